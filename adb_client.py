@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ADB原生协议客户端
+直接与adb服务端的TCP端口通信（host:transport、shell、exec、sync），
+不需要启动adb.exe进程，也可以在Linux上使用
+"""
+
+import socket
+import struct
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5037
+
+# 单条命令默认超时时间（秒）
+DEFAULT_TIMEOUT = 30.0
+
+# 每台设备最多保留的空闲sync连接数
+MAX_IDLE_CONNECTIONS = 4
+
+# shell v2 协议的数据包类型
+_SHELL_STDOUT = 1
+_SHELL_STDERR = 2
+_SHELL_EXIT = 3
+
+
+class AdbError(Exception):
+    """adb服务端返回FAIL或协议异常"""
+
+
+class AdbSyncFailure(AdbError):
+    """sync服务对请求返回FAIL（如文件不存在），重试也不会成功"""
+
+
+class AdbConnectError(ConnectionError):
+    """连接adb服务端或发送服务请求失败，命令尚未送达设备，可以换一种方式重新执行"""
+
+
+class AdbConnection:
+    """与adb服务端之间的一条TCP连接"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+
+    def settimeout(self, timeout: Optional[float]):
+        self.sock.settimeout(timeout)
+
+    def send_request(self, payload: str):
+        """发送一条host请求并检查OKAY/FAIL"""
+        self.write_request(payload)
+        self.read_status()
+
+    def write_request(self, payload: str):
+        """只发送请求，不读取响应"""
+        data = payload.encode("utf-8")
+        self.sock.sendall(b"%04x" % len(data) + data)
+
+    def read_status(self):
+        """读取OKAY/FAIL响应，FAIL时抛出AdbError"""
+        status = self.read_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(self.read_exact(4), 16)
+            raise AdbError(self.read_exact(length).decode("utf-8", errors="replace"))
+        raise AdbError(f"未知的adb响应: {status!r}")
+
+    def read_exact(self, size: int) -> bytes:
+        """读取指定长度的数据"""
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(min(size, 65536))
+            if not chunk:
+                raise AdbError("adb连接被关闭")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def read_until_close(self) -> bytes:
+        """读取到连接关闭为止"""
+        chunks = []
+        while True:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def read_length_prefixed(self) -> bytes:
+        """读取4位十六进制长度前缀的响应体"""
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AdbConnectionPool:
+    """按设备缓存可复用的连接（sync会话可以连续处理多次请求）"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 max_idle: int = MAX_IDLE_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self._idle: Dict[Tuple[Optional[str], str], List[AdbConnection]] = {}
+        self._lock = threading.Lock()
+
+    def connect(self, timeout: float = DEFAULT_TIMEOUT) -> AdbConnection:
+        """建立一条新的服务端连接"""
+        try:
+            return AdbConnection(self.host, self.port, timeout)
+        except OSError as e:
+            raise AdbConnectError(f"无法连接adb服务端: {e}") from e
+
+    def acquire(self, serial: Optional[str], service: str) -> Optional[AdbConnection]:
+        """取出一条空闲连接，没有则返回None"""
+        with self._lock:
+            idle = self._idle.get((serial, service))
+            if idle:
+                return idle.pop()
+        return None
+
+    def release(self, serial: Optional[str], service: str, conn: AdbConnection):
+        """归还连接，超过上限时直接关闭"""
+        with self._lock:
+            idle = self._idle.setdefault((serial, service), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle.clear()
+        for idle in pools:
+            for conn in idle:
+                conn.close()
+
+
+class AdbClient:
+    """adb服务端客户端"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.pool = AdbConnectionPool(host, port)
+
+    def _host_request(self, payload: str) -> bytes:
+        conn = self.pool.connect()
+        try:
+            conn.send_request(payload)
+            return conn.read_length_prefixed()
+        finally:
+            conn.close()
+
+    def server_version(self) -> int:
+        """
+        获取adb服务端版本，可用于检测服务端是否在运行
+
+        Returns:
+            int: 协议版本号
+        """
+        return int(self._host_request("host:version"), 16)
+
+    def devices(self) -> List[Tuple[str, str]]:
+        """
+        列出已连接的设备
+
+        Returns:
+            List[Tuple[str, str]]: (序列号, 状态) 列表
+        """
+        body = self._host_request("host:devices").decode("utf-8", errors="replace")
+        result = []
+        for line in body.splitlines():
+            parts = line.split("\t")
+            if len(parts) == 2:
+                result.append((parts[0], parts[1]))
+        return result
+
+    def device(self, serial: Optional[str] = None) -> "AdbDevice":
+        """获取设备对象，serial为None时使用唯一的已连接设备"""
+        return AdbDevice(self, serial)
+
+
+class AdbDevice:
+    """通过原生协议操作单台设备"""
+
+    def __init__(self, client: AdbClient, serial: Optional[str] = None):
+        self.client = client
+        self.serial = serial
+
+    def _open_transport(self, timeout: float) -> AdbConnection:
+        """建立连接并切换到本设备的传输通道"""
+        conn = self.client.pool.connect(timeout)
+        try:
+            if self.serial:
+                conn.send_request(f"host:transport:{self.serial}")
+            else:
+                conn.send_request("host:transport-any")
+        except OSError as e:
+            conn.close()
+            raise AdbConnectError(f"切换设备传输通道失败: {e}") from e
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _open_service(self, service: str, timeout: float) -> AdbConnection:
+        """
+        打开设备上的服务。服务请求写出之前的失败抛出AdbConnectError；
+        写出之后设备可能已经开始执行命令，此时的错误原样抛出，调用方不能重发
+        """
+        conn = self._open_transport(timeout)
+        try:
+            try:
+                conn.write_request(service)
+            except OSError as e:
+                raise AdbConnectError(f"发送服务请求失败: {e}") from e
+            conn.read_status()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def shell(self, command: str, check: bool = False, timeout: float = DEFAULT_TIMEOUT,
+              text: bool = True) -> subprocess.CompletedProcess:
+        """
+        执行shell命令（shell v2协议，可获得退出码，stderr合并到stdout）
+
+        Args:
+            command (str): 命令行
+            check (bool): 返回码非0时是否抛出CalledProcessError
+            timeout (float): 超时时间（秒）
+            text (bool): 是否将输出解码为字符串
+
+        Returns:
+            subprocess.CompletedProcess: 执行结果
+        """
+        try:
+            conn = self._open_service(f"shell,v2,raw:{command}", timeout)
+        except AdbError:
+            # 设备不支持shell v2时退回旧协议
+            return self._legacy_shell(command, check, timeout, text)
+
+        output = []
+        returncode = -1
+        try:
+            while True:
+                try:
+                    header = conn.read_exact(5)
+                except AdbError:
+                    break
+                packet_id, length = struct.unpack("<BI", header)
+                data = conn.read_exact(length)
+                if packet_id in (_SHELL_STDOUT, _SHELL_STDERR):
+                    output.append(data)
+                elif packet_id == _SHELL_EXIT:
+                    returncode = data[0] if data else 0
+                    break
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout)
+        finally:
+            conn.close()
+
+        return self._completed(command, b"".join(output), returncode, check, text)
+
+    def _legacy_shell(self, command: str, check: bool, timeout: float,
+                      text: bool) -> subprocess.CompletedProcess:
+        """旧版shell协议没有退出码，通过末尾的标记行取回"""
+        marker = b"__SIMHOSHINO_RC__:"
+        conn = self._open_service(
+            f"shell:{{ {command}\n}} 2>&1; printf '\\n{marker.decode()}%d\\n' $?", timeout
+        )
+        try:
+            raw = conn.read_until_close()
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout)
+        finally:
+            conn.close()
+
+        raw = raw.replace(b"\r\n", b"\n")
+        output, found, tail = raw.rpartition(b"\n" + marker)
+        if not found:
+            return self._completed(command, raw, -1, check, text)
+        return self._completed(command, output, int(tail.strip() or b"-1"), check, text)
+
+    @staticmethod
+    def _completed(command: str, stdout: bytes, returncode: int, check: bool,
+                   text: bool) -> subprocess.CompletedProcess:
+        """构造与subprocess.run一致的返回结果"""
+        if text:
+            stdout = stdout.decode("utf-8", errors="replace")
+        result = subprocess.CompletedProcess(command, returncode, stdout, "" if text else b"")
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, stdout, result.stderr)
+        return result
+
+    def exec_out(self, command: str, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+        """
+        以exec服务执行命令，返回未经终端处理的原始字节输出
+
+        Args:
+            command (str): 命令行
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            bytes: 标准输出
+        """
+        conn = self._open_service(f"exec:{command}", timeout)
+        try:
+            return conn.read_until_close()
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(command, timeout)
+        finally:
+            conn.close()
+
+    def open_stream(self, command: str, timeout: float = DEFAULT_TIMEOUT) -> AdbConnection:
+        """
+        启动一个持续输出的命令（如logcat），返回连接由调用方逐行读取并负责关闭
+
+        Args:
+            command (str): 命令行
+            timeout (float): 建立连接的超时时间（秒），连接建立后读取不超时
+
+        Returns:
+            AdbConnection: 命令输出所在的连接
+        """
+        conn = self._open_service(f"shell:{command}", timeout)
+        conn.settimeout(None)
+        return conn
+
+    def pull(self, remote_path: str, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+        """
+        通过sync协议读取设备上的文件内容
+
+        Args:
+            remote_path (str): 设备上的文件路径
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            bytes: 文件内容
+        """
+        conn = self.client.pool.acquire(self.serial, "sync")
+        if conn is not None:
+            # 连接池中的连接可能已被服务端关闭，失败时换一条新连接重试一次
+            try:
+                conn.settimeout(timeout)
+                return self._recv(conn, remote_path, timeout)
+            except AdbSyncFailure:
+                raise
+            except (AdbError, OSError):
+                pass
+        return self._recv(self._open_service("sync:", timeout), remote_path, timeout)
+
+    def _recv(self, conn: AdbConnection, remote_path: str, timeout: float) -> bytes:
+        """在sync连接上读取一个文件，成功后归还连接，出错时关闭连接"""
+        path = remote_path.encode("utf-8")
+        chunks = []
+        try:
+            conn.sock.sendall(b"RECV" + struct.pack("<I", len(path)) + path)
+            while True:
+                tag, length = struct.unpack("<4sI", conn.read_exact(8))
+                if tag == b"DATA":
+                    chunks.append(conn.read_exact(length))
+                elif tag == b"DONE":
+                    break
+                elif tag == b"FAIL":
+                    # 服务端在FAIL之后会关闭sync会话，连接不能再复用
+                    failure = conn.read_exact(length).decode("utf-8", errors="replace")
+                    raise AdbSyncFailure(f"拉取 {remote_path} 失败: {failure}")
+                else:
+                    raise AdbError(f"未知的sync响应: {tag!r}")
+        except socket.timeout:
+            conn.close()
+            raise subprocess.TimeoutExpired(f"pull {remote_path}", timeout)
+        except Exception:
+            conn.close()
+            raise
+
+        self.client.pool.release(self.serial, "sync", conn)
+        return b"".join(chunks)
+
+
+_client: Optional[AdbClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> AdbClient:
+    """获取进程内共享的客户端（所有请求共用同一个连接池）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AdbClient()
+        return _client
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ADB常驻Shell会话
+每个设备只维护一个长期存活的 `adb shell` 管道，命令之间用哨兵行分隔输出，
+避免每条命令都重新启动adb进程并与adb服务端握手。
+adb服务端可达时优先通过原生协议客户端（adb_client）执行，完全不启动adb进程
+"""
+
+import atexit
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Union
+
+from adb_client import AdbConnectError, get_client
+
+# 单条命令默认超时时间（秒）
+DEFAULT_TIMEOUT = 30.0
+
+# 执行后端: auto（服务端可达时走原生协议，否则走shell管道）、native、session
+ADB_BACKEND = os.environ.get("SIMHOSHINO_ADB_BACKEND", "auto")
+
+# 原生协议连接失败后，在这段时间内直接使用shell管道（秒）
+NATIVE_RETRY_INTERVAL = 10.0
+
+Command = Union[str, Sequence[str]]
+
+
+def get_adb_path() -> str:
+    """
+    获取adb可执行文件路径
+
+    Returns:
+        str: adb路径
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    bundled = os.path.join(current_dir, "adb.exe")
+    if os.name == "nt":
+        return bundled
+    return shutil.which("adb") or "adb"
+
+
+def _join_command(command: Command) -> str:
+    """将参数列表拼接为shell命令行"""
+    if isinstance(command, str):
+        return command
+    return " ".join(shlex.quote(str(arg)) for arg in command)
+
+
+class AdbShellSession:
+    """单设备常驻ADB Shell会话"""
+
+    def __init__(self, serial: Optional[str] = None, adb_path: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        """
+        初始化会话（进程在第一次执行命令时才启动）
+
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+            adb_path (Optional[str]): adb路径
+            timeout (float): 单条命令默认超时时间（秒）
+        """
+        self.serial = serial
+        self.adb_path = adb_path or get_adb_path()
+        self.timeout = timeout
+        self.reconnect_count = 0
+        self._started = False
+        self._proc: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _adb_args(self) -> List[str]:
+        """构造启动shell的adb参数"""
+        args = [self.adb_path]
+        if self.serial:
+            args += ["-s", self.serial]
+        return args + ["shell"]
+
+    def _start(self):
+        """启动adb shell进程和输出读取线程"""
+        self._lines = queue.Queue()
+        self._proc = subprocess.Popen(
+            self._adb_args(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        reader = threading.Thread(
+            target=self._read_output,
+            args=(self._proc, self._lines),
+            daemon=True
+        )
+        reader.start()
+
+    @staticmethod
+    def _read_output(proc: subprocess.Popen, lines: "queue.Queue[Optional[bytes]]"):
+        """持续读取shell输出，进程退出时放入None"""
+        try:
+            for line in iter(proc.stdout.readline, b""):
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    def _is_alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _kill(self):
+        """结束当前shell进程"""
+        if self._proc is None:
+            return
+        try:
+            self._proc.kill()
+            self._proc.wait(timeout=5)
+        except Exception:
+            pass
+        self._proc = None
+
+    def _ensure_started(self):
+        """确保shell进程存活，断开过的会话会被重新建立"""
+        if self._is_alive():
+            return
+        if self._started:
+            self.reconnect_count += 1
+        self._kill()
+        self._start()
+        self._started = True
+
+    def reconnect(self):
+        """丢弃当前管道并重新建立会话"""
+        with self._lock:
+            self._kill()
+            self._ensure_started()
+
+    def _write(self, script: str):
+        """把脚本写入当前管道"""
+        self._proc.stdin.write(script.encode("utf-8"))
+        self._proc.stdin.flush()
+
+    def _read_result(self, script: str, token: bytes, timeout: float) -> subprocess.CompletedProcess:
+        """读取脚本输出到哨兵行为止"""
+        chunks = []
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except queue.Empty:
+                self._kill()
+                raise subprocess.TimeoutExpired(script, timeout)
+            if line is None:
+                self._kill()
+                raise BrokenPipeError("adb shell 会话已断开")
+            if line.startswith(token):
+                returncode = int(line[len(token):].strip(b"\r\n") or b"-1")
+                break
+            chunks.append(line)
+
+        output = b"".join(chunks)
+        # 去掉哨兵前额外插入的换行
+        if output.endswith(b"\r\n"):
+            output = output[:-2]
+        elif output.endswith(b"\n"):
+            output = output[:-1]
+        return subprocess.CompletedProcess(script, returncode, output, b"")
+
+    def run(self, command: Command, check: bool = False, timeout: Optional[float] = None,
+            text: bool = True) -> subprocess.CompletedProcess:
+        """
+        在常驻shell中执行一条命令
+
+        Args:
+            command (Command): 命令字符串或参数列表
+            check (bool): 返回码非0时是否抛出CalledProcessError
+            timeout (Optional[float]): 超时时间（秒），None使用默认值
+            text (bool): 是否将输出解码为字符串
+
+        Returns:
+            subprocess.CompletedProcess: 执行结果（stderr已合并到stdout）
+        """
+        command_line = _join_command(command)
+        token_text = f"__SIMHOSHINO_END_{uuid.uuid4().hex}__:"
+        script = (
+            f"{{ {command_line}\n}} </dev/null 2>&1; "
+            f"printf '\\n{token_text}%d\\n' $?\n"
+        )
+        token = token_text.encode("ascii")
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._lock:
+            # 写入失败说明会话在写入前就已断开，脚本没有送达设备，重连后重试一次；
+            # 写入成功后脚本可能已经执行，读取输出时出错不能重发
+            for attempt in range(2):
+                self._ensure_started()
+                try:
+                    self._write(script)
+                    break
+                except OSError:
+                    self._kill()
+                    if attempt > 0:
+                        raise
+            result = self._read_result(script, token, timeout)
+
+        result.args = command
+        if text:
+            result.stdout = result.stdout.decode("utf-8", errors="replace")
+            result.stderr = ""
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, command, result.stdout, result.stderr
+            )
+        return result
+
+    def close(self):
+        """关闭会话"""
+        with self._lock:
+            if self._proc is not None and self._is_alive():
+                try:
+                    self._proc.stdin.write(b"exit\n")
+                    self._proc.stdin.flush()
+                    self._proc.wait(timeout=2)
+                except Exception:
+                    pass
+            self._kill()
+
+
+_sessions: Dict[Optional[str], AdbShellSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(serial: Optional[str] = None) -> AdbShellSession:
+    """
+    获取指定设备的常驻会话（不存在时创建）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+
+    Returns:
+        AdbShellSession: 会话对象
+    """
+    with _sessions_lock:
+        session = _sessions.get(serial)
+        if session is None:
+            session = AdbShellSession(serial)
+            _sessions[serial] = session
+        return session
+
+
+_native_unavailable_until = 0.0
+# 每台设备原生协议连接失败的次数
+_native_failures: Dict[Optional[str], int] = {}
+
+
+def connection_generation(serial: Optional[str] = None) -> int:
+    """
+    设备连接的代数，该设备每次原生协议连接失败或常驻会话重连后增加，
+    用于判断依赖设备状态的缓存是否需要失效（其他设备断线不影响）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+
+    Returns:
+        int: 连接代数
+    """
+    with _sessions_lock:
+        session = _sessions.get(serial)
+        failures = _native_failures.get(serial, 0)
+    return failures + (session.reconnect_count if session is not None else 0)
+
+
+def _use_native() -> bool:
+    """判断当前是否应该使用原生协议客户端"""
+    if ADB_BACKEND == "session":
+        return False
+    if ADB_BACKEND == "native":
+        return True
+    return time.monotonic() >= _native_unavailable_until
+
+
+def _mark_native_unavailable(serial: Optional[str]):
+    global _native_unavailable_until
+    _native_unavailable_until = time.monotonic() + NATIVE_RETRY_INTERVAL
+    with _sessions_lock:
+        _native_failures[serial] = _native_failures.get(serial, 0) + 1
+
+
+def run_shell(command: Command, serial: Optional[str] = None, check: bool = False,
+              timeout: Optional[float] = None, text: bool = True) -> subprocess.CompletedProcess:
+    """
+    便捷函数：执行shell命令（优先原生协议，否则使用设备的常驻会话）
+
+    Args:
+        command (Command): 命令字符串或参数列表
+        serial (Optional[str]): 设备序列号
+        check (bool): 返回码非0时是否抛出异常
+        timeout (Optional[float]): 超时时间（秒）
+        text (bool): 是否将输出解码为字符串
+
+    Returns:
+        subprocess.CompletedProcess: 执行结果
+    """
+    if _use_native():
+        try:
+            result = get_client().device(serial).shell(
+                _join_command(command),
+                check=check,
+                timeout=DEFAULT_TIMEOUT if timeout is None else timeout,
+                text=text
+            )
+            result.args = command
+            return result
+        except AdbConnectError:
+            # 只有命令还没送达设备时才换用shell管道，之后的错误重发可能导致副作用重复执行
+            if ADB_BACKEND == "native":
+                raise
+            _mark_native_unavailable(serial)
+    return get_session(serial).run(command, check=check, timeout=timeout, text=text)
+
+
+def exec_out(command: Command, serial: Optional[str] = None,
+             timeout: Optional[float] = None) -> bytes:
+    """
+    执行命令并返回原始字节输出（等价于 `adb exec-out`，不经过终端转换）
+
+    Args:
+        command (Command): 命令字符串或参数列表
+        serial (Optional[str]): 设备序列号
+        timeout (Optional[float]): 超时时间（秒）
+
+    Returns:
+        bytes: 命令输出
+    """
+    if _use_native():
+        try:
+            return get_client().device(serial).exec_out(
+                _join_command(command),
+                timeout=DEFAULT_TIMEOUT if timeout is None else timeout
+            )
+        except AdbConnectError:
+            if ADB_BACKEND == "native":
+                raise
+            _mark_native_unavailable(serial)
+    return run_shell(command, serial=serial, timeout=timeout, text=False).stdout
+
+
+def pull_file(remote_path: str, serial: Optional[str] = None,
+              timeout: Optional[float] = None) -> bytes:
+    """
+    读取设备上的文件内容（原生协议走sync服务，否则通过常驻会话cat）
+
+    Args:
+        remote_path (str): 设备上的文件路径
+        serial (Optional[str]): 设备序列号
+        timeout (Optional[float]): 超时时间（秒）
+
+    Returns:
+        bytes: 文件内容
+    """
+    if _use_native():
+        try:
+            return get_client().device(serial).pull(
+                remote_path,
+                timeout=DEFAULT_TIMEOUT if timeout is None else timeout
+            )
+        except AdbConnectError:
+            if ADB_BACKEND == "native":
+                raise
+            _mark_native_unavailable(serial)
+    return run_shell(["cat", remote_path], serial=serial, check=True,
+                     timeout=timeout, text=False).stdout
+
+
+@atexit.register
+def close_all_sessions():
+    """关闭所有会话"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+    get_client().pool.close_all()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多智能体路由
+请求的 model 字段即智能体名称：已配置的智能体和设备上正在显示的智能体都作为模型列出，
+调度时优先选择已经停留在该智能体聊天界面的设备（粘性路由，省去切换界面的开销），
+没有这样的设备时在分配到的设备上返回会话列表并点开该智能体
+"""
+
+import os
+import time
+from typing import Callable, List, Optional
+
+from adb_session import run_shell
+from element_index import center, get_element_index
+from ui_snapshot import UISnapshot
+
+# 默认模型：不指定智能体，使用当前界面上的智能体
+DEFAULT_MODEL = "SimHoshino-agent"
+
+# 配置的智能体名称（逗号分隔），会出现在模型列表中
+AGENTS_ENV = "SIMHOSHINO_AGENTS"
+
+# 切换界面时最多按返回键的次数
+NAV_MAX_BACK = 3
+
+# 每次点击或返回后等待界面稳定的时间（秒）
+NAV_SETTLE = 0.8
+
+# Android 返回键
+KEYCODE_BACK = "4"
+
+
+def configured_agents() -> List[str]:
+    """
+    环境变量中配置的智能体名称
+
+    Returns:
+        List[str]: 智能体名称列表
+    """
+    configured = os.environ.get(AGENTS_ENV, "")
+    return [name.strip() for name in configured.split(",") if name.strip()]
+
+
+def known_agents(visible: List[str]) -> List[str]:
+    """
+    可以路由到的智能体：已配置的智能体加上设备上出现过的智能体
+
+    Args:
+        visible (List[str]): 设备上出现过的智能体名称
+
+    Returns:
+        List[str]: 去重后的智能体名称列表
+    """
+    names = []
+    for name in configured_agents() + visible:
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def resolve_agent(model: Optional[str], agents: List[str]) -> Optional[str]:
+    """
+    把请求的 model 字段解析为智能体名称
+
+    只有已知的智能体才会触发切换界面；其他模型名称（例如客户端默认发送的 gpt-3.5-turbo）
+    按默认模型处理，使用当前界面上的智能体
+
+    Args:
+        model (Optional[str]): 请求中的模型名称
+        agents (List[str]): 已知的智能体名称
+
+    Returns:
+        Optional[str]: 智能体名称，默认模型或未知名称返回None（不切换智能体）
+    """
+    if not model or model == DEFAULT_MODEL:
+        return None
+    name = model.strip()
+    return name if name in agents else None
+
+
+def open_agent_chat(serial: Optional[str], agent_name: str,
+                    capture: Callable[[], Optional[UISnapshot]]) -> Optional[UISnapshot]:
+    """
+    在设备上打开智能体的聊天界面：当前界面上有该智能体的条目时点击它，否则按返回键后再找
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        agent_name (str): 智能体名称
+        capture (Callable[[], Optional[UISnapshot]]): 捕获最新快照的函数
+
+    Returns:
+        Optional[UISnapshot]: 已显示该智能体聊天界面的快照，切换失败返回None
+    """
+    backs = 0
+    tapped = False
+    while True:
+        snapshot = capture()
+        if snapshot is None:
+            return None
+        if agent_name in snapshot.agent_index():
+            return snapshot
+
+        entries = [] if tapped else get_element_index(serial, snapshot).find(text=agent_name)
+        if entries:
+            x, y = center(entries[0])
+            run_shell(["input", "tap", str(x), str(y)], serial=serial, check=True)
+            tapped = True
+        elif backs < NAV_MAX_BACK:
+            run_shell(["input", "keyevent", KEYCODE_BACK], serial=serial, check=True)
+            backs += 1
+            tapped = False
+        else:
+            return None
+        time.sleep(NAV_SETTLE)
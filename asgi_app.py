@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步服务入口（ASGI）
+聊天接口以协程实现：请求在事件循环上等待设备工作线程的通知，不再各自占用一个线程，
+大量等待中的客户端开销很小；总时限和客户端断开都会取消本轮对话，设备立即处理下一个请求。
+其他路由原样转发给Flask应用（兼容层）
+
+运行: python asgi_app.py（需要安装 uvicorn），或 uvicorn asgi_app:app
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from main import (
+    app as flask_app,
+    api_server,
+    get_device_pool,
+    load_or_create_api_key,
+    logger,
+    print_banner,
+    print_startup_info
+)
+from agent_router import DEFAULT_MODEL, known_agents, resolve_agent
+from chat_turn import ChatTurn
+from reply_detector import REPLY_DEADLINE
+from work_queue import QUEUE_WAIT_TIMEOUT, QueueFullError, QueueTimeoutError, WorkItem
+
+# 一轮对话（排队、发送和等待回复）的总时限（秒），超时后取消并返回504
+TURN_TIMEOUT = QUEUE_WAIT_TIMEOUT + REPLY_DEADLINE + 30.0
+
+# 兼容层执行Flask路由的线程数
+WSGI_THREADS = 8
+
+# 监听地址和端口
+ASGI_HOST = os.environ.get("SIMHOSHINO_HOST", "0.0.0.0")
+ASGI_PORT = int(os.environ.get("SIMHOSHINO_PORT", "5000"))
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi-compat")
+
+
+class TurnChannel:
+    """把设备工作线程上的对话进展转发到事件循环"""
+
+    def __init__(self, turn: ChatTurn):
+        """
+        Args:
+            turn (ChatTurn): 尚未提交的对话任务
+        """
+        self.loop = asyncio.get_running_loop()
+        self.started = asyncio.Event()
+        self.sent = asyncio.Event()
+        self.done = asyncio.Event()
+        self.updates: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        turn.add_listener(self._from_worker)
+
+    def attach(self, item: WorkItem):
+        """关联队列任务：任务没有执行（排队超时或被取消）时也能结束等待"""
+        item.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self._finish))
+
+    def _from_worker(self, kind: str, text: Optional[str]):
+        self.loop.call_soon_threadsafe(self._dispatch, kind, text)
+
+    def _dispatch(self, kind: str, text: Optional[str]):
+        if kind == "started":
+            self.started.set()
+        elif kind == "sent":
+            self.sent.set()
+        elif kind == "update":
+            self.updates.put_nowait(text)
+        elif kind == "end":
+            self.updates.put_nowait(None)
+
+    def _finish(self):
+        self.started.set()
+        self.sent.set()
+        self.done.set()
+        self.updates.put_nowait(None)
+
+
+async def wait_or_abort(awaitable: Awaitable, disconnected: "asyncio.Future", timeout: float) -> bool:
+    """
+    等待协程完成，客户端断开或超时时放弃
+
+    Args:
+        awaitable (Awaitable): 要等待的协程
+        disconnected (asyncio.Future): 客户端断开时完成的任务
+        timeout (float): 最长等待时间（秒）
+
+    Returns:
+        bool: 是否正常完成
+    """
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait({task, disconnected}, timeout=max(timeout, 0),
+                                 return_when=asyncio.FIRST_COMPLETED)
+    if task in done:
+        return True
+    task.cancel()
+    return False
+
+
+async def read_body(receive) -> bytes:
+    """读取完整的请求体"""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def wait_for_disconnect(receive):
+    """请求体读完之后，下一条消息只会是客户端断开"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def send_json(send, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+    """发送JSON响应"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    raw_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+        (b"access-control-allow-origin", b"*")
+    ]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), str(value).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_error(send, status: int, message: str, error_type: str,
+                     retry_after: Optional[int] = None):
+    """发送OpenAI格式的错误响应"""
+    error = {"message": message, "type": error_type}
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    await send_json(send, status, {"error": error}, headers)
+
+
+def stream_chunk(chat_id: str, timestamp: int, model: str, delta: dict,
+                 finish_reason: Optional[str] = None) -> bytes:
+    """一个 chat.completion.chunk 事件"""
+    chunk = {
+        "id": chat_id,
+        "object": "chat.completion.chunk",
+        "created": timestamp,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+
+def reply_message(result: Optional[dict]) -> str:
+    """非流式响应的内容：智能体的回复，没有回复时为提示文本"""
+    if not result or not result["agent_name"]:
+        return "未检测到智能体回复"
+    if result["reply"]:
+        return result["reply"]
+    return f"智能体 {result['agent_name']} 暂未回复，请稍后重试"
+
+
+async def chat_completions(scope, body: bytes, receive, send):
+    """OpenAI兼容的聊天完成API（协程版本）"""
+    request_id = uuid.uuid4().hex[:8]
+    client = scope.get("client")
+    logger.info(f"[{request_id}] 新的聊天请求(异步) - 客户端IP: {client[0] if client else None}")
+
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "messages" not in data:
+        await send_error(send, 400, "Missing required field: messages", "invalid_request_error")
+        return
+
+    model = data.get("model", DEFAULT_MODEL)
+    stream = data.get("stream", False)
+    user_message = None
+    messages = data["messages"]
+    # 格式不对的消息（不是列表或其中的元素不是对象）按没有用户消息处理，与Flask版本返回相同的400
+    for msg in reversed(messages if isinstance(messages, list) else []):
+        if isinstance(msg, dict) and msg.get("role") == "user":
+            user_message = msg.get("content", "")
+            break
+    if not user_message:
+        await send_error(send, 400, "No user message found", "invalid_request_error")
+        return
+
+    # 只有已知的智能体才会切换界面，其他模型名称按默认模型处理
+    device_pool = get_device_pool()
+    agent = resolve_agent(model, known_agents(device_pool.agents()))
+
+    logger.info(f"[{request_id}] 请求参数 - 模型: {model}, 流式: {stream}, 收到用户消息: {user_message}")
+
+    turn = ChatTurn(user_message, stream, agent)
+    channel = TurnChannel(turn)
+    try:
+        slot, item = device_pool.submit(turn, agent)
+    except QueueFullError as e:
+        logger.warning(f"[{request_id}] 所有设备队列已满，建议 {e.retry_after} 秒后重试")
+        await send_error(send, 429, "All device queues are full, please retry later",
+                         "rate_limit_exceeded", e.retry_after)
+        return
+    channel.attach(item)
+    logger.info(f"[{request_id}] 分配设备: {slot.name}，队列中还有 {slot.queue.pending} 个请求")
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    deadline = time.monotonic() + TURN_TIMEOUT
+    try:
+        # 排队最多等待 QUEUE_WAIT_TIMEOUT 秒；超时或客户端断开时从队列中取消，消息不会再发到设备上
+        if not await wait_or_abort(channel.started.wait(), disconnected, QUEUE_WAIT_TIMEOUT) and item.cancel():
+            turn.cancel()
+            if disconnected.done():
+                logger.info(f"[{request_id}] 客户端在排队时断开，已取消")
+            else:
+                logger.warning(f"[{request_id}] 排队超过 {QUEUE_WAIT_TIMEOUT:.0f} 秒，已取消")
+                await send_error(send, 503, "Timed out waiting for a device, please retry later",
+                                 "server_busy", slot.queue.retry_after())
+            return
+
+        waiting = channel.sent.wait() if stream else channel.done.wait()
+        if not await wait_or_abort(waiting, disconnected, deadline - time.monotonic()):
+            turn.cancel()
+            item.cancel()
+            if not disconnected.done():
+                logger.warning(f"[{request_id}] 超过 {TURN_TIMEOUT:.0f} 秒仍未完成，已取消")
+                await send_error(send, 504, "Timed out waiting for the agent", "timeout")
+            else:
+                logger.info(f"[{request_id}] 客户端已断开，取消本轮对话")
+            return
+        if stream and not turn.send_ok:
+            # 发送失败时 sent 先于错误信息到达，等本轮结束后再读取失败原因
+            await wait_or_abort(channel.done.wait(), disconnected, deadline - time.monotonic())
+
+        if isinstance(item.error, QueueTimeoutError):
+            logger.warning(f"[{request_id}] 排队超时: {item.error}")
+            await send_error(send, 503, "Timed out waiting for a device, please retry later",
+                             "server_busy", item.error.retry_after)
+            return
+        if isinstance(item.error, QueueFullError):
+            # 多进程模式下工作进程自己的队列也可能拒绝任务
+            logger.warning(f"[{request_id}] 设备 {slot.name} 的队列已满")
+            await send_error(send, 429, "All device queues are full, please retry later",
+                             "rate_limit_exceeded", item.error.retry_after)
+            return
+        if item.error is not None:
+            logger.error(f"[{request_id}] API异常: {item.error}")
+            await send_error(send, 500, f"Internal server error: {item.error}", "internal_server_error")
+            return
+        if not turn.send_ok:
+            error_msg = turn.error or "Failed to send message to agent"
+            logger.error(f"[{request_id}] 消息发送失败: {error_msg}")
+            await send_error(send, 500, error_msg, "internal_server_error")
+            return
+
+        if not stream:
+            logger.info(f"[{request_id}] 回复检测结束，返回标准响应")
+            await send_json(send, 200, api_server.format_openai_response(reply_message(turn.result), model))
+            return
+
+        await stream_reply(request_id, turn, channel, model, send, disconnected, deadline)
+    finally:
+        disconnected.cancel()
+
+
+async def stream_reply(request_id: str, turn: ChatTurn, channel: TurnChannel, model: str,
+                       send, disconnected: "asyncio.Future", deadline: float):
+    """把回复增量以SSE推送，客户端断开或超时时取消本轮对话"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            (b"access-control-allow-origin", b"*")
+        ]
+    })
+
+    chat_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+    timestamp = int(time.time())
+    body = stream_chunk(chat_id, timestamp, model, {"role": "assistant"})
+    await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    # 只发送比上次多出来的部分
+    emitted = ""
+    while True:
+        update = asyncio.ensure_future(channel.updates.get())
+        if not await wait_or_abort(update, disconnected, deadline - time.monotonic()):
+            turn.cancel()
+            if disconnected.done():
+                logger.info(f"[{request_id}] 客户端已断开，停止推送")
+                return
+            logger.warning(f"[{request_id}] 流式响应超时，已取消")
+            break
+        text = update.result()
+        if text is None:
+            break
+        if not text.startswith(emitted):
+            # 界面上的文本被改写，已发送的内容无法撤回，跳过这次变化
+            continue
+        delta = text[len(emitted):]
+        if delta:
+            emitted = text
+            body = stream_chunk(chat_id, timestamp, model, {"content": delta})
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    if not emitted:
+        agent_name = turn.state.get("agent_name")
+        message = f"智能体 {agent_name} 暂未回复，请稍后重试" if agent_name else "未检测到智能体回复"
+        body = stream_chunk(chat_id, timestamp, model, {"content": message})
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+
+    body = stream_chunk(chat_id, timestamp, model, {}, "stop") + b"data: [DONE]\n\n"
+    await send({"type": "http.response.body", "body": body})
+    logger.info(
+        f"[{request_id}] 流式响应结束 - 智能体: {turn.state.get('agent_name')}, "
+        f"完成: {turn.state.get('completed')}"
+    )
+
+
+def call_flask(scope, body: bytes) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """在线程中以WSGI方式调用Flask应用，返回 (状态码, 响应头, 响应体)"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        content = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], content
+
+
+async def forward_to_flask(scope, body: bytes, send):
+    """兼容层：其他路由交给Flask处理"""
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(_wsgi_executor, call_flask, scope, body)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def app(scope, receive, send):
+    """ASGI应用"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # 启动时初始化设备池，冷启动耗时不落在第一个请求上
+                await asyncio.get_running_loop().run_in_executor(None, get_device_pool)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    if scope["method"] == "POST" and scope["path"] == "/v1/chat/completions":
+        await chat_completions(scope, body, receive, send)
+    else:
+        await forward_to_flask(scope, body, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ 异步模式需要安装 uvicorn: pip install uvicorn")
+        sys.exit(1)
+
+    print_banner()
+    api_key = load_or_create_api_key()
+    print("⚡ 异步模式")
+    print_startup_info(api_key, ASGI_HOST, ASGI_PORT)
+    uvicorn.run(app, host=ASGI_HOST, port=ASGI_PORT)
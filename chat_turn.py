@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单轮对话任务
+检测基线、发送消息和等待回复都在设备的工作线程上执行，
+HTTP请求线程只通过事件和队列获取发送结果与回复增量
+"""
+
+import queue
+import threading
+from typing import Callable, Iterator, List, Optional
+
+from server import MessageServer
+
+
+class ChatTurn:
+    """提交到设备工作队列的一轮对话"""
+
+    def __init__(self, user_message: str, stream: bool = False, agent: Optional[str] = None):
+        """
+        Args:
+            user_message (str): 要发送的用户消息
+            stream (bool): 是否以增量方式产出回复
+            agent (Optional[str]): 目标智能体，None时使用当前界面上的智能体
+        """
+        self.user_message = user_message
+        self.stream = stream
+        self.agent = agent
+        self.error: Optional[str] = None
+        self.turn_context: Optional[dict] = None
+        self.send_ok = False
+        self.result: Optional[dict] = None
+        self.state: dict = {}
+        self.sent = threading.Event()
+        self.cancelled = threading.Event()
+        self._updates: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._listeners: List[Callable[[str, Optional[str]], None]] = []
+
+    def add_listener(self, listener: Callable[[str, Optional[str]], None]):
+        """
+        订阅本轮对话的进展（需在提交到队列之前调用；在设备工作线程上回调）
+
+        Args:
+            listener (Callable[[str, Optional[str]], None]): 回调函数，参数为事件类型和文本：
+                ("started", None) 离开队列开始执行、("sent", None) 消息已发出或发送失败、
+                ("update", 完整回复) 回复变化、("end", None) 本轮结束
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, kind: str, text: Optional[str] = None):
+        for listener in self._listeners:
+            try:
+                listener(kind, text)
+            except Exception as e:
+                print(f"⚠️  对话进展回调异常: {e}")
+
+    def _mark_sent(self):
+        if not self.sent.is_set():
+            self.sent.set()
+            self._notify("sent")
+
+    def __call__(self, server: MessageServer) -> Optional[dict]:
+        """
+        在设备工作线程上执行本轮对话
+
+        Args:
+            server (MessageServer): 设备的消息服务器
+
+        Returns:
+            Optional[dict]: 非流式时为回复检测结果，流式时为流状态，发送失败为None
+        """
+        self._notify("started")
+        try:
+            if self.cancelled.is_set():
+                # 排队期间已被取消（客户端放弃等待），不再发送消息
+                self.error = "Turn cancelled before it started"
+                return None
+            if self.agent is not None and not server.ensure_agent(self.agent):
+                self.error = f"Failed to open chat with agent {self.agent}"
+                return None
+
+            # 发送前记录智能体和它的最后一条消息，作为判断新回复的基线
+            self.turn_context = server.detect_agent(agent_name=self.agent)
+            self.send_ok = server.send_message_to_chat(self.user_message)
+            self._mark_sent()
+            if not self.send_ok:
+                return None
+
+            agent_name = self.turn_context["agent_name"]
+            baseline = self.turn_context["baseline"]
+            if self.stream:
+                for text in server.stream_agent_reply(agent_name, baseline, self.user_message,
+                                                      self.state, cancelled=self.cancelled):
+                    self._updates.put(text)
+                    self._notify("update", text)
+                return self.state
+
+            self.result = server.wait_for_agent_reply(agent_name, baseline, self.user_message,
+                                                      cancelled=self.cancelled)
+            return self.result
+        finally:
+            self._mark_sent()
+            self._updates.put(None)
+            self._notify("end")
+
+    def iter_updates(self) -> Iterator[str]:
+        """逐个取出工作线程产出的完整回复文本，直到本轮对话结束"""
+        while True:
+            text = self._updates.get()
+            if text is None:
+                return
+            yield text
+
+    def cancel(self):
+        """停止等待回复（例如客户端已断开）"""
+        self.cancelled.set()
+        self._notify("cancel")
+
+    def to_request(self) -> dict:
+        """序列化为发给设备工作进程的请求"""
+        return {"message": self.user_message, "stream": self.stream, "agent": self.agent}
+
+    @classmethod
+    def from_request(cls, request: dict) -> "ChatTurn":
+        """在设备工作进程中按请求重建对话任务"""
+        return cls(request["message"], request.get("stream", False), request.get("agent"))
+
+    def outcome(self) -> dict:
+        """本轮对话的结果（由工作进程发回前端进程）"""
+        return {
+            "send_ok": self.send_ok,
+            "error": self.error,
+            "turn_context": self.turn_context,
+            "result": self.result,
+            "state": self.state
+        }
+
+    def apply_remote(self, kind: str, payload: dict):
+        """
+        在前端进程中重放工作进程上报的进展
+
+        Args:
+            kind (str): 事件类型（started / sent / update / end）
+            payload (dict): 事件内容
+        """
+        if kind == "started":
+            self._notify("started")
+        elif kind == "sent":
+            self.send_ok = payload.get("send_ok", False)
+            self.turn_context = payload.get("turn_context")
+            self._mark_sent()
+        elif kind == "update":
+            self._updates.put(payload["text"])
+            self._notify("update", payload["text"])
+        elif kind == "end":
+            for name, value in payload.items():
+                if name in ("send_ok", "error", "turn_context", "result"):
+                    setattr(self, name, value)
+            self.state.update(payload.get("state") or {})
+            self._mark_sent()
+            self._updates.put(None)
+            self._notify("end")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话增量识别
+为每台设备维护当前可见对话的消息气泡列表（带稳定的键），发送消息时记下已有的气泡，
+之后的快照只与它比较：从底部向上找到第一个已知气泡为止，开销只与新消息数量有关，
+之前的旧回复永远不会被当成新回复返回
+"""
+
+import hashlib
+import threading
+from typing import Dict, List, Optional, Set
+
+from ui_snapshot import UISnapshot
+
+
+def bubble_key(resource_id: str, previous: str, text: str) -> str:
+    """
+    气泡的稳定键：由控件id、文本和上一条文本决定，滚动后位置变化不影响键
+
+    Args:
+        resource_id (str): 控件resource-id
+        previous (str): 上一条文本
+        text (str): 气泡文本
+
+    Returns:
+        str: 键
+    """
+    return hashlib.md5(f"{resource_id}\x00{previous}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def extract_bubbles(snapshot: UISnapshot) -> List[Dict]:
+    """
+    按显示顺序提取对话区域的文本气泡（到输入框为止）
+
+    Args:
+        snapshot (UISnapshot): UI快照
+
+    Returns:
+        List[Dict]: 气泡列表，每项包含 key、text、resource_id、bounds
+    """
+    bubbles = []
+    for node in snapshot.nodes:
+        if node["class"].endswith("EditText"):
+            break
+        if not node["text"]:
+            continue
+        bubbles.append({
+            "text": node["text"],
+            "resource_id": node["resource_id"],
+            "bounds": node["bounds"]
+        })
+    return rekey(bubbles)
+
+
+def rekey(bubbles: List[Dict]) -> List[Dict]:
+    """
+    按顺序重新计算气泡的键（拼接多页内容后调用）
+
+    Args:
+        bubbles (List[Dict]): 气泡列表
+
+    Returns:
+        List[Dict]: 同一个列表
+    """
+    previous = ""
+    for bubble in bubbles:
+        bubble["key"] = bubble_key(bubble["resource_id"], previous, bubble["text"])
+        previous = bubble["text"]
+    return bubbles
+
+
+class ConversationModel:
+    """单台设备的可见对话模型"""
+
+    def __init__(self):
+        self.bubbles: List[Dict] = []
+        self.sent_text: Optional[str] = None
+        self.in_turn = False
+        self._known: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def begin_turn(self, snapshot: Optional[UISnapshot], sent_text: str) -> bool:
+        """
+        发送前记录当前可见的气泡，作为本轮对话的比较基准
+
+        Args:
+            snapshot (Optional[UISnapshot]): 发送前的快照
+            sent_text (str): 本次发送的消息内容
+
+        Returns:
+            bool: 是否成功建立基准（快照为None时本轮不使用增量识别）
+        """
+        with self._lock:
+            if snapshot is None:
+                self.in_turn = False
+                return False
+            self.bubbles = extract_bubbles(snapshot)
+            self._known = {bubble["key"] for bubble in self.bubbles}
+            self.sent_text = sent_text.strip()
+            self.in_turn = True
+            return True
+
+    def end_turn(self):
+        """本轮对话结束"""
+        with self._lock:
+            self.in_turn = False
+
+    def new_bubbles(self, bubbles: List[Dict]) -> List[Dict]:
+        """
+        发送之后新出现的气泡（从底部向上扫描到第一个已知气泡为止）
+
+        Args:
+            bubbles (List[Dict]): 发送后的气泡列表（单个快照或拼接后的多页内容）
+
+        Returns:
+            List[Dict]: 新气泡（显示顺序）
+        """
+        with self._lock:
+            known = self._known
+        new = []
+        for bubble in reversed(bubbles):
+            if bubble["key"] in known:
+                break
+            new.append(bubble)
+        new.reverse()
+        return new
+
+    def reply(self, snapshot: UISnapshot) -> Optional[str]:
+        """
+        本轮对话中智能体的回复：我们发送的消息之后出现的新气泡
+
+        Args:
+            snapshot (UISnapshot): 发送后的快照
+
+        Returns:
+            Optional[str]: 回复内容（多个气泡用换行连接），还没有回复时返回None
+        """
+        return self.reply_from(extract_bubbles(snapshot))
+
+    def reply_from(self, bubbles: List[Dict]) -> Optional[str]:
+        """
+        从气泡列表中取出本轮对话的回复（见 reply）
+
+        Args:
+            bubbles (List[Dict]): 发送后的气泡列表
+
+        Returns:
+            Optional[str]: 回复内容，还没有回复时返回None
+        """
+        new = self.new_bubbles(bubbles)
+        for i in range(len(new) - 1, -1, -1):
+            if new[i]["text"] == self.sent_text:
+                new = new[i + 1:]
+                break
+        else:
+            # 没有看到我们自己的消息（可能已滚出屏幕），排除与发送内容相同的气泡
+            new = [bubble for bubble in new if bubble["text"] != self.sent_text]
+        return "\n".join(bubble["text"] for bubble in new) or None
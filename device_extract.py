@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备端文本提取
+把一个小的shell脚本推送到模拟器上，由它在设备端完成dump和筛选，
+只把需要的几行文本（@消息及其前一句、智能体的上一句消息、最后几条文本）传回主机，
+不再传输和解析完整的XML。多台设备共用一台主机时可以明显降低传输量和CPU占用
+"""
+
+import html
+import os
+import shlex
+import threading
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from adb_session import connection_generation, run_shell
+
+# 是否启用设备端提取（默认关闭，设置为1时启用）
+DEVICE_EXTRACT_ENABLED = os.environ.get("SIMHOSHINO_DEVICE_EXTRACT", "0") == "1"
+
+# 设备上的脚本路径
+HELPER_PATH = "/data/local/tmp/simhoshino_extract.sh"
+
+# 默认返回的最后文本条数
+LAST_TEXTS = 10
+
+# 设备端脚本：参数为 智能体名称（可为空） 和 返回的最后文本条数
+HELPER_SCRIPT = r'''#!/system/bin/sh
+# SimHoshino device-side extractor
+f=/data/local/tmp/simhoshino_extract_$$.xml
+uiautomator dump "$f" >/dev/null 2>&1 || { rm -f "$f"; exit 1; }
+grep -o ' text="[^"]*"' "$f" | sed -e 's/^ text="//' -e 's/"$//' | grep -v '^[[:space:]]*$' > "$f.txt"
+rm -f "$f"
+prev=""; at=""; atprev=""; found=""
+while IFS= read -r t; do
+  if [ -z "$found" ]; then
+    case "$t" in *@*) at="$t"; atprev="$prev"; found=1;; esac
+  fi
+  prev="$t"
+done < "$f.txt"
+agent="$1"
+[ -z "$agent" ] && [ -n "$at" ] && [ -n "$atprev" ] && agent="$atprev"
+prev=""; agentprev=""
+if [ -n "$agent" ]; then
+  while IFS= read -r t; do
+    if [ -n "$prev" ]; then
+      case "$t" in *"发送消息给$agent"*) agentprev="$prev"; break;; esac
+    fi
+    prev="$t"
+  done < "$f.txt"
+fi
+printf 'AT\t%s\t%s\n' "$atprev" "$at"
+printf 'AGENT\t%s\t%s\n' "$agent" "$agentprev"
+tail -n "${2:-10}" "$f.txt" | while IFS= read -r t; do printf 'TEXT\t%s\n' "$t"; done
+rm -f "$f.txt"
+'''
+
+# 已推送脚本的设备: 序列号 → 推送时的连接代数
+_installed: Dict[Optional[str], int] = {}
+_installed_lock = threading.Lock()
+
+
+def install_helper(serial: Optional[str] = None) -> bool:
+    """
+    把提取脚本推送到设备（每台设备只推送一次，设备重连后重新推送）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+
+    Returns:
+        bool: 脚本是否可用
+    """
+    generation = connection_generation(serial)
+    with _installed_lock:
+        if _installed.get(serial) == generation:
+            return True
+
+    command = f"cat > {HELPER_PATH} <<'__SIMHOSHINO_EOF__'\n{HELPER_SCRIPT}__SIMHOSHINO_EOF__\nchmod 755 {HELPER_PATH}"
+    try:
+        run_shell(command, serial=serial, check=True)
+    except Exception as e:
+        print(f"⚠️  推送设备端提取脚本失败: {e}")
+        return False
+
+    with _installed_lock:
+        _installed[serial] = generation
+    return True
+
+
+def _clean(text: str) -> Optional[str]:
+    """还原XML实体并去掉首尾空白，空字符串返回None"""
+    text = html.unescape(text).strip()
+    return text or None
+
+
+def device_extract(serial: Optional[str] = None, agent_name: Optional[str] = None,
+                   last_n: int = LAST_TEXTS) -> Optional[dict]:
+    """
+    在设备端dump并筛选文本
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        agent_name (Optional[str]): 智能体名称，None时使用@消息的前一句作为智能体名称
+        last_n (int): 返回的最后文本条数
+
+    Returns:
+        Optional[dict]: {"at_previous", "at_message", "agent_name", "agent_previous", "texts"}，
+            失败返回None
+    """
+    if not install_helper(serial):
+        return None
+
+    # 设备端比较的是XML中转义后的文本
+    pattern = escape(agent_name, {'"': "&quot;"}) if agent_name else ""
+    command = f"sh {HELPER_PATH} {shlex.quote(pattern)} {int(last_n)}"
+    try:
+        result = run_shell(command, serial=serial)
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return None
+
+    extracted = {
+        "at_previous": None,
+        "at_message": None,
+        "agent_name": None,
+        "agent_previous": None,
+        "texts": []
+    }
+    texts: List[str] = extracted["texts"]
+    for line in result.stdout.splitlines():
+        fields = line.split("\t")
+        if fields[0] == "AT" and len(fields) == 3:
+            extracted["at_previous"] = _clean(fields[1])
+            extracted["at_message"] = _clean(fields[2])
+        elif fields[0] == "AGENT" and len(fields) == 3:
+            extracted["agent_name"] = _clean(fields[1])
+            extracted["agent_previous"] = _clean(fields[2])
+        elif fields[0] == "TEXT" and len(fields) == 2:
+            text = _clean(fields[1])
+            if text:
+                texts.append(text)
+    return extracted
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多模拟器设备池
+每个设备拥有独立的发送/提取流水线（MessageServer）和串行工作队列，
+调度器把聊天请求分配给负载最低的设备，多开实例时吞吐量随实例数增长
+"""
+
+import os
+import subprocess
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from adb_client import get_client
+from adb_session import get_adb_path
+from server import MessageServer
+from work_queue import STOP_TIMEOUT, DeviceWorkQueue, QueueFullError, WorkItem
+
+# 手动指定设备序列号（逗号分隔），未设置时自动发现
+DEVICES_ENV = "SIMHOSHINO_DEVICES"
+
+# 预热失败后重试的间隔（秒）
+WARM_UP_RETRY_INTERVAL = 30.0
+
+
+def discover_serials() -> List[str]:
+    """
+    发现已连接且在线的设备
+
+    Returns:
+        List[str]: 设备序列号列表
+    """
+    configured = os.environ.get(DEVICES_ENV, "").strip()
+    if configured:
+        return [serial.strip() for serial in configured.split(",") if serial.strip()]
+
+    try:
+        devices = get_client().devices()
+    except ConnectionError:
+        # adb服务端未启动时由adb命令行启动并列出设备
+        try:
+            result = subprocess.run(
+                [get_adb_path(), "devices"],
+                capture_output=True,
+                text=True,
+                check=True
+            )
+        except Exception as e:
+            print(f"⚠️  无法获取设备列表: {e}")
+            return []
+        devices = []
+        for line in result.stdout.splitlines()[1:]:
+            parts = line.split("\t")
+            if len(parts) == 2:
+                devices.append((parts[0], parts[1]))
+    except Exception as e:
+        print(f"⚠️  无法获取设备列表: {e}")
+        return []
+
+    return [serial for serial, state in devices if state == "device"]
+
+
+class DeviceSlot:
+    """设备池中的一台设备"""
+
+    def __init__(self, serial: Optional[str]):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+        """
+        self.serial = serial
+        self.server = MessageServer(serial)
+        self.queue = DeviceWorkQueue(self.name, self.server)
+        self.last_used = 0.0
+        self.retired = False
+        # 运行中连续出错变为未就绪时重新预热
+        self.server.on_degraded = self._submit_warm_up
+        # 预热作为第一个任务在设备工作线程上执行，不阻塞启动
+        self._submit_warm_up()
+
+    @property
+    def name(self) -> str:
+        return self.serial or "default"
+
+    @property
+    def visible_agents(self) -> Dict[str, Optional[str]]:
+        """设备上最近看到的智能体"""
+        return self.server.visible_agents
+
+    @property
+    def ready(self) -> bool:
+        """设备是否已完成预热"""
+        return self.server.readiness["ready"]
+
+    def _submit_warm_up(self):
+        try:
+            self.queue.submit(self._warm_up)
+        except QueueFullError:
+            self._retry_warm_up()
+
+    def _warm_up(self, server: MessageServer) -> bool:
+        ready = server.warm_up()
+        if not ready:
+            self._retry_warm_up()
+        return ready
+
+    def _retry_warm_up(self):
+        """预热失败时稍后再试，设备恢复后自动变为就绪"""
+        if self.retired:
+            return
+        timer = threading.Timer(WARM_UP_RETRY_INTERVAL, self._submit_warm_up)
+        timer.daemon = True
+        timer.start()
+
+    def mark_unready(self, reason: str):
+        """把设备标记为未就绪（例如模拟器探测失败），之后重新预热"""
+        self.server.mark_unready(reason)
+
+    def reset(self, reason: str):
+        """
+        设备原地修复（序列号不变）后重新预热：正在执行的任务收到取消信号，
+        预热排在还在排队的任务之前，仍由同一个工作线程执行，不会有两个线程同时操作这台设备
+
+        Args:
+            reason (str): 原因
+        """
+        self.queue.cancel_current()
+        # 已经排队的预热任务由新的预热代替
+        pending = [item for item in self.queue.drain() if item.fn != self._warm_up]
+        self.server.mark_unready(reason, notify=False)
+        self._submit_warm_up()
+        self.queue.adopt(pending)
+
+    def retire(self) -> List[WorkItem]:
+        """
+        设备已被替换，停止后台活动：取消正在执行的任务并等待工作线程退出
+
+        Returns:
+            List[WorkItem]: 还没有开始执行的任务，由调用方转交给新设备
+        """
+        self.retired = True
+        if self.server.watcher is not None:
+            self.server.watcher.stop()
+        pending = [item for item in self.queue.drain() if item.fn != self._warm_up]
+        if not self.queue.stop():
+            print(f"⚠️  设备 {self.name} 的工作线程在 {STOP_TIMEOUT:.0f} 秒内没有结束当前任务")
+        return pending
+
+    def adopt(self, items: List[WorkItem]):
+        """接收被替换设备上还没有开始执行的任务"""
+        self.queue.adopt(items)
+
+    def status(self, deep: bool = False) -> dict:
+        """
+        设备当前状态（只读取缓存的统计，不访问设备）
+
+        Args:
+            deep (bool): 是否包含预热状态和最近一次探测耗时
+        """
+        status = {"serial": self.name, "ready": self.ready}
+        status.update(self.queue.stats())
+        status["agents"] = list(self.visible_agents)
+        if self.server.watcher is not None:
+            status["watcher"] = self.server.watcher.stats()
+        # 未配置界面事件源时等待回复只靠轮询
+        status["events"] = self.server.events.stats() if self.server.events is not None else "off"
+        if deep:
+            status["readiness"] = self.server.readiness_status()
+        return status
+
+
+class DevicePool:
+    """设备池与请求调度器"""
+
+    slot_class = DeviceSlot
+
+    # 模拟器生命周期管理器（由 EmulatorManager.attach 设置）
+    manager = None
+
+    def __init__(self, serials: Optional[List[Optional[str]]] = None):
+        """
+        初始化设备池
+
+        Args:
+            serials (Optional[List[Optional[str]]]): 设备序列号列表，None时自动发现；
+                没有发现任何设备时退回到单个默认设备
+        """
+        if serials is None:
+            serials = discover_serials() or [None]
+        self.slots = [self.slot_class(serial) for serial in serials]
+        self._by_serial: Dict[Optional[str], DeviceSlot] = {slot.serial: slot for slot in self.slots}
+        self._lock = threading.Lock()
+        print(f"📱 设备池初始化完成，共 {len(self.slots)} 台设备: "
+              f"{', '.join(slot.name for slot in self.slots)}")
+
+    @property
+    def size(self) -> int:
+        return len(self.slots)
+
+    def get(self, serial: Optional[str]) -> Optional[DeviceSlot]:
+        """按序列号获取设备"""
+        return self._by_serial.get(serial)
+
+    def submit(self, fn: Callable[[MessageServer], Any],
+               agent: Optional[str] = None) -> Tuple[DeviceSlot, WorkItem]:
+        """
+        把一轮对话提交到负载最低的设备队列（负载相同时选择最久未使用的设备）；
+        已完成预热的设备优先；指定智能体时优先选择正停留在该智能体聊天界面的设备，
+        它的队列满了才分配给其他设备
+
+        Args:
+            fn (Callable[[MessageServer], Any]): 在设备工作线程上执行的任务
+            agent (Optional[str]): 目标智能体
+
+        Returns:
+            Tuple[DeviceSlot, WorkItem]: (分配到的设备, 任务对象)
+
+        Raises:
+            QueueFullError: 所有设备的队列都已满
+        """
+        with self._lock:
+            candidates = sorted(self.slots, key=lambda s: (
+                not s.ready,
+                agent is not None and agent not in s.visible_agents,
+                s.queue.load,
+                s.last_used
+            ))
+            retry_after = None
+            for slot in candidates:
+                try:
+                    item = slot.queue.submit(fn)
+                except QueueFullError as e:
+                    retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                    continue
+                slot.last_used = item.enqueued_at
+                return slot, item
+        raise QueueFullError(retry_after or 1)
+
+    def agents(self) -> List[str]:
+        """所有设备上最近看到的智能体"""
+        names: List[str] = []
+        for slot in self.slots:
+            for name in slot.visible_agents:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def replace(self, old_serial: Optional[str], new_serial: Optional[str]) -> DeviceSlot:
+        """
+        把一台设备换成另一台设备（例如用备用模拟器替换故障模拟器）：
+        旧槽位先移出设备池并退役（取消正在执行的任务、等待工作线程退出），
+        然后新设备使用新的槽位开始预热，旧槽位中还在排队的任务转到新槽位（排在预热之后）。
+        新旧序列号相同时（例如模拟器原地修复之后）不创建新槽位，而是重置原槽位并重新预热
+
+        Args:
+            old_serial (Optional[str]): 被替换的设备序列号
+            new_serial (Optional[str]): 新设备序列号
+
+        Returns:
+            DeviceSlot: 新设备的槽位
+        """
+        if old_serial == new_serial:
+            # 持有设备池的锁，重置期间不会有新请求排到预热前面
+            with self._lock:
+                slot = self._by_serial.get(old_serial)
+                if slot is not None:
+                    slot.reset("模拟器已修复，重新预热")
+            if slot is not None:
+                print(f"🔁 设备 {slot.name} 已重置并重新预热")
+                return slot
+
+        with self._lock:
+            old_slot = self._by_serial.pop(old_serial, None)
+            index = len(self.slots)
+            if old_slot is not None:
+                index = self.slots.index(old_slot)
+                self.slots = [slot for slot in self.slots if slot is not old_slot]
+        # 旧的工作线程退出之后才开始预热新设备
+        pending = old_slot.retire() if old_slot is not None else []
+        new_slot = self.slot_class(new_serial)
+        with self._lock:
+            self.slots = self.slots[:index] + [new_slot] + self.slots[index:]
+            self._by_serial[new_serial] = new_slot
+        if pending:
+            new_slot.adopt(pending)
+            print(f"📦 {len(pending)} 个排队中的请求已转到设备 {new_slot.name}")
+        if old_serial == new_serial:
+            print(f"🔁 设备 {new_slot.name} 已重新加入设备池")
+        else:
+            print(f"🔁 设备 {old_slot.name if old_slot else old_serial} 已替换为 {new_slot.name}")
+        return new_slot
+
+    def mark_unready(self, serial: Optional[str], reason: str):
+        """
+        把设备标记为未就绪，预热成功后自动恢复
+
+        Args:
+            serial (Optional[str]): 设备序列号
+            reason (str): 原因
+        """
+        slot = self.get(serial)
+        if slot is not None:
+            slot.mark_unready(reason)
+
+    def ready_slots(self) -> List[DeviceSlot]:
+        """已完成预热的设备"""
+        return [slot for slot in self.slots if slot.ready]
+
+    def status(self, deep: bool = False) -> List[dict]:
+        """所有设备的状态（deep 为True时包含预热状态）"""
+        return [slot.status(deep) for slot in self.slots]
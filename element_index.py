@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+界面元素索引
+从快照的节点列表建立按 resource-id / class / text 查找的索引，
+用来定位输入框和发送按钮的实际坐标，代替写死的屏幕坐标。
+索引按设备和布局指纹缓存，聊天内容变化不会触发重建
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from send_message_fixed import INPUT_BOX_POS, SEND_BUTTON_POS
+from ui_snapshot import UISnapshot
+
+# 每台设备最多缓存的布局数
+MAX_CACHED_LAYOUTS = 4
+
+# 输入框提示文本的前缀
+INPUT_HINT_PREFIX = "发送消息给"
+
+# 发送按钮的resource-id或描述中的常见标识
+SEND_BUTTON_KEYWORDS = ("send", "发送")
+
+# 发送按钮的文本
+SEND_BUTTON_TEXT = "发送"
+
+Point = Tuple[int, int]
+
+
+def _is_layout_node(node: Dict) -> bool:
+    """参与布局指纹的节点：可点击的控件和输入框（聊天气泡不参与）"""
+    return node["clickable"] or node["class"].endswith("EditText")
+
+
+def layout_fingerprint(snapshot: UISnapshot) -> str:
+    """
+    计算快照的布局指纹（屏幕尺寸加上可交互控件的类名、resource-id和位置）
+
+    Args:
+        snapshot (UISnapshot): UI快照
+
+    Returns:
+        str: 指纹
+    """
+    nodes = snapshot.nodes
+    digest = hashlib.md5()
+    if nodes:
+        digest.update(repr(nodes[0]["bounds"]).encode("utf-8"))
+    for node in nodes:
+        if _is_layout_node(node):
+            digest.update(f"{node['class']}|{node['resource_id']}|{node['bounds']}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def center(node: Dict) -> Optional[Point]:
+    """节点中心坐标"""
+    bounds = node.get("bounds")
+    if not bounds:
+        return None
+    left, top, right, bottom = bounds
+    if right <= left or bottom <= top:
+        return None
+    return (left + right) // 2, (top + bottom) // 2
+
+
+class ElementIndex:
+    """单个布局的元素索引"""
+
+    def __init__(self, nodes: List[Dict]):
+        """
+        Args:
+            nodes (List[Dict]): 快照的节点列表（只保留有坐标的节点）
+        """
+        self.by_resource_id: Dict[str, List[Dict]] = {}
+        self.by_class: Dict[str, List[Dict]] = {}
+        self.by_text: Dict[str, List[Dict]] = {}
+        for node in nodes:
+            if center(node) is None:
+                continue
+            entry = {
+                "resource_id": node["resource_id"],
+                "class": node["class"],
+                "text": node["text"],
+                "content_desc": node["content_desc"],
+                "clickable": node["clickable"],
+                "bounds": node["bounds"]
+            }
+            if entry["resource_id"]:
+                self.by_resource_id.setdefault(entry["resource_id"], []).append(entry)
+            self.by_class.setdefault(entry["class"], []).append(entry)
+            if entry["text"]:
+                self.by_text.setdefault(entry["text"], []).append(entry)
+        self.input_box = self._find_input_box()
+        self.send_button = self._find_send_button()
+
+    def find(self, resource_id: Optional[str] = None, class_name: Optional[str] = None,
+             text: Optional[str] = None) -> List[Dict]:
+        """
+        按条件查找元素（多个条件同时满足）
+
+        Args:
+            resource_id (Optional[str]): resource-id
+            class_name (Optional[str]): 类名
+            text (Optional[str]): 文本
+
+        Returns:
+            List[Dict]: 匹配的元素
+        """
+        if resource_id is not None:
+            candidates = self.by_resource_id.get(resource_id, [])
+        elif text is not None:
+            candidates = self.by_text.get(text, [])
+        elif class_name is not None:
+            candidates = self.by_class.get(class_name, [])
+        else:
+            return []
+        return [
+            entry for entry in candidates
+            if (class_name is None or entry["class"] == class_name)
+            and (text is None or entry["text"] == text)
+        ]
+
+    def _find_input_box(self) -> Optional[Dict]:
+        """输入框：优先带有 "发送消息给" 提示的EditText，否则取最靠下的EditText"""
+        edits = [
+            entry for class_name, entries in self.by_class.items()
+            if class_name.endswith("EditText") for entry in entries
+        ]
+        if not edits:
+            return None
+        for entry in edits:
+            if entry["text"].startswith(INPUT_HINT_PREFIX):
+                return entry
+        return max(edits, key=lambda entry: entry["bounds"][3])
+
+    def _in_input_row(self, entry: Dict) -> bool:
+        """控件是否与输入框在同一行（输入框未知时不限制）"""
+        if self.input_box is None:
+            return True
+        _, top, _, bottom = self.input_box["bounds"]
+        return entry["bounds"][1] < bottom and entry["bounds"][3] > top
+
+    def _find_send_button(self) -> Optional[Dict]:
+        """
+        发送按钮：输入框所在行中可点击的控件，优先resource-id或描述中带有发送字样、文本为发送的，
+        否则取输入框右侧最近的一个（聊天气泡的描述就是消息内容，不可点击也不在输入行，不会被选中）
+        """
+        row = [
+            entry for entries in self.by_class.values() for entry in entries
+            if entry["clickable"] and entry is not self.input_box and self._in_input_row(entry)
+        ]
+        for entry in row:
+            label = f"{entry['resource_id'].rsplit('/', 1)[-1]} {entry['content_desc']}".lower()
+            if entry["text"] == SEND_BUTTON_TEXT or any(word in label for word in SEND_BUTTON_KEYWORDS):
+                return entry
+
+        if self.input_box is None:
+            return None
+        right = self.input_box["bounds"][2]
+        right_side = [entry for entry in row if entry["bounds"][0] >= right]
+        return min(right_side, key=lambda entry: entry["bounds"][0]) if right_side else None
+
+    def send_targets(self) -> Tuple[Optional[Point], Optional[Point]]:
+        """
+        输入框和发送按钮的中心坐标
+
+        Returns:
+            Tuple[Optional[Point], Optional[Point]]: (输入框坐标, 发送按钮坐标)，找不到时为None
+        """
+        input_pos = center(self.input_box) if self.input_box else None
+        send_pos = center(self.send_button) if self.send_button else None
+        return input_pos, send_pos
+
+
+_indexes: Dict[Optional[str], "OrderedDict[str, ElementIndex]"] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_element_index(serial: Optional[str], snapshot: UISnapshot) -> ElementIndex:
+    """
+    获取快照对应的元素索引，同一设备上布局指纹相同时直接复用
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        snapshot (UISnapshot): UI快照
+
+    Returns:
+        ElementIndex: 元素索引
+    """
+    fingerprint = layout_fingerprint(snapshot)
+    with _indexes_lock:
+        layouts = _indexes.setdefault(serial, OrderedDict())
+        index = layouts.get(fingerprint)
+        if index is not None:
+            layouts.move_to_end(fingerprint)
+            return index
+
+    index = ElementIndex(snapshot.nodes)
+    with _indexes_lock:
+        layouts[fingerprint] = index
+        while len(layouts) > MAX_CACHED_LAYOUTS:
+            layouts.popitem(last=False)
+    return index
+
+
+def resolve_send_targets(serial: Optional[str],
+                         snapshot: Optional[UISnapshot]) -> Tuple[Point, Point]:
+    """
+    确定输入框和发送按钮的坐标，无法从界面定位时使用默认坐标
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        snapshot (Optional[UISnapshot]): UI快照
+
+    Returns:
+        Tuple[Point, Point]: (输入框坐标, 发送按钮坐标)
+    """
+    if snapshot is None:
+        return INPUT_BOX_POS, SEND_BUTTON_POS
+    input_pos, send_pos = get_element_index(serial, snapshot).send_targets()
+    return input_pos or INPUT_BOX_POS, send_pos or SEND_BUTTON_POS
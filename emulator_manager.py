@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟器生命周期管理
+通过雷电模拟器的控制台（ldconsole.exe / dnconsole.exe）启动、检查、重启和还原实例，
+并保留一台已启动的备用实例：服务中的实例连续多次探测失败时，立即把设备池中的这台设备
+换成备用实例，再在后台修复故障实例，修复后它成为新的备用实例。
+恢复时间从手动处理的几分钟缩短到几秒，设备池容量保持稳定。
+
+控制台命令通过 CommandRunner 执行，测试时可以替换为模拟实现
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from adb_session import run_shell
+
+# 服务中的模拟器实例编号（逗号分隔），未设置时不启用生命周期管理
+EMULATORS_ENV = "SIMHOSHINO_EMULATORS"
+
+# 备用实例编号（逗号分隔）
+SPARE_EMULATORS_ENV = "SIMHOSHINO_SPARE_EMULATORS"
+
+# 修复时用于还原实例的备份文件（.ldbk），未设置时只重启
+BACKUP_ENV = "SIMHOSHINO_EMULATOR_BACKUP"
+
+# 控制台路径，未设置时使用目录中的 ldconsole.exe 或 dnconsole.exe
+CONSOLE_ENV = "SIMHOSHINO_CONSOLE"
+
+# 控制台命令的超时时间（秒）
+CONSOLE_TIMEOUT = 60.0
+
+# 等待实例开机完成的最长时间（秒）
+BOOT_TIMEOUT = 120.0
+
+# 开机等待期间的检查间隔（秒）
+BOOT_POLL_INTERVAL = 2.0
+
+# 健康检查的间隔（秒）
+HEALTH_INTERVAL = 10.0
+
+# 单次探测的超时时间（秒）
+PROBE_TIMEOUT = 5.0
+
+# 连续探测失败多少次判定为故障
+FAILURE_THRESHOLD = 3
+
+# 修复失败后再次尝试的等待时间（秒），每次失败翻倍，直到上限
+RECOVERY_RETRY_INITIAL = 30.0
+RECOVERY_RETRY_MAX = 600.0
+
+# 控制台输出的编码（Windows 中文系统为GBK）
+CONSOLE_ENCODING = "gbk" if os.name == "nt" else "utf-8"
+
+
+def serial_for_index(index: int) -> str:
+    """模拟器实例对应的adb序列号（实例0为 emulator-5554，之后每个实例加2）"""
+    return f"emulator-{5554 + index * 2}"
+
+
+def _parse_indexes(value: str) -> List[int]:
+    """解析逗号分隔的实例编号"""
+    return [int(part.strip()) for part in value.split(",") if part.strip().isdigit()]
+
+
+def find_console() -> Optional[str]:
+    """
+    查找模拟器控制台程序
+
+    Returns:
+        Optional[str]: 控制台路径，找不到时返回None
+    """
+    configured = os.environ.get(CONSOLE_ENV, "").strip()
+    if configured:
+        return configured
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in ("ldconsole.exe", "dnconsole.exe"):
+        path = os.path.join(current_dir, name)
+        if os.path.exists(path):
+            return path
+    return shutil.which("ldconsole") or shutil.which("dnconsole")
+
+
+class CommandRunner(ABC):
+    """执行控制台命令的接口"""
+
+    @abstractmethod
+    def run(self, args: List[str], timeout: float) -> Tuple[int, str]:
+        """
+        执行命令
+
+        Args:
+            args (List[str]): 命令和参数
+            timeout (float): 超时时间（秒）
+
+        Returns:
+            Tuple[int, str]: (返回码, 输出)
+        """
+
+
+class SubprocessRunner(CommandRunner):
+    """通过子进程执行控制台命令"""
+
+    def run(self, args: List[str], timeout: float) -> Tuple[int, str]:
+        result = subprocess.run(args, capture_output=True, timeout=timeout)
+        return result.returncode, result.stdout.decode(CONSOLE_ENCODING, errors="replace")
+
+
+class EmulatorConsole:
+    """模拟器控制台命令的封装"""
+
+    def __init__(self, path: Optional[str] = None, runner: Optional[CommandRunner] = None):
+        """
+        Args:
+            path (Optional[str]): 控制台路径，None时自动查找
+            runner (Optional[CommandRunner]): 命令执行器，None时使用子进程
+        """
+        self.path = path or find_console()
+        if self.path is None:
+            raise FileNotFoundError("找不到模拟器控制台（ldconsole.exe / dnconsole.exe）")
+        self.runner = runner or SubprocessRunner()
+
+    def _run(self, *args, timeout: float = CONSOLE_TIMEOUT) -> str:
+        code, output = self.runner.run([self.path] + [str(arg) for arg in args], timeout)
+        if code != 0:
+            raise RuntimeError(f"控制台命令 {args[0]} 失败 (返回码 {code}): {output.strip()}")
+        return output
+
+    def list_instances(self) -> Dict[int, dict]:
+        """
+        列出所有实例（list2 输出：编号,标题,顶层窗口句柄,绑定窗口句柄,是否已进入安卓,进程ID,VBox进程ID）
+
+        Returns:
+            Dict[int, dict]: 实例编号 → {"index", "title", "running", "pid"}
+        """
+        instances = {}
+        for line in self._run("list2").splitlines():
+            parts = line.strip().split(",")
+            if len(parts) < 6 or not parts[0].isdigit():
+                continue
+            index = int(parts[0])
+            instances[index] = {
+                "index": index,
+                "title": parts[1],
+                "running": parts[4] == "1",
+                "pid": int(parts[5]) if parts[5].lstrip("-").isdigit() else None
+            }
+        return instances
+
+    def is_running(self, index: int) -> bool:
+        """实例是否已启动并进入安卓"""
+        instance = self.list_instances().get(index)
+        return bool(instance and instance["running"])
+
+    def launch(self, index: int):
+        """启动实例"""
+        self._run("launch", "--index", index)
+
+    def quit(self, index: int):
+        """关闭实例"""
+        self._run("quit", "--index", index)
+
+    def reboot(self, index: int):
+        """重启实例"""
+        self._run("reboot", "--index", index)
+
+    def restore(self, index: int, backup_file: str):
+        """从备份文件还原实例（实例需要先关闭）"""
+        self._run("restore", "--index", index, "--file", backup_file, timeout=CONSOLE_TIMEOUT * 5)
+
+
+class EmulatorInstance:
+    """一个受管理的模拟器实例"""
+
+    def __init__(self, index: int, role: str):
+        """
+        Args:
+            index (int): 实例编号
+            role (str): 角色（active 服务中 / spare 备用）
+        """
+        self.index = index
+        self.serial = serial_for_index(index)
+        self.role = role
+        self.state = "stopped"
+        self.failures = 0
+        self.recoveries = 0
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.state == "healthy"
+
+    def status(self) -> dict:
+        return {
+            "index": self.index,
+            "serial": self.serial,
+            "role": self.role,
+            "state": self.state,
+            "failures": self.failures,
+            "recoveries": self.recoveries,
+            "last_latency": round(self.last_latency, 3) if self.last_latency is not None else None,
+            "last_error": self.last_error
+        }
+
+
+class EmulatorManager:
+    """模拟器生命周期管理器"""
+
+    def __init__(self, console: EmulatorConsole, active: List[int], spares: List[int],
+                 backup_file: Optional[str] = None,
+                 probe: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            console (EmulatorConsole): 模拟器控制台
+            active (List[int]): 服务中的实例编号
+            spares (List[int]): 备用实例编号
+            backup_file (Optional[str]): 修复时用于还原的备份文件
+            probe (Optional[Callable[[str], bool]]): 探测设备是否可用的函数，None时检查开机完成标志
+        """
+        self.console = console
+        self.backup_file = backup_file
+        self.probe = probe or self._probe_boot_completed
+        self.instances = [EmulatorInstance(index, "active") for index in active] + \
+                         [EmulatorInstance(index, "spare") for index in spares]
+        self.pool = None
+        self.replacements = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["EmulatorManager"]:
+        """
+        按环境变量创建管理器
+
+        Returns:
+            Optional[EmulatorManager]: 管理器，没有配置实例时返回None
+        """
+        active = _parse_indexes(os.environ.get(EMULATORS_ENV, ""))
+        if not active:
+            return None
+        spares = _parse_indexes(os.environ.get(SPARE_EMULATORS_ENV, ""))
+        backup_file = os.environ.get(BACKUP_ENV, "").strip() or None
+        return cls(EmulatorConsole(), active, spares, backup_file)
+
+    def _probe_boot_completed(self, serial: str) -> bool:
+        """探测设备：adb可以连接且开机已完成"""
+        result = run_shell(["getprop", "sys.boot_completed"], serial=serial, timeout=PROBE_TIMEOUT)
+        return result.returncode == 0 and result.stdout.strip() == "1"
+
+    def _check(self, instance: EmulatorInstance) -> bool:
+        """探测一次并记录耗时和连续失败次数"""
+        started = time.monotonic()
+        try:
+            ok = self.probe(instance.serial)
+            error = None if ok else "设备未响应"
+        except Exception as e:
+            ok, error = False, str(e)
+        instance.last_latency = time.monotonic() - started
+        if ok:
+            instance.failures = 0
+            instance.last_error = None
+        else:
+            instance.failures += 1
+            instance.last_error = error
+        return ok
+
+    def _boot(self, instance: EmulatorInstance) -> bool:
+        """启动实例（已启动时跳过）并等待开机完成"""
+        instance.state = "booting"
+        try:
+            if not self.console.is_running(instance.index):
+                self.console.launch(instance.index)
+        except Exception as e:
+            instance.state = "failed"
+            instance.last_error = str(e)
+            return False
+        return self._wait_until_healthy(instance)
+
+    def _wait_until_healthy(self, instance: EmulatorInstance) -> bool:
+        deadline = time.monotonic() + BOOT_TIMEOUT
+        while time.monotonic() < deadline and not self._stop.is_set():
+            if self._check(instance):
+                instance.state = "healthy"
+                return True
+            self._stop.wait(BOOT_POLL_INTERVAL)
+        instance.state = "failed"
+        return False
+
+    def start(self) -> List[str]:
+        """
+        启动所有实例并等待开机，然后开始健康检查
+
+        Returns:
+            List[str]: 开机成功的服务中实例的序列号（作为设备池的设备列表）
+        """
+        threads = [
+            threading.Thread(target=self._boot, args=(instance,), daemon=True)
+            for instance in self.instances
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 开机失败的服务中实例换成健康的备用实例；没有备用实例时仍留在设备池中（未就绪），
+        # 由健康检查线程在后台修复，设备池的容量始终等于配置的服务中实例数
+        for instance in self.instances:
+            if instance.role == "active" and not instance.healthy:
+                spare = next((i for i in self.instances if i.role == "spare" and i.healthy), None)
+                if spare is not None:
+                    spare.role, instance.role = "active", "spare"
+                    print(f"🔁 模拟器 {instance.index} 开机失败，由备用模拟器 {spare.index} 代替")
+        serials = [instance.serial for instance in self.instances if instance.role == "active"]
+        for instance in self.instances:
+            print(f"🖥️  模拟器 {instance.index} ({instance.serial}, {instance.role}): {instance.state}")
+
+        self._thread = threading.Thread(target=self._run, name="emulator-manager", daemon=True)
+        self._thread.start()
+        return serials
+
+    def attach(self, pool):
+        """关联设备池：替换设备时通过 pool.replace 切换"""
+        self.pool = pool
+        pool.manager = self
+
+    def stop(self):
+        """停止健康检查"""
+        self._stop.set()
+
+    def _run(self):
+        """健康检查线程"""
+        while not self._stop.wait(HEALTH_INTERVAL):
+            for instance in list(self.instances):
+                if instance.state == "failed":
+                    # 之前启动或修复失败的实例按退避间隔继续重试
+                    if time.monotonic() >= instance.retry_at:
+                        threading.Thread(target=self.recover, args=(instance,), daemon=True).start()
+                    continue
+                if instance.state != "healthy":
+                    continue
+                if self._check(instance):
+                    continue
+                if instance.role == "active" and self.pool is not None:
+                    # 探测失败时设备先退出就绪状态，恢复后由重新预热标记为就绪
+                    self.pool.mark_unready(instance.serial, f"模拟器探测失败: {instance.last_error}")
+                if instance.failures < FAILURE_THRESHOLD:
+                    continue
+                instance.state = "degraded"
+                print(f"⚠️  模拟器 {instance.index} 连续 {instance.failures} 次探测失败: {instance.last_error}")
+                if instance.role == "active":
+                    self._replace(instance)
+                threading.Thread(target=self.recover, args=(instance,), daemon=True).start()
+
+    def _replace(self, instance: EmulatorInstance):
+        """把故障实例从设备池中换成一台健康的备用实例"""
+        with self._lock:
+            spare = next((i for i in self.instances if i.role == "spare" and i.healthy), None)
+            if spare is None:
+                print(f"⚠️  没有可用的备用模拟器，模拟器 {instance.index} 将原地修复")
+                return
+            spare.role, instance.role = "active", "spare"
+            self.replacements += 1
+        print(f"🔁 使用备用模拟器 {spare.index} 替换模拟器 {instance.index}")
+        if self.pool is not None:
+            self.pool.replace(instance.serial, spare.serial)
+
+    def recover(self, instance: EmulatorInstance) -> bool:
+        """
+        修复实例：先重启，失败时（配置了备份文件则先还原）关闭后重新启动
+
+        Args:
+            instance (EmulatorInstance): 要修复的实例
+
+        Returns:
+            bool: 是否修复成功
+        """
+        instance.state = "recovering"
+        instance.recoveries += 1
+        print(f"🔧 正在修复模拟器 {instance.index}...")
+        try:
+            self.console.reboot(instance.index)
+            if self._wait_until_healthy(instance):
+                print(f"✅ 模拟器 {instance.index} 重启后恢复")
+                self._recovered(instance)
+                return True
+
+            instance.state = "recovering"
+            self.console.quit(instance.index)
+            if self.backup_file:
+                self.console.restore(instance.index, self.backup_file)
+            self.console.launch(instance.index)
+            if self._wait_until_healthy(instance):
+                print(f"✅ 模拟器 {instance.index} 重新启动后恢复")
+                self._recovered(instance)
+                return True
+        except Exception as e:
+            instance.state = "failed"
+            instance.last_error = str(e)
+        instance.retry_delay = min(max(instance.retry_delay * 2, RECOVERY_RETRY_INITIAL), RECOVERY_RETRY_MAX)
+        instance.retry_at = time.monotonic() + instance.retry_delay
+        print(f"❌ 模拟器 {instance.index} 修复失败: {instance.last_error}，"
+              f"{instance.retry_delay:.0f}秒后重试")
+        return False
+
+    def _recovered(self, instance: EmulatorInstance):
+        """修复成功：仍在设备池中的实例重置原来的设备槽位并重新预热，否则成为备用实例"""
+        instance.retry_delay = 0.0
+        if instance.role == "active" and self.pool is not None:
+            self.pool.replace(instance.serial, instance.serial)
+
+    def status(self) -> dict:
+        """所有实例的状态"""
+        return {
+            "replacements": self.replacements,
+            "instances": [instance.status() for instance in self.instances]
+        }
+
@@ -3,13 +3,19 @@ from flask_cors import CORS
 import json
 import time
 from datetime import datetime
-from server import MessageServer
+from device_pool import DevicePool
+from supervisor import SUPERVISOR_ENABLED, SupervisedPool
+from emulator_manager import EmulatorManager
+from chat_turn import ChatTurn
+from agent_router import DEFAULT_MODEL, known_agents, resolve_agent
+from work_queue import QUEUE_WAIT_TIMEOUT, QueueFullError, QueueTimeoutError
 import uuid
 import threading
 import secrets
 import string
 import os
 import logging
+import multiprocessing
 from logging.handlers import RotatingFileHandler
 
 app = Flask(__name__)
@@ -25,21 +31,23 @@ def setup_logging():
     # 配置日志格式
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     
+    # 控制台输出
+    handlers = [logging.StreamHandler()]
+    # 文件输出（带轮转）只在主进程中配置：设备工作进程启动时会重新导入本模块，
+    # 多个进程轮转同一个日志文件在Windows上会失败
+    if multiprocessing.parent_process() is None:
+        handlers.append(RotatingFileHandler(
+            'logs/simhoshino_api.log',
+            maxBytes=10*1024*1024,  # 10MB
+            backupCount=5,
+            encoding='utf-8'
+        ))
+    
     # 配置根日志记录器
     logging.basicConfig(
         level=logging.INFO,
         format=log_format,
-        handlers=[
-            # 控制台输出
-            logging.StreamHandler(),
-            # 文件输出（带轮转）
-            RotatingFileHandler(
-                'logs/simhoshino_api.log',
-                maxBytes=10*1024*1024,  # 10MB
-                backupCount=5,
-                encoding='utf-8'
-            )
-        ]
+        handlers=handlers
     )
     
     # 设置Flask应用的日志级别
@@ -50,8 +58,30 @@ def setup_logging():
 # 初始化日志系统
 logger = setup_logging()
 
-# 初始化消息服务器实例
-message_server = MessageServer()
+# 设备池（每台设备一个消息服务器实例和一个串行工作队列）
+# 只在实际处理请求的进程中创建一次：导入本模块不会占用设备，调试重载的监视进程也不会
+_device_pool = None
+_device_pool_lock = threading.Lock()
+
+def get_device_pool(supervised=None):
+    """
+    获取设备池，第一次调用时初始化
+    
+    Args:
+        supervised: 是否每台设备使用一个工作进程（只在第一次调用时生效），None时由环境变量决定
+    """
+    global _device_pool
+    with _device_pool_lock:
+        if _device_pool is None:
+            if supervised is None:
+                supervised = SUPERVISOR_ENABLED
+            # 配置了模拟器实例时先启动它们，开机失败的服务中实例由备用实例代替（没有备用实例时在后台修复）
+            manager = EmulatorManager.from_env()
+            serials = manager.start() if manager is not None else None
+            _device_pool = SupervisedPool(serials) if supervised else DevicePool(serials)
+            if manager is not None:
+                manager.attach(_device_pool)
+        return _device_pool
 
 def generate_api_key():
     """生成安全的API密钥"""
@@ -120,16 +150,34 @@ class OpenAIAPIServer:
             }
         }
     
-    def format_stream_response(self, content, model="SimHoshino-agent"):
-        """格式化为流式响应"""
+    def format_incremental_stream(self, updates, model="SimHoshino-agent", empty_message=None):
+        """
+        将不断增长的回复文本转换为增量流式响应
+        
+        Args:
+            updates: 产出当前完整回复文本的迭代器
+            model (str): 模型名称
+            empty_message: 没有任何回复时调用，返回要发送的提示文本
+        """
         chat_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
         timestamp = int(time.time())
         
         # 开始响应
         yield f"data: {json.dumps({'id': chat_id, 'object': 'chat.completion.chunk', 'created': timestamp, 'model': model, 'choices': [{'index': 0, 'delta': {'role': 'assistant'}, 'finish_reason': None}]})}\n\n"
         
-        # 内容响应
-        yield f"data: {json.dumps({'id': chat_id, 'object': 'chat.completion.chunk', 'created': timestamp, 'model': model, 'choices': [{'index': 0, 'delta': {'content': content}, 'finish_reason': None}]})}\n\n"
+        # 只发送比上次多出来的部分
+        emitted = ""
+        for text in updates:
+            if not text.startswith(emitted):
+                # 界面上的文本被改写，已发送的内容无法撤回，跳过这次变化
+                continue
+            delta = text[len(emitted):]
+            if delta:
+                emitted = text
+                yield f"data: {json.dumps({'id': chat_id, 'object': 'chat.completion.chunk', 'created': timestamp, 'model': model, 'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]})}\n\n"
+        
+        if not emitted and empty_message is not None:
+            yield f"data: {json.dumps({'id': chat_id, 'object': 'chat.completion.chunk', 'created': timestamp, 'model': model, 'choices': [{'index': 0, 'delta': {'content': empty_message()}, 'finish_reason': None}]})}\n\n"
         
         # 结束响应
         yield f"data: {json.dumps({'id': chat_id, 'object': 'chat.completion.chunk', 'created': timestamp, 'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
@@ -138,6 +186,34 @@ class OpenAIAPIServer:
 # 创建API服务器实例
 api_server = OpenAIAPIServer()
 
+# 流式响应的HTTP头（禁止代理缓冲）
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def stream_agent_reply(request_id, turn, model):
+    """转发设备工作线程产出的回复增量，以SSE推送"""
+    state = turn.state
+    
+    def empty_message():
+        if state.get("agent_name"):
+            return f"智能体 {state['agent_name']} 暂未回复，请稍后重试"
+        return "未检测到智能体回复"
+    
+    yield from api_server.format_incremental_stream(turn.iter_updates(), model, empty_message)
+    logger.info(
+        f"[{request_id}] 流式响应结束 - 智能体: {state.get('agent_name')}, "
+        f"完成: {state.get('completed')}"
+    )
+
+def queue_error_response(error_msg, error_type, status, retry_after):
+    """队列满或排队超时的错误响应（带Retry-After头）"""
+    response = jsonify({"error": {"message": error_msg, "type": error_type}})
+    response.status_code = status
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
 @app.route('/v1/chat/completions', methods=['POST'])
 def chat_completions():
     """OpenAI兼容的聊天完成API"""
@@ -158,15 +234,20 @@ def chat_completions():
             return jsonify({"error": {"message": error_msg, "type": "invalid_request_error"}}), 400
         
         messages = data['messages']
-        model = data.get('model', 'SimHoshino-agent')
+        model = data.get('model', DEFAULT_MODEL)
         stream = data.get('stream', False)
         
         logger.info(f"[{request_id}] 请求参数 - 模型: {model}, 流式: {stream}, 消息数量: {len(messages)}")
         
+        # model 字段指定目标智能体；只有已配置或设备上出现过的智能体才会切换界面，其他名称按默认模型处理
+        agent = resolve_agent(model, known_agents(get_device_pool().agents()))
+        if agent is None and model != DEFAULT_MODEL:
+            logger.info(f"[{request_id}] 模型 {model} 不是已知的智能体，使用当前界面上的智能体")
+        
         # 获取最后一条用户消息
         user_message = None
-        for msg in reversed(messages):
-            if msg.get('role') == 'user':
+        for msg in reversed(messages if isinstance(messages, list) else []):
+            if isinstance(msg, dict) and msg.get('role') == 'user':
                 user_message = msg.get('content', '')
                 break
         
@@ -178,11 +259,55 @@ def chat_completions():
         logger.info(f"[{request_id}] 收到用户消息: {user_message}")
         print(f"📨 收到用户消息: {user_message}")
         
-        # 发送消息到智能体
-        logger.info(f"[{request_id}] 开始发送消息到智能体")
-        success = message_server.send_message_to_chat(user_message)
-        if not success:
-            error_msg = "Failed to send message to agent"
+        # 提交到负载最低的设备队列，本轮对话的所有操作都在这台设备的工作线程上完成
+        device_pool = get_device_pool()
+        turn = ChatTurn(user_message, stream, agent)
+        try:
+            slot, item = device_pool.submit(turn, agent)
+        except QueueFullError as e:
+            logger.warning(f"[{request_id}] 所有设备队列已满，建议 {e.retry_after} 秒后重试")
+            return queue_error_response(
+                "All device queues are full, please retry later", "rate_limit_exceeded", 429, e.retry_after
+            )
+        message_server = slot.server
+        logger.info(f"[{request_id}] 分配设备: {slot.name}，队列中还有 {slot.queue.pending} 个请求")
+        
+        # 排队最多等待 QUEUE_WAIT_TIMEOUT 秒；超时后取消任务，消息不会再发到设备上
+        if not item.wait_dequeued(QUEUE_WAIT_TIMEOUT) and item.cancel():
+            turn.cancel()
+            retry_after = slot.queue.retry_after()
+            logger.warning(f"[{request_id}] 排队超过 {QUEUE_WAIT_TIMEOUT:.0f} 秒，已取消")
+            return queue_error_response(
+                "Timed out waiting for a device, please retry later", "server_busy", 503, retry_after
+            )
+        
+        try:
+            if stream:
+                # 只等到消息发出，回复由工作线程继续推送
+                while not turn.sent.wait(0.2):
+                    if item.done.is_set():
+                        break
+                if item.done.is_set():
+                    item.wait()
+            else:
+                item.wait()
+        except QueueTimeoutError as e:
+            logger.warning(f"[{request_id}] 排队超时: {e}")
+            return queue_error_response(
+                "Timed out waiting for a device, please retry later", "server_busy", 503, e.retry_after
+            )
+        except QueueFullError as e:
+            # 多进程模式下工作进程自己的队列也可能拒绝任务
+            logger.warning(f"[{request_id}] 设备 {slot.name} 的队列已满，建议 {e.retry_after} 秒后重试")
+            return queue_error_response(
+                "All device queues are full, please retry later", "rate_limit_exceeded", 429, e.retry_after
+            )
+        logger.info(f"[{request_id}] 排队等待 {item.wait_time:.2f}秒")
+        
+        turn_context = turn.turn_context
+        logger.debug(f"[{request_id}] 发送前基线: {turn_context}")
+        if not turn.send_ok:
+            error_msg = turn.error or "Failed to send message to agent"
             logger.error(f"[{request_id}] 消息发送失败: {error_msg}")
             logger.debug(f"[{request_id}] 发送失败详细信息 - 用户消息: {repr(user_message)}")
             
@@ -204,42 +329,48 @@ def chat_completions():
                 
             return jsonify({"error": {"message": error_msg, "type": "internal_server_error"}}), 500
         
-        logger.info(f"[{request_id}] 消息发送成功，等待智能体回复...")
+        logger.info(f"[{request_id}] 消息发送成功")
         
-        # 等待一段时间让智能体处理
-        time.sleep(3)
+        if stream:
+            # 边轮询边推送，首个增量在第一次看到回复时即可发出
+            logger.info(f"[{request_id}] 返回增量流式响应")
+            response = app.response_class(
+                stream_agent_reply(request_id, turn, model),
+                mimetype='text/event-stream',
+                headers=SSE_HEADERS
+            )
+            # 客户端断开后停止轮询，设备立即处理下一个请求
+            response.call_on_close(turn.cancel)
+            return response
         
-        # 获取智能体回复
-        logger.info(f"[{request_id}] 开始获取智能体回复")
-        previous_msg, at_msg = message_server.extract_at_messages()
-        if at_msg and previous_msg:
-            agent_name = previous_msg.strip()
+        reply_result = turn.result
+        logger.info(
+            f"[{request_id}] 回复检测结束 - 完成: {reply_result['completed']}, "
+            f"轮询: {reply_result['polls']}次, 耗时: {reply_result['elapsed']:.2f}秒"
+        )
+        agent_name = reply_result["agent_name"]
+        if agent_name:
             logger.info(f"[{request_id}] 检测到智能体: {agent_name}")
             print(f"🔍 检测到智能体: {agent_name}")
             
-            agent_response = message_server.get_agent_previous_message(agent_name)
+            agent_response = reply_result["reply"]
             if agent_response:
+                if not reply_result["completed"]:
+                    logger.warning(f"[{request_id}] 等待超时，回复可能尚未完整")
                 logger.info(f"[{request_id}] 获取到智能体回复 - 长度: {len(agent_response)}字符")
                 logger.debug(f"[{request_id}] 智能体回复内容: {agent_response}")
                 
-                if stream:
-                    logger.info(f"[{request_id}] 返回流式响应")
-                    return app.response_class(
-                        api_server.format_stream_response(agent_response, model),
-                        mimetype='text/plain'
-                    )
-                else:
-                    logger.info(f"[{request_id}] 返回标准响应")
-                    return jsonify(api_server.format_openai_response(agent_response, model))
+                logger.info(f"[{request_id}] 返回标准响应")
+                return jsonify(api_server.format_openai_response(agent_response, model))
             else:
                 error_msg = f"智能体 {agent_name} 暂未回复，请稍后重试"
                 logger.warning(f"[{request_id}] 智能体未回复: {error_msg}")
-                logger.debug(f"[{request_id}] 智能体详细信息 - 名称: {agent_name}, previous_msg: {repr(previous_msg)}, at_msg: {repr(at_msg)}")
+                logger.debug(f"[{request_id}] 智能体详细信息 - 名称: {agent_name}, 基线: {repr(turn_context['baseline'])}")
                 # 详细调试信息已记录到日志
         else:
             error_msg = "未检测到智能体回复"
             logger.warning(f"[{request_id}] 未检测到智能体回复")
-            logger.debug(f"[{request_id}] extract_at_messages返回值 - previous_msg: {repr(previous_msg)}, at_msg: {repr(at_msg)}")
+            logger.debug(f"[{request_id}] 回复检测结果: {reply_result}")
             # 详细调试信息已记录到日志
             
             # 尝试获取更多调试信息
@@ -263,15 +394,8 @@ def chat_completions():
         
         logger.error(f"[{request_id}] 最终错误: {error_msg}")
         
-        if stream:
-            logger.info(f"[{request_id}] 返回错误流式响应")
-            return app.response_class(
-                api_server.format_stream_response(error_msg, model),
-                mimetype='text/plain'
-            )
-        else:
-            logger.info(f"[{request_id}] 返回错误标准响应")
-            return jsonify(api_server.format_openai_response(error_msg, model))
+        logger.info(f"[{request_id}] 返回错误标准响应")
+        return jsonify(api_server.format_openai_response(error_msg, model))
         
     except Exception as e:
         import traceback
@@ -302,14 +426,18 @@ def list_models():
     client_ip = request.remote_addr
     logger.info(f"模型列表请求 - 客户端IP: {client_ip}")
     
+    # 默认模型之外，每个已配置或设备上出现过的智能体都是一个模型
+    model_ids = [DEFAULT_MODEL] + known_agents(get_device_pool().agents())
+    
+    created = int(time.time())
     response = {
         "object": "list",
         "data": [{
-            "id": "SimHoshino-agent",
+            "id": model_id,
             "object": "model",
-            "created": int(time.time()),
+            "created": created,
             "owned_by": "SimHoshino"
-        }]
+        } for model_id in model_ids]
     }
     
     logger.debug(f"返回模型列表: {response}")
@@ -317,19 +445,46 @@ def list_models():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """健康检查"""
+    """健康检查（?deep=1 时包含各设备的预热状态和最近一次探测耗时，只读取缓存）"""
     client_ip = request.remote_addr
     logger.info(f"健康检查请求 - 客户端IP: {client_ip}")
     
+    deep = request.args.get('deep') == '1'
+    device_pool = get_device_pool()
+    status = "ok"
+    if deep:
+        ready_count = len(device_pool.ready_slots())
+        if ready_count == 0:
+            status = "unavailable"
+        elif ready_count < device_pool.size:
+            status = "degraded"
+    
     response = {
-        "status": "ok",
+        "status": status,
         "timestamp": datetime.now().isoformat(),
-        "server": "SimHoshino OpenAI API Server"
+        "server": "SimHoshino OpenAI API Server",
+        "devices": device_pool.status(deep)
     }
+    if deep and device_pool.manager is not None:
+        response["emulators"] = device_pool.manager.status()
     
     logger.debug(f"健康检查响应: {response}")
     return jsonify(response)
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查：至少有一台设备完成预热时返回200，否则返回503"""
+    device_pool = get_device_pool()
+    devices = [{"serial": slot.name, "ready": slot.ready} for slot in device_pool.slots]
+    ready = any(device["ready"] for device in devices)
+    
+    response = {
+        "ready": ready,
+        "ready_devices": sum(1 for device in devices if device["ready"]),
+        "devices": devices
+    }
+    return jsonify(response), 200 if ready else 503
+
 @app.route('/', methods=['GET'])
 def index():
     """根路径信息"""
@@ -342,7 +497,8 @@ def index():
         "endpoints": {
             "chat_completions": "/v1/chat/completions",
             "models": "/v1/models",
-            "health": "/health"
+            "health": "/health",
+            "ready": "/ready"
         },
         "documentation": "Compatible with OpenAI API format"
     }
@@ -350,11 +506,9 @@ def index():
     logger.debug(f"根路径响应: {response}")
     return jsonify(response)
 
-if __name__ == '__main__':
-    # 只在主进程中显示启动信息，避免调试模式重载时重复显示
-    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
-        # ASCII艺术字
-        print(r"""
+def print_banner():
+    """打印启动横幅"""
+    print(r"""
  $$$$$$\  $$\               $$\   $$\                     $$\       $$\                     
 $$  __$$\ \__|              $$ |  $$ |                    $$ |      \__|                    
 $$ /  \__|$$\ $$$$$$\$$$$\  $$ |  $$ | $$$$$$\   $$$$$$$\ $$$$$$$\  $$\ $$$$$$$\   $$$$$$\  
@@ -365,6 +519,24 @@ $$\   $$ |$$ |$$ | $$ | $$ |$$ |  $$ |$$ |  $$ | \____$$\ $$ |  $$ |$$ |$$ |  $$
  \______/ \__|\__| \__| \__|\__|  \__| \______/ \_______/ \__|  \__|\__|\__|  \__| \______/ 
                                                                                             
         """)
+
+def print_startup_info(api_key, host, port):
+    """打印服务地址和API密钥"""
+    print("🚀 启动SimHoshino OpenAI API服务器...")
+    print(f"📡 服务器地址: http://localhost:{port}")
+    print(f"🔗 API端点: http://localhost:{port}/v1/chat/completions")
+    print(f"📋 模型列表: http://localhost:{port}/v1/models")
+    print(f"❤️  健康检查: http://localhost:{port}/health")
+    print("="*60)
+    print(f"🔑 API密钥: {api_key}")
+    print("="*60)
+    logger.info(f"服务器即将在 {host}:{port} 上启动")
+
+if __name__ == '__main__':
+    # 开发模式：调试和自动重载开启，生产环境请使用 serve.py
+    # 只在主进程中显示启动信息，避免调试模式重载时重复显示
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        print_banner()
         
         # 加载或生成API密钥
         logger.info("应用程序启动开始")
@@ -372,15 +544,9 @@ $$\   $$ |$$ |$$ | $$ | $$ |$$ |  $$ |$$ |  $$ | \____$$\ $$ |  $$ |$$ |$$ |  $$
         logger.info(f"API密钥已准备就绪: {api_key[:12]}...")
         
         logger.info("SimHoshino OpenAI API服务器启动中...")
-        print("🚀 启动SimHoshino OpenAI API服务器...")
-        print("📡 服务器地址: http://localhost:5000")
-        print("🔗 API端点: http://localhost:5000/v1/chat/completions")
-        print("📋 模型列表: http://localhost:5000/v1/models")
-        print("❤️  健康检查: http://localhost:5000/health")
-        print("="*60)
-        print(f"🔑 API密钥: {api_key}")
-        print("="*60)
-        
-        logger.info("服务器即将在端口5000上启动")
+        print_startup_info(api_key, '0.0.0.0', 5000)
+    else:
+        # 重载后的子进程才处理请求，由它独占设备
+        get_device_pool()
     
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,53 +1,56 @@
-import os
-import subprocess
 import xml.etree.ElementTree as ET
-from pathlib import Path
 from typing import Optional, List
 
+from adb_session import get_adb_path
+from ui_parser import iter_matches
+from ui_snapshot import UISnapshot
+
 
 class MessageExtractor:
     """智能体消息提取器"""
     
-    def __init__(self):
-        """初始化提取器，设置ADB路径"""
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.adb_path = os.path.join(current_dir, "adb.exe")
+    def __init__(self, serial: Optional[str] = None):
+        """
+        初始化提取器，设置ADB路径
+        
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+        """
+        self.adb_path = get_adb_path()
+        self.serial = serial
+        self.xml_data: Optional[bytes] = None
         
     def _capture_ui_data(self) -> bool:
         """
-        捕获UI数据（XML和截图）
+        捕获UI数据（XML直接读入内存）
         
         Returns:
             bool: 是否成功捕获数据
         """
         try:
-            # 1. 获取界面XML
-            subprocess.run([self.adb_path, "shell", "uiautomator", "dump", "/sdcard/ui_dump.xml"], 
-                         check=True, capture_output=True)
-            
-            # 2. 拉取XML到当前目录
-            subprocess.run([self.adb_path, "pull", "/sdcard/ui_dump.xml", "."], 
-                         check=True, capture_output=True)
-            
-            return Path("ui_dump.xml").exists()
+            # 屏幕未变化时复用上一份快照，不再重复dump
+            snapshot = UISnapshot.capture(self.serial)
+            self.xml_data = snapshot.xml_data if snapshot is not None else None
+            return self.xml_data is not None
             
-        except subprocess.CalledProcessError:
+        except Exception:
+            self.xml_data = None
             return False
     
     def _extract_all_texts(self) -> List[str]:
         """
-        从XML文件中提取所有文本内容
+        从内存中的XML提取所有文本内容
         
         Returns:
             List[str]: 所有文本内容列表
         """
         texts = []
-        if not Path("ui_dump.xml").exists():
+        if not self.xml_data:
             return texts
             
         try:
-            tree = ET.parse("ui_dump.xml")
-            for node in tree.iter():
+            root = ET.fromstring(self.xml_data)
+            for node in root.iter():
                 if text := node.attrib.get("text", "").strip():
                     texts.append(text)
         except ET.ParseError:
@@ -70,25 +73,17 @@ class MessageExtractor:
             print("错误：无法获取UI数据")
             return None
         
-        # 2. 提取所有文本
-        texts = self._extract_all_texts()
-        if not texts:
-            print("错误：未找到任何文本内容")
-            return None
-        
-        # 3. 查找目标模式
+        # 2. 流式查找目标模式，找到即停止解析
         target_pattern = f"发送消息给{agent_name}"
         
-        for i, text in enumerate(texts):
-            if target_pattern in text:
-                # 找到了目标文本，返回上一句
-                if i > 0:
-                    previous_text = texts[i - 1]
-                    print(f"找到智能体 '{agent_name}' 的上一句消息: {previous_text}")
-                    return previous_text
-                else:
-                    print(f"找到了 '{target_pattern}'，但它是第一句，没有上一句")
-                    return None
+        for i, previous_text, text in iter_matches(self.xml_data, lambda t: target_pattern in t):
+            # 找到了目标文本，返回上一句
+            if previous_text is not None:
+                print(f"找到智能体 '{agent_name}' 的上一句消息: {previous_text}")
+                return previous_text
+            else:
+                print(f"找到了 '{target_pattern}'，但它是第一句，没有上一句")
+                return None
         
         print(f"未找到 '{target_pattern}' 相关内容")
         return None
@@ -128,12 +123,13 @@ class MessageExtractor:
         return result
 
 
-def get_agent_previous_message(agent_name: str) -> Optional[str]:
+def get_agent_previous_message(agent_name: str, serial: Optional[str] = None) -> Optional[str]:
     """
     便捷函数：获取指定智能体的上一句消息
     
     Args:
         agent_name (str): 智能体名称（如 "黍"）
+        serial (Optional[str]): 设备序列号
         
     Returns:
         Optional[str]: 上一句消息内容
@@ -143,7 +139,7 @@ def get_agent_previous_message(agent_name: str) -> Optional[str]:
         >>> print(message)
         "（语气危险）看来，你这只可爱的小白兔，终于落入了我的手里呢～"
     """
-    extractor = MessageExtractor()
+    extractor = MessageExtractor(serial)
     return extractor.get_previous_message(agent_name)
 
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能体回复完成检测
+发送消息后按退避间隔轮询界面：智能体最后一条消息与发送前不同，
+在连续几次快照中保持不变，并且距离上次变化已经过了一段时间，就认为回复已经完成。
+有界面变化事件时，变化发生后立即读取，轮询间隔只作为没有事件时的兜底
+"""
+
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+# 等待回复的总时限（秒）
+REPLY_DEADLINE = 60.0
+
+# 第一次轮询前的间隔（秒）
+POLL_INITIAL_INTERVAL = 0.5
+
+# 轮询间隔上限（秒）
+POLL_MAX_INTERVAL = 2.0
+
+# 每次未变化时间隔的增长倍数
+POLL_BACKOFF_FACTOR = 1.5
+
+# 回复内容连续相同多少次快照才认为已完成
+STABLE_POLLS = 2
+
+# 回复内容至少保持多久不变才认为已完成（秒）；界面事件触发的读取可能只相隔零点几秒，
+# 只看快照次数会在智能体生成的间隙提前结束
+STABLE_SECONDS = 1.5
+
+
+class ReplyWaitPolicy:
+    """回复等待策略"""
+
+    def __init__(self, deadline: float = REPLY_DEADLINE,
+                 initial_interval: float = POLL_INITIAL_INTERVAL,
+                 max_interval: float = POLL_MAX_INTERVAL,
+                 backoff_factor: float = POLL_BACKOFF_FACTOR,
+                 stable_polls: int = STABLE_POLLS,
+                 stable_seconds: float = STABLE_SECONDS):
+        """
+        Args:
+            deadline (float): 等待回复的总时限（秒）
+            initial_interval (float): 初始轮询间隔（秒）
+            max_interval (float): 轮询间隔上限（秒）
+            backoff_factor (float): 间隔增长倍数
+            stable_polls (int): 判定完成所需的连续相同快照数
+            stable_seconds (float): 判定完成所需的最短不变时间（秒）
+        """
+        self.deadline = deadline
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.stable_polls = max(1, stable_polls)
+        self.stable_seconds = max(0.0, stable_seconds)
+
+    def intervals(self) -> Iterator[float]:
+        """按退避策略产出轮询间隔"""
+        interval = self.initial_interval
+        while True:
+            yield interval
+            interval = min(interval * self.backoff_factor, self.max_interval)
+
+
+class ReplyTracker:
+    """根据连续快照中的回复文本判断回复是否完成（不涉及设备操作）"""
+
+    def __init__(self, baseline: Optional[str] = None, sent_text: Optional[str] = None,
+                 stable_polls: int = STABLE_POLLS, stable_seconds: float = STABLE_SECONDS):
+        """
+        Args:
+            baseline (Optional[str]): 发送前智能体的最后一条消息
+            sent_text (Optional[str]): 本次发送的消息内容
+            stable_polls (int): 判定完成所需的连续相同快照数
+            stable_seconds (float): 判定完成所需的最短不变时间（秒）
+        """
+        self.baseline = baseline.strip() if baseline else None
+        self.sent_text = sent_text.strip() if sent_text else None
+        self.stable_polls = max(1, stable_polls)
+        self.stable_seconds = max(0.0, stable_seconds)
+        self.reply: Optional[str] = None
+        self.changed_at = 0.0
+        self.stable_count = 0
+        self.polls = 0
+
+    def is_new(self, text: Optional[str]) -> bool:
+        """文本是否是发送之后出现的新回复"""
+        if not text:
+            return False
+        text = text.strip()
+        return text != self.baseline and text != self.sent_text
+
+    def observe(self, text: Optional[str]) -> bool:
+        """
+        记录一次快照中的回复文本
+
+        Args:
+            text (Optional[str]): 当前快照中智能体的最后一条消息
+
+        Returns:
+            bool: 回复是否已经完成
+        """
+        self.polls += 1
+        if not self.is_new(text):
+            self.stable_count = 0
+            return False
+
+        if text == self.reply:
+            self.stable_count += 1
+        else:
+            self.reply = text
+            self.changed_at = time.monotonic()
+            self.stable_count = 1
+        return self.completed
+
+    @property
+    def changed(self) -> bool:
+        """最近一次观察是否看到了新的内容"""
+        return self.stable_count == 1
+
+    @property
+    def completed(self) -> bool:
+        if self.reply is None or self.stable_count < self.stable_polls:
+            return False
+        return time.monotonic() - self.changed_at >= self.stable_seconds
+
+
+def iter_reply_updates(read_reply: Callable[[], Optional[str]], tracker: ReplyTracker,
+                       policy: Optional[ReplyWaitPolicy] = None,
+                       cancelled: Optional[threading.Event] = None,
+                       changes: Optional[Any] = None) -> Iterator[str]:
+    """
+    轮询界面，每当回复内容变化时产出当前的完整回复，完成、超时或被取消后结束
+
+    Args:
+        read_reply (Callable[[], Optional[str]]): 捕获一次界面并返回智能体最后一条消息
+        tracker (ReplyTracker): 回复状态跟踪器
+        policy (Optional[ReplyWaitPolicy]): 等待策略
+        cancelled (Optional[threading.Event]): 取消信号（例如客户端已断开）
+        changes (Optional[Any]): 界面变化信号（提供 seq 和 wait_for_change，如 UIEventWatcher）
+
+    Yields:
+        str: 当前的完整回复内容
+    """
+    policy = policy or ReplyWaitPolicy()
+    cancelled = cancelled or threading.Event()
+    end = time.monotonic() + policy.deadline
+    intervals = policy.intervals()
+    seen = changes.seq if changes is not None else 0
+
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        wait = min(next(intervals), remaining)
+        if changes is not None:
+            # 界面变化时提前醒来；间隔内没有事件也读取一次，用来确认回复已稳定
+            changes.wait_for_change(seen, wait, cancelled)
+            seen = changes.seq
+            if cancelled.is_set():
+                return
+        elif cancelled.wait(wait):
+            return
+
+        completed = tracker.observe(read_reply())
+        if tracker.changed:
+            yield tracker.reply
+            # 内容还在变化时回到最短间隔，尽快确认是否稳定
+            intervals = policy.intervals()
+        if completed:
+            return
+
+
+def wait_for_reply(read_reply: Callable[[], Optional[str]], tracker: ReplyTracker,
+                   policy: Optional[ReplyWaitPolicy] = None,
+                   cancelled: Optional[threading.Event] = None,
+                   changes: Optional[Any] = None) -> dict:
+    """
+    轮询直到回复完成或超时
+
+    Args:
+        read_reply (Callable[[], Optional[str]]): 捕获一次界面并返回智能体最后一条消息
+        tracker (ReplyTracker): 回复状态跟踪器
+        policy (Optional[ReplyWaitPolicy]): 等待策略
+        cancelled (Optional[threading.Event]): 取消信号
+        changes (Optional[Any]): 界面变化信号
+
+    Returns:
+        dict: {"reply": 回复内容, "completed": 是否完成, "polls": 轮询次数, "elapsed": 耗时}
+    """
+    start = time.monotonic()
+    for _ in iter_reply_updates(read_reply, tracker, policy, cancelled, changes):
+        pass
+
+    return {
+        "reply": tracker.reply,
+        "completed": tracker.completed,
+        "polls": tracker.polls,
+        "elapsed": time.monotonic() - start
+    }
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+屏幕变化探测
+在设备上对截图的消息区域计算md5并读取当前焦点窗口，只把几十个字节的指纹传回；
+指纹与上一次快照相同时说明界面没有变化，可以跳过完整的层次结构dump。
+截图裁掉顶部的状态栏（时钟）和底部的输入行（闪烁的光标），否则几乎每次探测指纹都会变化
+"""
+
+import hashlib
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+from adb_session import run_shell
+
+# 裁掉的顶部状态栏高度和底部输入行（含导航栏）高度，占屏幕高度的比例
+STATUS_BAR_FRACTION = 0.06
+INPUT_ROW_FRACTION = 0.15
+
+# screencap 原始输出的文件头长度（宽、高、格式、色彩空间各4字节）和每像素字节数
+RAW_HEADER_SIZE = 16
+BYTES_PER_PIXEL = 4
+
+# 读取当前焦点窗口
+FOCUS_COMMAND = "dumpsys window 2>/dev/null | grep -m 1 mCurrentFocus"
+
+# 空输入的md5（screencap不可用时md5sum读到的是空数据）
+_EMPTY_MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+# 各设备的屏幕尺寸（宽, 高）
+_screen_sizes: Dict[Optional[str], Tuple[int, int]] = {}
+_sizes_lock = threading.Lock()
+
+
+def screen_size(serial: Optional[str] = None, timeout: Optional[float] = None) -> Optional[Tuple[int, int]]:
+    """
+    获取设备的屏幕尺寸（第一次读取后缓存）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        timeout (Optional[float]): 超时时间（秒）
+
+    Returns:
+        Optional[Tuple[int, int]]: (宽, 高)，读取失败返回None
+    """
+    with _sizes_lock:
+        size = _screen_sizes.get(serial)
+    if size is not None:
+        return size
+    try:
+        output = run_shell(["wm", "size"], serial=serial, timeout=timeout).stdout
+    except Exception:
+        return None
+    # screencap 输出的是物理分辨率，不受 Override size 影响
+    match = re.search(r"Physical size:\s*(\d+)x(\d+)", output)
+    if not match:
+        return None
+    size = (int(match.group(1)), int(match.group(2)))
+    with _sizes_lock:
+        _screen_sizes[serial] = size
+    return size
+
+
+def build_probe_command(size: Tuple[int, int]) -> str:
+    """
+    构造探测命令：只对截图中状态栏和输入行之间的像素计算摘要
+
+    Args:
+        size (Tuple[int, int]): 屏幕尺寸（宽, 高）
+
+    Returns:
+        str: shell命令
+    """
+    width, height = size
+    row_bytes = width * BYTES_PER_PIXEL
+    top = int(height * STATUS_BAR_FRACTION)
+    bottom = int(height * (1 - INPUT_ROW_FRACTION))
+    start = RAW_HEADER_SIZE + top * row_bytes
+    length = (bottom - top) * row_bytes
+    return (
+        f"screencap 2>/dev/null | tail -c +{start + 1} | head -c {length} | md5sum; "
+        f"{FOCUS_COMMAND}"
+    )
+
+
+def screen_fingerprint(serial: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
+    """
+    获取当前屏幕的指纹
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        timeout (Optional[float]): 超时时间（秒）
+
+    Returns:
+        Optional[str]: 指纹，设备不支持截图或探测失败时返回None
+    """
+    size = screen_size(serial, timeout)
+    if size is None:
+        return None
+    try:
+        output = run_shell(build_probe_command(size), serial=serial, timeout=timeout).stdout
+    except Exception:
+        return None
+
+    lines = output.strip().splitlines()
+    if not lines:
+        return None
+    screen_hash = lines[0].split()[0] if lines[0].split() else ""
+    if not screen_hash or screen_hash == _EMPTY_MD5:
+        return None
+    return hashlib.md5(output.strip().encode("utf-8")).hexdigest()
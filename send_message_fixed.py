@@ -1,40 +1,120 @@
 import os
 import subprocess
+import threading
 import time
 import sys
 import base64
+from typing import Dict, Optional
 
-def enable_adb_keyboard():
-    """确保ADBKeyboard输入法已启用"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    adb_path = os.path.join(current_dir, "adb.exe")
-    
+from adb_session import connection_generation, pull_file, run_shell
+
+# ADBKeyboard输入法
+ADB_KEYBOARD_IME = "com.android.adbkeyboard/.AdbIME"
+
+# 输入框和发送按钮的屏幕坐标
+INPUT_BOX_POS = (500, 1000)
+SEND_BUTTON_POS = (800, 1200)
+
+# 点击输入框后在设备上等待软键盘弹出的最长时间和轮询间隔（秒），
+# 上限与原来固定等待的0.5秒相同，检测不到时也不会比原来更慢
+FOCUS_WAIT_TIMEOUT = 0.5
+FOCUS_POLL_INTERVAL = 0.1
+
+# 批量输入脚本中每一步结果的标记前缀
+STEP_MARKER = "__SIMHOSHINO_STEP__"
+
+# 后台复核输入法状态的间隔（秒）
+IME_REVERIFY_INTERVAL = 60.0
+
+# 已确认启用ADBKeyboard的设备: 序列号 → 确认时的连接代数
+_ime_verified: Dict[Optional[str], int] = {}
+_ime_lock = threading.Lock()
+_ime_verifier: Optional[threading.Thread] = None
+
+def ime_ready(serial=None):
+    """输入法状态缓存是否有效（设备重连后自动失效）"""
+    with _ime_lock:
+        generation = _ime_verified.get(serial)
+    return generation is not None and generation == connection_generation(serial)
+
+def invalidate_ime_state(serial=None):
+    """使设备的输入法状态缓存失效，下次发送前重新检查"""
+    with _ime_lock:
+        _ime_verified.pop(serial, None)
+
+def _mark_ime_ready(serial):
+    global _ime_verifier
+    with _ime_lock:
+        _ime_verified[serial] = connection_generation(serial)
+        if _ime_verifier is None:
+            _ime_verifier = threading.Thread(
+                target=_reverify_ime_loop,
+                name="ime-verifier",
+                daemon=True
+            )
+            _ime_verifier.start()
+
+def _reverify_ime_loop():
+    """后台定期读取当前输入法（只读一次设置），被切换走的设备让缓存失效"""
+    while True:
+        time.sleep(IME_REVERIFY_INTERVAL)
+        with _ime_lock:
+            serials = list(_ime_verified)
+        for serial in serials:
+            try:
+                result = run_shell(
+                    ["settings", "get", "secure", "default_input_method"],
+                    serial=serial,
+                    check=True
+                )
+                if ADB_KEYBOARD_IME not in result.stdout.strip():
+                    print(f"⚠️  设备 {serial or 'default'} 的输入法已被切换，下次发送前重新启用")
+                    invalidate_ime_state(serial)
+            except Exception:
+                invalidate_ime_state(serial)
+
+def ensure_adb_keyboard(serial=None):
+    """
+    确保ADBKeyboard输入法已启用，优先使用缓存的状态
     
+    Args:
+        serial (Optional[str]): 设备序列号
+        
+    Returns:
+        bool: 输入法是否可用
+    """
+    if ime_ready(serial):
+        return True
+    if not enable_adb_keyboard(serial):
+        return False
+    _mark_ime_ready(serial)
+    return True
+
+def enable_adb_keyboard(serial=None):
+    """确保ADBKeyboard输入法已启用"""
     try:
         # 检查当前输入法
-        result = subprocess.run(
-            [adb_path, "shell", "settings", "get", "secure", "default_input_method"],
-            capture_output=True,
-            text=True,
+        result = run_shell(
+            ["settings", "get", "secure", "default_input_method"],
+            serial=serial,
             check=True
         )
         
         current_ime = result.stdout.strip()
-        target_ime = "com.android.adbkeyboard/.AdbIME"
+        target_ime = ADB_KEYBOARD_IME
         
         if target_ime in current_ime:
             print("✅ ADB启动完成")
             return True
         
         # 启用并设置为默认输入法
-        subprocess.run([adb_path, "shell", "ime", "enable", target_ime], check=True)
-        subprocess.run([adb_path, "shell", "ime", "set", target_ime], check=True)
+        run_shell(["ime", "enable", target_ime], serial=serial, check=True)
+        run_shell(["ime", "set", target_ime], serial=serial, check=True)
         
         # 验证设置
-        result = subprocess.run(
-            [adb_path, "shell", "settings", "get", "secure", "default_input_method"],
-            capture_output=True,
-            text=True,
+        result = run_shell(
+            ["settings", "get", "secure", "default_input_method"],
+            serial=serial,
             check=True
         )
         
@@ -49,11 +129,8 @@ def enable_adb_keyboard():
         print(f"❌ 启用输入失败: {str(e)}")
         return False
 
-def input_text_via_b64(text):
+def input_text_via_b64(text, serial=None):
     """使用Base64编码输入文本（更可靠的中文输入方法）"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    adb_path = os.path.join(current_dir, "adb.exe")
-    
     try:
         # 将文本转换为Base64编码
         b64_text = base64.b64encode(text.encode('utf-8')).decode('utf-8')
@@ -61,14 +138,12 @@ def input_text_via_b64(text):
         print(f"使用Base64编码输入文本: '{text}' → {b64_text}")
         
         # 发送ADB_INPUT_B64广播
-        result = subprocess.run(
+        result = run_shell(
             [
-                adb_path, "shell", 
                 "am", "broadcast", "-a", "ADB_INPUT_B64", 
                 "--es", "msg", b64_text
             ],
-            capture_output=True,
-            text=True,
+            serial=serial,
             check=True
         )
         
@@ -81,71 +156,117 @@ def input_text_via_b64(text):
             return False
             
     except subprocess.CalledProcessError as e:
-        print(f"❌ 命令执行失败: {e.stderr}")
+        print(f"❌ 命令执行失败: {e.output}")
         return False
     except Exception as e:
         print(f"❌ 输入文本时发生错误: {str(e)}")
         return False
 
-def send_message_via_adb_keyboard(text):
-    """使用ADBKeyBoard发送消息（完整流程）"""
-    # 1. 确保输入法已启用
-    if not enable_adb_keyboard():
-        print("❌ 无法启用ADB注入")
-        return False
+def build_send_script(text, input_pos=INPUT_BOX_POS, send_pos=SEND_BUTTON_POS):
+    """
+    构造点击输入框 → 等待焦点 → 输入 → 发送的设备端脚本
     
-    # 2. 激活输入框
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    adb_path = os.path.join(current_dir, "adb.exe")
+    每一步输出一行 "标记:步骤:返回码"，失败时后续步骤不再执行。
+    脚本在子shell中运行，exit 不会结束常驻会话
     
-    input_box_x, input_box_y = 500, 1000  # 输入框坐标
+    Args:
+        text (str): 消息内容
+        input_pos (tuple): 输入框坐标
+        send_pos (tuple): 发送按钮坐标
+        
+    Returns:
+        str: shell脚本
+    """
+    b64_text = base64.b64encode(text.encode('utf-8')).decode('utf-8')
+    polls = max(1, int(FOCUS_WAIT_TIMEOUT / FOCUS_POLL_INTERVAL))
+    lines = [
+        # 1. 激活输入框
+        f"input tap {input_pos[0]} {input_pos[1]}",
+        f"rc=$?; echo {STEP_MARKER}:tap:$rc; [ $rc -eq 0 ] || exit $rc",
+        # 2. 等待输入法弹出（超时也继续输入，与原来固定等待的行为一致）
+        "i=0",
+        f"while [ $i -lt {polls} ]; do",
+        "  dumpsys input_method 2>/dev/null | grep -q 'mInputShown=true' && break",
+        f"  sleep {FOCUS_POLL_INTERVAL}; i=$((i+1))",
+        "done",
+        f"[ $i -lt {polls} ]; echo {STEP_MARKER}:focus:$?",
+        # 3. 使用Base64编码输入文本
+        f"out=$(am broadcast -a ADB_INPUT_B64 --es msg {b64_text} 2>&1)",
+        "echo \"$out\" | grep -q 'Broadcast completed'",
+        f"rc=$?; echo {STEP_MARKER}:type:$rc; [ $rc -eq 0 ] || exit $rc",
+        # 4. 发送消息：先尝试回车键，失败再点击发送按钮
+        f"input keyevent 66; rc=$?; echo {STEP_MARKER}:submit:$rc; [ $rc -eq 0 ] && exit 0",
+        f"input tap {send_pos[0]} {send_pos[1]}; rc=$?; echo {STEP_MARKER}:submit_button:$rc; exit $rc",
+    ]
+    return "(\n" + "\n".join(lines) + "\n)"
+
+def parse_step_results(output):
+    """
+    解析批量输入脚本输出的每一步结果
     
+    Args:
+        output (str): 脚本输出
+        
+    Returns:
+        dict: 步骤名 → 返回码（按执行顺序）
+    """
+    steps = {}
+    for line in output.splitlines():
+        if not line.startswith(STEP_MARKER + ":"):
+            continue
+        _, step, rc = line.strip().split(":", 2)
+        steps[step] = int(rc) if rc.lstrip("-").isdigit() else -1
+    return steps
+
+def send_message_via_adb_keyboard(text, serial=None, input_pos=None, send_pos=None):
+    """使用ADBKeyBoard发送消息（完整流程在设备上一次执行，坐标为None时使用默认坐标）"""
+    # 确保输入法已启用（状态已缓存时不访问设备）
+    if not ensure_adb_keyboard(serial):
+        print("❌ 无法启用ADB注入")
+        return False
+    
+    print(f"发送消息: '{text}'")
     try:
-        subprocess.run([adb_path, "shell", "input", "tap", str(input_box_x), str(input_box_y)], check=True)
-        time.sleep(0.5)
+        script = build_send_script(text, input_pos or INPUT_BOX_POS, send_pos or SEND_BUTTON_POS)
+        result = run_shell(script, serial=serial)
     except Exception as e:
         print(f"❌ 注入失败: {str(e)}")
+        invalidate_ime_state(serial)
         return False
     
-    # 3. 使用Base64编码输入文本
-    if not input_text_via_b64(text):
-        print("❌ 文本注入失败")
-        return False
-    
-    # 4. 发送消息
-    send_button_x, send_button_y = 800, 1200  # 发送按钮坐标
-    
-    print("发送消息...")
-    try:
-        # 尝试回车键
-        subprocess.run([adb_path, "shell", "input", "keyevent", "66"], check=True)
-        
+    steps = parse_step_results(result.stdout)
+    if steps.get("tap") != 0:
+        print(f"❌ 注入失败: {result.stdout.strip()}")
+    elif steps.get("type") != 0:
+        print(f"❌ 文本注入失败: {result.stdout.strip()}")
+    elif steps.get("submit") == 0:
+        if steps.get("focus") != 0:
+            print("⚠️  未确认输入框获得焦点")
+        print("✅ 消息发送成功")
         return True
-    except:
-        try:
-            # 尝试发送按钮
-            subprocess.run([adb_path, "shell", "input", "tap", str(send_button_x), str(send_button_y)], check=True)
-            print("✅ 消息发送成功（发送按钮）")
-            return True
-        except Exception as e:
-            print(f"❌ 发送失败: {str(e)}")
-            return False
+    elif steps.get("submit_button") == 0:
+        print("✅ 消息发送成功（发送按钮）")
+        return True
+    else:
+        print(f"❌ 发送失败: {result.stdout.strip()}")
+    
+    invalidate_ime_state(serial)
+    return False
 
-def get_ui_state_for_coordinates():
+def get_ui_state_for_coordinates(serial=None):
     """获取UI状态以确定坐标"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    adb_path = os.path.join(current_dir, "adb.exe")
-    
     print("获取UI状态以确定坐标...")
     
     try:
         # 获取UI层次结构
-        subprocess.run([adb_path, "shell", "uiautomator", "dump", "/sdcard/ui.xml"], check=True)
-        subprocess.run([adb_path, "pull", "/sdcard/ui.xml"], check=True)
+        run_shell(["uiautomator", "dump", "/sdcard/ui.xml"], serial=serial, check=True)
+        with open("ui.xml", "wb") as f:
+            f.write(pull_file("/sdcard/ui.xml", serial))
         
         # 获取屏幕截图
-        subprocess.run([adb_path, "shell", "screencap", "-p", "/sdcard/screen.png"], check=True)
-        subprocess.run([adb_path, "pull", "/sdcard/screen.png"], check=True)
+        run_shell(["screencap", "-p", "/sdcard/screen.png"], serial=serial, check=True)
+        with open("screen.png", "wb") as f:
+            f.write(pull_file("/sdcard/screen.png", serial))
         
         print("✅ UI状态已保存到当前目录")
         print("请查看 screen.png 和 ui.xml 文件以确定正确的坐标")
@@ -154,17 +275,22 @@ def get_ui_state_for_coordinates():
         print(f"❌ 获取UI状态失败: {str(e)}")
         return False
 
-def send_message(message: str) -> bool:
+def send_message(message: str, serial: Optional[str] = None, input_pos=None, send_pos=None) -> bool:
     """
     发送消息的主函数
     
     Args:
         message (str): 要发送的消息内容
+        serial (Optional[str]): 设备序列号，None表示默认设备
+        input_pos (Optional[tuple]): 输入框坐标，None使用默认坐标
+        send_pos (Optional[tuple]): 发送按钮坐标，None使用默认坐标
         
     Returns:
         bool: 发送是否成功
     """
-    return send_message_via_adb_keyboard(message)
+    # 延迟导入：ui_backend 的命令行后端依赖本模块
+    from ui_backend import get_backend
+    return get_backend(serial).send_message(message, input_pos, send_pos)
 
 
 # 测试代码已移除 - 此模块作为库使用
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境入口
+关闭调试器和自动重载，使用多线程WSGI服务器：安装了 waitress 时使用 waitress，
+否则使用 werkzeug 的多线程服务器。
+
+设备归属：默认所有设备由这个进程独占，启动时初始化一次设备池（发现设备并开始预热），
+之后才开始接受请求；不使用多进程预派生，避免多个进程同时操作同一台设备。
+使用 --supervisor 时本进程只处理HTTP，每台设备由一个独立的工作进程独占（见 supervisor.py）
+
+运行: python serve.py [--host 0.0.0.0] [--port 5000] [--threads 16] [--supervisor]
+"""
+
+import argparse
+import os
+import time
+
+from main import app, get_device_pool, load_or_create_api_key, logger, print_banner, print_startup_info
+from supervisor import SUPERVISOR_ENABLED
+
+# 默认监听地址、端口和处理请求的线程数（可用环境变量覆盖）
+DEFAULT_HOST = os.environ.get("SIMHOSHINO_HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.environ.get("SIMHOSHINO_PORT", "5000"))
+DEFAULT_THREADS = int(os.environ.get("SIMHOSHINO_THREADS", "16"))
+
+
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="SimHoshino OpenAI API服务器（生产模式）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS,
+                        help="处理请求的线程数（仅 waitress 使用）")
+    parser.add_argument("--supervisor", action="store_true", default=SUPERVISOR_ENABLED,
+                        help="每台设备使用一个独立的工作进程")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print_banner()
+
+    logger.info("应用程序启动开始（生产模式）")
+    api_key = load_or_create_api_key()
+    logger.info(f"API密钥已准备就绪: {api_key[:12]}...")
+
+    # 在接受请求之前初始化设备池，冷启动耗时固定落在启动阶段
+    started = time.monotonic()
+    device_pool = get_device_pool(supervised=args.supervisor)
+    elapsed = time.monotonic() - started
+    logger.info(f"设备池初始化完成，共 {device_pool.size} 台设备，耗时 {elapsed:.2f}秒")
+
+    print_startup_info(api_key, args.host, args.port)
+
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+
+    if serve is not None:
+        print(f"🍵 使用 waitress，{args.threads} 个线程")
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+        return
+
+    from werkzeug.serving import make_server
+    print("🧵 未安装 waitress，使用 werkzeug 多线程服务器")
+    server = make_server(args.host, args.port, app, threaded=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
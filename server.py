@@ -7,30 +7,36 @@
 
 import sys
 import os
-from typing import Optional, List, Dict
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Iterator, Optional, List, Dict
 
-# 导入三个核心模块
+# 导入核心模块
 try:
     # 导入消息发送模块
     from send_message_fixed import (
         send_message,
-        enable_adb_keyboard,
-        input_text_via_b64,
+        ensure_adb_keyboard,
+        invalidate_ime_state,
         get_ui_state_for_coordinates
     )
     
     # 导入消息提取模块
-    from message_extractor import (
-        MessageExtractor,
-        get_agent_previous_message
-    )
+    from message_extractor import MessageExtractor
     
-    # 导入主功能模块
-    from message_main import (
-        get_page_texts,
-        get_at_symbol_messages,
-        analyze_ui_structure
-    )
+    # 导入UI后端、快照、元素索引和回复检测模块
+    from adb_session import run_shell
+    from ui_backend import get_backend
+    from ui_snapshot import UISnapshot
+    from element_index import get_element_index, resolve_send_targets
+    from device_extract import DEVICE_EXTRACT_ENABLED, device_extract
+    from ui_events import get_event_watcher
+    from snapshot_watcher import WATCHER_ENABLED, SnapshotWatcher
+    from conversation import ConversationModel
+    from stitch_capture import STITCH_ENABLED, StitchedCapture
+    from agent_router import open_agent_chat
+    from reply_detector import ReplyTracker, ReplyWaitPolicy, iter_reply_updates, wait_for_reply
     
     print("✅ 所有模块导入成功")
     
@@ -39,30 +45,312 @@ except ImportError as e:
     print("请确保以下文件存在于当前目录:")
     print("- send_message_fixed.py")
     print("- message_extractor.py")
-    print("- message_main.py")
+    print("- ui_snapshot.py")
+    print("- reply_detector.py")
     sys.exit(1)
 
 
+# 快照默认有效期（秒），超过后查询会重新捕获
+SNAPSHOT_TTL = 1.0
+
+# 连续多少次捕获界面或发送消息失败后把设备标记为未就绪（之后重新预热）
+READY_FAILURE_THRESHOLD = 3
+
+
 class MessageServer:
     """智能体消息处理服务器类"""
     
-    def __init__(self):
-        """初始化聊天器"""
-        self.extractor = MessageExtractor()
+    def __init__(self, serial: Optional[str] = None, snapshot_ttl: float = SNAPSHOT_TTL,
+                 reply_policy: Optional[ReplyWaitPolicy] = None):
+        """
+        初始化聊天器
+        
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+            snapshot_ttl (float): 快照有效期（秒）
+            reply_policy (Optional[ReplyWaitPolicy]): 等待回复的策略
+        """
+        self.serial = serial
+        self.extractor = MessageExtractor(serial)
+        self.snapshot_ttl = snapshot_ttl
+        self.reply_policy = reply_policy or ReplyWaitPolicy()
+        self.snapshot: Optional[UISnapshot] = None
+        self._snapshot_lock = threading.Lock()
+        # 界面变化事件（未配置事件源时为None，等待回复时退回纯轮询）
+        self.events = get_event_watcher(serial)
+        # 后台界面监视（启用后所有查询共用同一个捕获流，不再自行dump）
+        self.watcher = SnapshotWatcher(serial) if WATCHER_ENABLED else None
+        # 可见对话模型（发送时记录已有气泡，之后只识别新出现的气泡）
+        self.conversation = ConversationModel()
+        # 回复超过一屏时滚动拼接（默认关闭）
+        self.stitcher = StitchedCapture(serial) if STITCH_ENABLED else None
+        # 最近一次看到的智能体标记（名称 → 上一句消息），用于粘性路由
+        self.visible_agents: Dict[str, Optional[str]] = {}
+        # 预热状态（由 warm_up 更新，健康检查只读取这里，不访问设备）
+        self.readiness = {
+            "ready": False,
+            "stage": "pending",
+            "error": None,
+            "ime_ready": None,
+            "warm_up_seconds": None,
+            "warmed_at": None
+        }
+        self.last_probe_latency: Optional[float] = None
+        # 连续失败的设备操作次数，以及设备从就绪变为未就绪时的回调（由设备池设置，用于重新预热）
+        self.consecutive_failures = 0
+        self.on_degraded: Optional[Callable[[], None]] = None
         print("🚀 消息服务器初始化完成")
     
-    def get_agent_previous_message(self, agent_name: str) -> Optional[str]:
+    def get_snapshot(self, max_age: Optional[float] = None) -> Optional[UISnapshot]:
+        """
+        获取UI快照，缓存的快照未过期时直接复用
+        
+        Args:
+            max_age (Optional[float]): 允许的最大快照年龄（秒），None使用默认有效期，0表示强制重新捕获
+            
+        Returns:
+            Optional[UISnapshot]: UI快照，捕获失败返回None
+        """
+        max_age = self.snapshot_ttl if max_age is None else max_age
+        if self.watcher is not None:
+            snapshot = self.watcher.get(max_age)
+            self._record_result(snapshot is not None, "捕获界面")
+            return snapshot
+        with self._snapshot_lock:
+            if self.snapshot is not None and max_age > 0 and self.snapshot.is_fresh(max_age):
+                return self.snapshot
+            started = time.monotonic()
+            snapshot = UISnapshot.capture(self.serial)
+            if snapshot is not None:
+                self.snapshot = snapshot
+                self.last_probe_latency = time.monotonic() - started
+        self._record_result(snapshot is not None, "捕获界面")
+        return snapshot
+    
+    @property
+    def probe_latency(self) -> Optional[float]:
+        """最近一次捕获界面的耗时（秒），还没有捕获过时为None"""
+        if self.watcher is not None:
+            return self.watcher.last_capture_seconds
+        return self.last_probe_latency
+    
+    def refresh_snapshot(self) -> Optional[UISnapshot]:
+        """
+        强制重新捕获UI快照
+        
+        Returns:
+            Optional[UISnapshot]: 新的UI快照
+        """
+        return self.get_snapshot(max_age=0)
+    
+    def invalidate_snapshot(self):
+        """丢弃缓存的快照（界面已发生变化时调用）"""
+        with self._snapshot_lock:
+            self.snapshot = None
+        if self.watcher is not None:
+            self.watcher.invalidate()
+    
+    def get_agent_previous_message(self, agent_name: str,
+                                   snapshot: Optional[UISnapshot] = None) -> Optional[str]:
         """
         获取指定智能体的上一句消息
         
         Args:
             agent_name (str): 智能体名称
+            snapshot (Optional[UISnapshot]): 使用的快照，None时使用缓存或重新捕获
             
         Returns:
             Optional[str]: 上一句消息内容
         """
         print(f"📥 正在获取智能体 '{agent_name}' 的上一句消息...")
-        return get_agent_previous_message(agent_name)
+        snapshot = snapshot or self.get_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot.agent_previous_message(agent_name)
+    
+    def detect_agent(self, snapshot: Optional[UISnapshot] = None,
+                     agent_name: Optional[str] = None) -> Dict[str, Optional[str]]:
+        """
+        识别当前对话的智能体及其最后一条消息（发送前调用，作为回复检测的基线）
+        
+        Args:
+            snapshot (Optional[UISnapshot]): 使用的快照，None时使用缓存或重新捕获
+            agent_name (Optional[str]): 已知的智能体名称，None时根据@消息识别
+            
+        Returns:
+            Dict[str, Optional[str]]: {"agent_name": 智能体名称, "baseline": 最后一条消息}
+        """
+        snapshot = snapshot or self.get_snapshot()
+        if snapshot is None:
+            return {"agent_name": agent_name, "baseline": None}
+        
+        if agent_name is not None:
+            return {
+                "agent_name": agent_name,
+                "baseline": self._note_agents(snapshot).get(agent_name)
+            }
+        
+        previous_msg, at_msg = snapshot.at_messages()
+        if not (at_msg and previous_msg):
+            return {"agent_name": None, "baseline": None}
+        
+        agent_name = previous_msg.strip()
+        return {
+            "agent_name": agent_name,
+            "baseline": snapshot.agent_previous_message(agent_name)
+        }
+    
+    def _note_agents(self, snapshot: UISnapshot) -> Dict[str, Optional[str]]:
+        """记录快照中出现的智能体（一次扫描得到所有智能体标记）"""
+        self.visible_agents = snapshot.agent_index()
+        return self.visible_agents
+    
+    def ensure_agent(self, agent_name: str) -> bool:
+        """
+        确保设备停留在指定智能体的聊天界面，不在时尝试切换过去
+        
+        Args:
+            agent_name (str): 智能体名称
+            
+        Returns:
+            bool: 是否已处于该智能体的聊天界面
+        """
+        snapshot = self.get_snapshot()
+        if snapshot is not None and agent_name in self._note_agents(snapshot):
+            return True
+        
+        print(f"🧭 正在切换到智能体 '{agent_name}' 的聊天界面...")
+        try:
+            with self._device_action():
+                snapshot = open_agent_chat(self.serial, agent_name, self.refresh_snapshot)
+        except Exception as e:
+            print(f"❌ 切换智能体失败: {e}")
+            snapshot = None
+        if snapshot is None:
+            self.invalidate_snapshot()
+            return False
+        self._note_agents(snapshot)
+        return True
+    
+    def wait_for_agent_reply(self, agent_name: Optional[str], baseline: Optional[str],
+                             sent_text: Optional[str],
+                             policy: Optional[ReplyWaitPolicy] = None,
+                             cancelled: Optional[threading.Event] = None) -> dict:
+        """
+        轮询界面直到智能体的新回复稳定下来或超时
+        
+        Args:
+            agent_name (Optional[str]): 智能体名称，None时从每次快照中识别
+            baseline (Optional[str]): 发送前智能体的最后一条消息
+            sent_text (Optional[str]): 本次发送的消息内容
+            policy (Optional[ReplyWaitPolicy]): 等待策略，None使用服务器默认策略
+            cancelled (Optional[threading.Event]): 取消信号
+            
+        Returns:
+            dict: {"agent_name", "reply", "completed", "polls", "elapsed"}
+        """
+        policy = policy or self.reply_policy
+        tracker = self._reply_tracker(baseline, sent_text, policy)
+        state = {"agent_name": agent_name}
+        
+        try:
+            with self._turn():
+                result = wait_for_reply(self._reply_reader(state), tracker, policy, cancelled,
+                                        self._change_signal())
+        finally:
+            self.conversation.end_turn()
+        result["agent_name"] = state["agent_name"]
+        return result
+    
+    def stream_agent_reply(self, agent_name: Optional[str], baseline: Optional[str],
+                           sent_text: Optional[str], state: Optional[dict] = None,
+                           policy: Optional[ReplyWaitPolicy] = None,
+                           cancelled: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        持续轮询智能体正在增长的消息，每次内容变化时产出当前完整回复
+        
+        Args:
+            agent_name (Optional[str]): 智能体名称，None时从每次快照中识别
+            baseline (Optional[str]): 发送前智能体的最后一条消息
+            sent_text (Optional[str]): 本次发送的消息内容
+            state (Optional[dict]): 调用方传入的状态字典，结束后包含 agent_name 和 completed
+            policy (Optional[ReplyWaitPolicy]): 等待策略，None使用服务器默认策略
+            cancelled (Optional[threading.Event]): 取消信号（客户端断开时停止轮询）
+            
+        Yields:
+            str: 当前的完整回复内容
+        """
+        policy = policy or self.reply_policy
+        tracker = self._reply_tracker(baseline, sent_text, policy)
+        state = state if state is not None else {}
+        state["agent_name"] = agent_name
+        
+        try:
+            with self._turn():
+                yield from iter_reply_updates(self._reply_reader(state), tracker, policy, cancelled,
+                                              self._change_signal())
+            state["completed"] = tracker.completed
+        finally:
+            self.conversation.end_turn()
+    
+    def _reply_tracker(self, baseline: Optional[str], sent_text: Optional[str],
+                       policy: ReplyWaitPolicy) -> ReplyTracker:
+        """
+        创建回复跟踪器；使用对话增量识别时读到的都是发送后的新气泡，
+        不再与基线比较（智能体重复上一次的回复也能识别）
+        """
+        if self.conversation.in_turn and not DEVICE_EXTRACT_ENABLED:
+            baseline = None
+        return ReplyTracker(baseline, sent_text, policy.stable_polls, policy.stable_seconds)
+    
+    def _turn(self):
+        """等待回复期间让后台监视切换到快速捕获"""
+        return self.watcher.turn() if self.watcher is not None else nullcontext()
+    
+    def _device_action(self):
+        """点击、输入或滑动设备期间暂停后台监视的捕获"""
+        return self.watcher.paused() if self.watcher is not None else nullcontext()
+    
+    def _change_signal(self):
+        """回复检测使用的界面变化信号：后台监视的新快照，其次是界面事件"""
+        return self.watcher if self.watcher is not None else self.events
+    
+    def _reply_reader(self, state: dict) -> Callable[[], Optional[str]]:
+        """构造每次轮询时读取智能体最后一条消息的函数（智能体未知时顺便识别）"""
+        def read_reply() -> Optional[str]:
+            if self.watcher is not None:
+                # 后台监视已在等待时发布了新快照，直接读取最新的一份
+                return self._read_agent_reply(self.watcher.latest(), state)
+            
+            if DEVICE_EXTRACT_ENABLED:
+                # 在设备端完成dump和筛选，只传回需要的文本；失败时退回完整dump
+                extracted = device_extract(self.serial, state["agent_name"])
+                if extracted is not None:
+                    if state["agent_name"] is None:
+                        state["agent_name"] = extracted["agent_name"]
+                        if state["agent_name"] is None:
+                            return None
+                    return extracted["agent_previous"]
+            
+            return self._read_agent_reply(self.refresh_snapshot(), state)
+        return read_reply
+    
+    def _read_agent_reply(self, snapshot: Optional[UISnapshot], state: dict) -> Optional[str]:
+        """从快照中读取智能体的回复（智能体未知时顺便识别）"""
+        if snapshot is None:
+            return None
+        if self.conversation.in_turn:
+            # 只看我们发送之后出现的气泡
+            if state["agent_name"] is None:
+                state["agent_name"] = self.detect_agent(snapshot)["agent_name"]
+            if self.stitcher is not None:
+                return self.conversation.reply_from(self.stitcher.read(snapshot, self._device_action))
+            return self.conversation.reply(snapshot)
+        if state["agent_name"] is None:
+            state["agent_name"] = self.detect_agent(snapshot)["agent_name"]
+            if state["agent_name"] is None:
+                return None
+        return snapshot.agent_previous_message(state["agent_name"])
     
     def send_message_to_chat(self, message: str) -> bool:
         """
@@ -75,26 +363,56 @@ class MessageServer:
             bool: 发送是否成功
         """
         print(f"📤 正在发送消息: '{message}'")
-        return send_message(message)
+        sent = False
+        try:
+            snapshot = self.get_snapshot()
+            # 记录发送前可见的气泡，回复检测只识别之后新出现的气泡
+            self.conversation.begin_turn(snapshot, message)
+            if self.stitcher is not None:
+                self.stitcher.begin(snapshot)
+            # 从当前界面定位输入框和发送按钮，定位不到时使用默认坐标
+            input_pos, send_pos = resolve_send_targets(self.serial, snapshot)
+            with self._device_action():
+                sent = send_message(message, self.serial, input_pos, send_pos)
+            return sent
+        finally:
+            self._record_result(sent, "发送消息")
+            if not sent:
+                # 发送失败时不会再等待回复，本轮对话在这里结束
+                self.conversation.end_turn()
+            # 发送后界面已变化，旧快照不再可信
+            self.invalidate_snapshot()
     
-    def get_page_xml_info(self) -> List[str]:
+    def get_page_xml_info(self, snapshot: Optional[UISnapshot] = None) -> List[str]:
         """
         获取当前页面的所有文本信息
         
+        Args:
+            snapshot (Optional[UISnapshot]): 使用的快照，None时使用缓存或重新捕获
+            
         Returns:
             List[str]: 页面文本列表
         """
         print("📱 正在获取页面文本信息...")
-        return get_page_texts()
+        snapshot = snapshot or self.get_snapshot()
+        if snapshot is None:
+            return []
+        return snapshot.texts
     
-    def extract_at_messages(self) -> tuple:
+    def extract_at_messages(self, snapshot: Optional[UISnapshot] = None) -> tuple:
         """
         提取包含@符号的消息及其前一个元素
         
+        Args:
+            snapshot (Optional[UISnapshot]): 使用的快照，None时使用缓存或重新捕获
+            
         Returns:
             tuple: (previous_message, at_message) 元组
         """
-        return get_at_symbol_messages()
+        snapshot = snapshot or self.get_snapshot()
+        if snapshot is None:
+            return (None, None)
+        return snapshot.at_messages()
     
     def get_ui_debug_info(self) -> bool:
         """
@@ -104,7 +422,7 @@ class MessageServer:
             bool: 是否成功获取调试信息
         """
         print("🔧 正在获取UI调试信息...")
-        return get_ui_state_for_coordinates()
+        return get_ui_state_for_coordinates(self.serial)
     
     def check_adb_keyboard_status(self) -> bool:
         """
@@ -114,17 +432,107 @@ class MessageServer:
             bool: ADB键盘是否可用
         """
         print("⌨️ 正在检查ADB键盘状态...")
-        return enable_adb_keyboard()
+        # 主动检查时总是访问设备，并刷新输入法状态缓存
+        invalidate_ime_state(self.serial)
+        return ensure_adb_keyboard(self.serial)
+    
+    def warm_up(self) -> bool:
+        """
+        预热：连接设备、确认输入法、预先dump一次并建立元素索引，
+        首个请求不再承担这些冷启动开销；结果记录在 readiness 中
+        
+        Returns:
+            bool: 设备是否已就绪
+        """
+        started = time.monotonic()
+        readiness = self.readiness
+        readiness.update(stage="connecting", error=None)
+        self.consecutive_failures = 0
+        try:
+            # 建立到adb服务端的连接（原生协议或常驻会话）
+            run_shell(["echo", "ready"], serial=self.serial, check=True)
+            
+            # uiautomator2 后端使用自己的输入法，只有命令行后端需要ADBKeyboard
+            readiness["stage"] = "ime"
+            backend = get_backend(self.serial)
+            if getattr(backend, "active", backend).name == "cli":
+                readiness["ime_ready"] = self.check_adb_keyboard_status()
+            else:
+                readiness["ime_ready"] = True
+            
+            # 预先dump一次（uiautomator冷启动），并为当前布局建立元素索引
+            readiness["stage"] = "priming"
+            snapshot = self.refresh_snapshot()
+            if snapshot is None:
+                raise RuntimeError("无法获取界面层次结构")
+            get_element_index(self.serial, snapshot)
+            # 记录当前界面上的智能体，首个请求就能按智能体路由到这台设备
+            self._note_agents(snapshot)
+        except Exception as e:
+            readiness.update(ready=False, stage="failed", error=str(e))
+            print(f"❌ 设备 {self.serial or 'default'} 预热失败: {e}")
+            return False
+        
+        ready = bool(readiness["ime_ready"])
+        readiness.update(
+            ready=ready,
+            stage="ready" if ready else "failed",
+            error=None if ready else "ADB键盘不可用",
+            warm_up_seconds=round(time.monotonic() - started, 3),
+            warmed_at=time.time()
+        )
+        if ready:
+            print(f"🔥 设备 {self.serial or 'default'} 预热完成，耗时 {readiness['warm_up_seconds']}秒")
+        return ready
+    
+    def _record_result(self, ok: bool, action: str):
+        """记录一次设备操作的结果，连续失败达到阈值时把设备标记为未就绪"""
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= READY_FAILURE_THRESHOLD:
+            self.mark_unready(f"连续 {self.consecutive_failures} 次{action}失败")
     
-    def analyze_ui_structure(self) -> dict:
+    def mark_unready(self, reason: str, notify: bool = True):
+        """
+        把设备标记为未就绪，就绪检查不再把流量导向这台设备，直到重新预热成功
+        
+        Args:
+            reason (str): 原因
+            notify (bool): 是否调用 on_degraded 安排重新预热（调用方自己安排时为False）
+        """
+        was_ready = self.readiness["ready"]
+        self.consecutive_failures = 0
+        self.readiness.update(ready=False, stage="degraded", error=reason)
+        if not was_ready:
+            return
+        print(f"⚠️  设备 {self.serial or 'default'} 标记为未就绪: {reason}")
+        if notify and self.on_degraded is not None:
+            self.on_degraded()
+    
+    def readiness_status(self) -> dict:
+        """就绪状态和最近一次探测耗时（只读取缓存，不访问设备）"""
+        status = dict(self.readiness)
+        latency = self.probe_latency
+        status["last_probe_latency"] = round(latency, 3) if latency is not None else None
+        return status
+    
+    def analyze_ui_structure(self, snapshot: Optional[UISnapshot] = None) -> dict:
         """
         分析UI结构，返回详细信息
         
+        Args:
+            snapshot (Optional[UISnapshot]): 使用的快照，None时使用缓存或重新捕获
+            
         Returns:
             dict: UI分析结果
         """
         print("🔍 正在分析UI结构...")
-        return analyze_ui_structure()
+        snapshot = snapshot or self.get_snapshot()
+        if snapshot is None:
+            return {"error": "无法获取UI数据"}
+        return snapshot.analyze()
 
 
 # 交互式测试代码已移除 - 此模块作为库使用
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台界面监视
+每台设备一个后台线程持续捕获界面（有对话进行时快速捕获，空闲时放慢），
+把快照连同递增的序号放入有界环形缓冲区；请求不再自己触发dump，
+而是等待"序号大于X且满足条件P的快照"，流式响应、健康检查和分析共用同一个捕获流。
+设备工作线程点击、输入或滑动期间暂停捕获；界面被我们改变之前开始的捕获不会发布
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from ui_snapshot import UISnapshot
+
+# 是否启用后台监视（默认关闭，设置为1时启用）
+WATCHER_ENABLED = os.environ.get("SIMHOSHINO_SNAPSHOT_WATCHER", "0") == "1"
+
+# 环形缓冲区保留的快照数
+RING_CAPACITY = 16
+
+# 有对话进行时两次捕获之间的间隔（秒）
+ACTIVE_INTERVAL = 0.3
+
+# 空闲时两次捕获之间的间隔（秒）
+IDLE_INTERVAL = 5.0
+
+# 按需捕获时等待新快照的最长时间（秒）
+CAPTURE_WAIT_TIMEOUT = 10.0
+
+
+class SnapshotRing:
+    """带序号的有界快照缓冲区"""
+
+    def __init__(self, capacity: int = RING_CAPACITY):
+        """
+        Args:
+            capacity (int): 保留的快照数
+        """
+        self.seq = 0
+        self._items: "deque[Tuple[int, UISnapshot]]" = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+
+    def publish(self, snapshot: UISnapshot) -> int:
+        """
+        发布一个快照
+
+        Args:
+            snapshot (UISnapshot): 新捕获的快照
+
+        Returns:
+            int: 快照序号
+        """
+        with self._cond:
+            self.seq += 1
+            self._items.append((self.seq, snapshot))
+            self._cond.notify_all()
+            return self.seq
+
+    def latest(self) -> Tuple[int, Optional[UISnapshot]]:
+        """最新的快照及其序号（还没有快照时为 (0, None)）"""
+        with self._cond:
+            if not self._items:
+                return 0, None
+            return self._items[-1]
+
+    def _newer_than(self, seq: int) -> List[Tuple[int, UISnapshot]]:
+        return [item for item in self._items if item[0] > seq]
+
+    def wait_for(self, after_seq: int, predicate: Optional[Callable[[UISnapshot], bool]] = None,
+                 timeout: Optional[float] = None,
+                 cancelled: Optional[threading.Event] = None) -> Optional[Tuple[int, UISnapshot]]:
+        """
+        等待序号大于 after_seq 且满足条件的快照
+
+        Args:
+            after_seq (int): 只接受这个序号之后的快照
+            predicate (Optional[Callable[[UISnapshot], bool]]): 快照需要满足的条件，None表示任意快照
+            timeout (Optional[float]): 最长等待时间（秒），None表示一直等待
+            cancelled (Optional[threading.Event]): 取消信号
+
+        Returns:
+            Optional[Tuple[int, UISnapshot]]: (序号, 快照)，超时或取消返回None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        checked = after_seq
+        while True:
+            with self._cond:
+                while self.seq <= checked:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if (remaining is not None and remaining <= 0) or \
+                            (cancelled is not None and cancelled.is_set()):
+                        return None
+                    # 分段等待以便及时响应取消
+                    self._cond.wait(0.2 if remaining is None else min(remaining, 0.2))
+                candidates = self._newer_than(checked)
+
+            # 条件在锁外判断，解析快照时不阻塞发布
+            for seq, snapshot in candidates:
+                checked = seq
+                if predicate is None or predicate(snapshot):
+                    return seq, snapshot
+
+
+class SnapshotWatcher:
+    """单台设备的后台界面监视线程"""
+
+    def __init__(self, serial: Optional[str] = None, capacity: int = RING_CAPACITY):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号
+            capacity (int): 环形缓冲区容量
+        """
+        self.serial = serial
+        self.ring = SnapshotRing(capacity)
+        self.captures = 0
+        self.failures = 0
+        self.last_capture_seconds: Optional[float] = None
+        self._active_turns = 0
+        self._stale_seq = 0
+        self._epoch = 0
+        self._paused_by: Optional[int] = None
+        self._lock = threading.Lock()
+        self._capture_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"snapshot-watcher-{serial or 'default'}",
+            daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def seq(self) -> int:
+        """最新快照的序号"""
+        return self.ring.seq
+
+    @property
+    def active(self) -> bool:
+        """是否有对话正在进行"""
+        return self._active_turns > 0
+
+    def _capture(self) -> Optional[UISnapshot]:
+        """捕获并发布一个快照；捕获期间界面被我们改变（invalidate）时丢弃，返回None"""
+        epoch = self._epoch
+        started = time.monotonic()
+        snapshot = UISnapshot.capture(self.serial)
+        if snapshot is None:
+            self.failures += 1
+            return None
+        self.last_capture_seconds = time.monotonic() - started
+        self.captures += 1
+        with self._lock:
+            if epoch != self._epoch:
+                return None
+            self.ring.publish(snapshot)
+        return snapshot
+
+    def _run(self):
+        """监视线程：按当前节奏持续捕获"""
+        while not self._stop.is_set():
+            with self._capture_lock:
+                epoch = self._epoch
+                snapshot = self._capture()
+            if snapshot is None and epoch != self._epoch:
+                # 捕获到的是改变之前的界面，立即重新捕获
+                continue
+            self._wake.wait(ACTIVE_INTERVAL if self.active else IDLE_INTERVAL)
+            self._wake.clear()
+
+    def stop(self):
+        """停止监视"""
+        self._stop.set()
+        self._wake.set()
+
+    @contextmanager
+    def turn(self) -> Iterator[None]:
+        """对话进行期间切换到快速捕获"""
+        with self._lock:
+            self._active_turns += 1
+        self._wake.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_turns -= 1
+
+    def latest(self) -> Optional[UISnapshot]:
+        """最新的快照（不触发捕获）"""
+        return self.ring.latest()[1]
+
+    def invalidate(self):
+        """界面已被我们改变（例如刚发送了消息），之前的快照和正在进行的捕获都不再视为新鲜"""
+        with self._lock:
+            self._epoch += 1
+            self._stale_seq = self.ring.seq
+        self._wake.set()
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """
+        设备操作（点击、输入、滑动）期间暂停后台捕获，结束后之前的快照全部失效
+
+        进入时等待正在进行的捕获结束；期间本线程调用 get() 会直接在本线程捕获
+        """
+        with self._capture_lock:
+            self._paused_by = threading.get_ident()
+            try:
+                yield
+            finally:
+                self._paused_by = None
+                self.invalidate()
+
+    def get(self, max_age: float) -> Optional[UISnapshot]:
+        """
+        获取足够新的快照，缓冲区中没有时请求立即捕获并等待
+
+        Args:
+            max_age (float): 允许的最大快照年龄（秒），0表示必须是请求之后的新快照
+
+        Returns:
+            Optional[UISnapshot]: 快照，等待超时返回None
+        """
+        seq, snapshot = self.ring.latest()
+        if snapshot is not None and max_age > 0 and seq > self._stale_seq and snapshot.is_fresh(max_age):
+            return snapshot
+        if self._paused_by == threading.get_ident():
+            # 暂停期间后台线程不会捕获，由操作设备的线程自己捕获
+            return self._capture()
+        self._wake.set()
+        result = self.ring.wait_for(seq, timeout=CAPTURE_WAIT_TIMEOUT)
+        return result[1] if result is not None else None
+
+    def wait_for(self, after_seq: int, predicate: Optional[Callable[[UISnapshot], bool]] = None,
+                 timeout: Optional[float] = None,
+                 cancelled: Optional[threading.Event] = None) -> Optional[Tuple[int, UISnapshot]]:
+        """等待序号大于 after_seq 且满足条件的快照（见 SnapshotRing.wait_for）"""
+        return self.ring.wait_for(after_seq, predicate, timeout, cancelled)
+
+    def wait_for_change(self, after_seq: int, timeout: float,
+                        cancelled: Optional[threading.Event] = None) -> bool:
+        """
+        等待新快照发布（与 UIEventWatcher 接口一致，可直接作为回复检测的变化信号）
+
+        Args:
+            after_seq (int): 上次读取时的序号
+            timeout (float): 最长等待时间（秒）
+            cancelled (Optional[threading.Event]): 取消信号
+
+        Returns:
+            bool: 是否有新快照
+        """
+        return self.ring.wait_for(after_seq, timeout=timeout, cancelled=cancelled) is not None
+
+    def stats(self) -> dict:
+        """监视器统计信息"""
+        seq, snapshot = self.ring.latest()
+        return {
+            "seq": seq,
+            "active": self.active,
+            "captures": self.captures,
+            "failures": self.failures,
+            "last_capture_seconds": round(self.last_capture_seconds, 3)
+            if self.last_capture_seconds is not None else None,
+            "latest_age": round(snapshot.age, 3) if snapshot is not None else None
+        }
@@ -26,6 +26,6 @@ echo.
 
 :: 启动服务器
 echo 🌟 启动API服务器...
-python main.py
+python serve.py
 
 pause 
\ No newline at end of file
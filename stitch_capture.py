@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滚动拼接捕获
+回复超过一屏时，单次dump只包含当前可见的部分。这里在每轮对话中维护已经拼接好的气泡列表：
+新的一页与已拼接内容有重叠时直接合并，不需要滚动；没有重叠（中间有内容滚出了屏幕）时
+按固定步长向上滚动消息列表、逐页捕获并去重，直到接上已拼接的内容，然后滚回底部
+"""
+
+import os
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+
+from adb_session import run_shell
+from conversation import extract_bubbles, rekey
+from ui_snapshot import UISnapshot
+
+# 是否启用滚动拼接（默认关闭，设置为1时启用；会实际滚动聊天界面）
+STITCH_ENABLED = os.environ.get("SIMHOSHINO_STITCH", "0") == "1"
+
+# 一次最多向上滚动的页数
+MAX_SCROLL_PAGES = 5
+
+# 每次滚动的距离占消息列表高度的比例（小于1，保证相邻两页有重叠）
+SCROLL_FRACTION = 0.6
+
+# 滑动手势的持续时间（毫秒），较慢的滑动不会产生惯性滚动
+SCROLL_DURATION_MS = 400
+
+# 两页至少要重叠这么多个气泡才算接上（"好的"、"嗯"之类的短回复只靠一个气泡很容易误判）；
+# 某一页总共不到这么多气泡时（如整屏只有一条长回复）例外
+MIN_OVERLAP = 2
+
+Bounds = Tuple[int, int, int, int]
+
+
+def merge_pages(upper: List[Dict], lower: List[Dict]) -> Optional[List[Dict]]:
+    """
+    合并上下两页气泡：找到上页末尾与下页开头最长的重叠部分并去重
+
+    重叠部分的气泡控件id和文本都要一一对应，且至少有 MIN_OVERLAP 个（见其说明）。
+    上页最后一个气泡可能是正在生成的回复，下页中对应的文本只要以它开头就算重叠
+
+    Args:
+        upper (List[Dict]): 位置靠上的气泡列表
+        lower (List[Dict]): 位置靠下的气泡列表
+
+    Returns:
+        Optional[List[Dict]]: 合并后的列表，两页没有重叠时返回None
+    """
+    for k in range(min(len(upper), len(lower)), 0, -1):
+        if k < MIN_OVERLAP and k < len(upper) and k < len(lower):
+            break
+        tail = upper[-k:]
+        head = lower[:k]
+        if all(a["resource_id"] == b["resource_id"] for a, b in zip(tail, head)) \
+                and all(a["text"] == b["text"] for a, b in zip(tail[:-1], head[:-1])) \
+                and head[-1]["text"].startswith(tail[-1]["text"]):
+            return upper[:-k] + lower
+    return None
+
+
+def find_scroll_area(snapshot: UISnapshot) -> Optional[Bounds]:
+    """
+    消息列表的区域：面积最大的可滚动控件
+
+    Args:
+        snapshot (UISnapshot): UI快照
+
+    Returns:
+        Optional[Bounds]: (left, top, right, bottom)，找不到时返回None
+    """
+    candidates = [node["bounds"] for node in snapshot.nodes if node.get("scrollable") and node["bounds"]]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+
+
+class StitchedCapture:
+    """单台设备在一轮对话中的拼接状态"""
+
+    def __init__(self, serial: Optional[str] = None):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号
+        """
+        self.serial = serial
+        self.bubbles: List[Dict] = []
+        self.pages_scrolled = 0
+
+    def begin(self, snapshot: Optional[UISnapshot]):
+        """
+        新一轮对话开始，以发送前的界面作为拼接起点
+
+        Args:
+            snapshot (Optional[UISnapshot]): 发送前的快照
+        """
+        self.bubbles = extract_bubbles(snapshot) if snapshot is not None else []
+
+    def read(self, snapshot: UISnapshot,
+             device_action: Callable[[], ContextManager] = nullcontext) -> List[Dict]:
+        """
+        把当前页合并进已拼接的内容，必要时向上滚动补齐中间缺失的页
+
+        Args:
+            snapshot (UISnapshot): 当前（位于底部的）快照
+            device_action (Callable[[], ContextManager]): 滑动期间进入的上下文（如暂停后台监视）
+
+        Returns:
+            List[Dict]: 拼接后的完整气泡列表
+        """
+        page = extract_bubbles(snapshot)
+        if not self.bubbles:
+            merged = page
+        else:
+            merged = merge_pages(self.bubbles, page)
+            if merged is None:
+                try:
+                    with device_action():
+                        merged = self._scroll_and_stitch(snapshot, page)
+                except Exception as e:
+                    # 保留已经拼接好的内容，当前页接在后面（中间可能缺少一段）
+                    print(f"⚠️  滚动拼接失败，当前页直接接在已拼接的内容之后: {e}")
+                    merged = self.bubbles + page
+        self.bubbles = rekey(merged)
+        return self.bubbles
+
+    def _swipe(self, area: Bounds, towards_top: bool):
+        """在消息列表中滑动一步；towards_top 为True时查看更早的内容"""
+        left, top, right, bottom = area
+        x = (left + right) // 2
+        distance = int((bottom - top) * SCROLL_FRACTION)
+        start = top + (bottom - top - distance) // 2
+        y1, y2 = (start, start + distance) if towards_top else (start + distance, start)
+        run_shell(
+            ["input", "swipe", str(x), str(y1), str(x), str(y2), str(SCROLL_DURATION_MS)],
+            serial=self.serial,
+            check=True
+        )
+
+    def _scroll_and_stitch(self, snapshot: UISnapshot, page: List[Dict]) -> List[Dict]:
+        """向上逐页捕获直到接上已拼接的内容，最后滚回底部"""
+        area = find_scroll_area(snapshot)
+        if area is None:
+            # 无法滚动时当前页直接接在已拼接的内容之后
+            return self.bubbles + page
+
+        collected = page
+        merged = None
+        steps = 0
+        try:
+            while steps < MAX_SCROLL_PAGES:
+                self._swipe(area, towards_top=True)
+                steps += 1
+                upper_snapshot = UISnapshot.capture(self.serial)
+                if upper_snapshot is None:
+                    break
+                upper = extract_bubbles(upper_snapshot)
+                combined = merge_pages(upper, collected)
+                collected = combined if combined is not None else upper + collected
+                merged = merge_pages(self.bubbles, collected)
+                if merged is not None:
+                    break
+        finally:
+            # 多滑一步，确保回到最底部（新消息继续在底部出现）
+            for _ in range(steps + 1):
+                self._swipe(area, towards_top=False)
+            self.pages_scrolled += steps
+
+        if merged is not None:
+            return merged
+        print(f"⚠️  向上滚动 {steps} 页仍未接上之前的内容，回复可能不完整")
+        return self.bubbles + collected
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程设备工作模式
+前端进程只处理HTTP，每台设备由一个独立的工作进程负责（ADB会话、快照缓存和XML解析都在工作进程中），
+两者通过管道交换带长度前缀的JSON消息。多台设备的dump解析分散到多个CPU核心上，
+某个工作进程崩溃只影响这台设备上的请求，前端会自动重新启动它。
+
+设备归属：每台设备只属于一个工作进程，前端进程不直接操作任何设备
+
+消息格式（JSON）：
+    前端 → 工作进程: {"op": "turn", "id", "request"} / {"op": "cancel", "id"} /
+                     {"op": "degraded", "reason"} / {"op": "reset", "reason"} / {"op": "stop"}
+    工作进程 → 前端: {"event": "started" | "sent" | "update" | "end" | "done", "id", ...} / {"event": "status", "status"}
+"""
+
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from chat_turn import ChatTurn
+from device_pool import DevicePool, DeviceSlot
+from work_queue import DEFAULT_TURN_SECONDS, QUEUE_DEPTH, STOP_TIMEOUT, QueueFullError, QueueTimeoutError, WorkItem
+
+# 是否启用多进程模式（默认关闭，设置为1时启用）
+SUPERVISOR_ENABLED = os.environ.get("SIMHOSHINO_SUPERVISOR", "0") == "1"
+
+# 工作进程上报状态的间隔（秒）
+STATUS_INTERVAL = 5.0
+
+# 工作进程退出后重新启动前的等待时间（秒）
+RESTART_DELAY = 2.0
+
+# 工作进程使用 spawn 方式启动（各平台行为一致，不继承前端进程的线程）
+_mp = multiprocessing.get_context("spawn")
+
+
+def encode_message(message: dict) -> bytes:
+    """编码一条消息（长度前缀由管道的 send_bytes 添加）"""
+    return json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+
+def decode_message(data: bytes) -> dict:
+    """解码一条消息"""
+    return json.loads(data.decode("utf-8"))
+
+
+def describe_error(error: Optional[BaseException]) -> Optional[dict]:
+    """把任务异常转换为可以跨进程传递的描述"""
+    if error is None:
+        return None
+    if isinstance(error, QueueTimeoutError):
+        return {"type": "queue_timeout", "waited": error.waited, "retry_after": error.retry_after}
+    if isinstance(error, QueueFullError):
+        return {"type": "queue_full", "retry_after": error.retry_after}
+    return {"type": "error", "message": str(error)}
+
+
+def restore_error(description: Optional[dict]) -> Optional[BaseException]:
+    """按描述还原异常"""
+    if description is None:
+        return None
+    if description["type"] == "queue_timeout":
+        return QueueTimeoutError(description["waited"], description["retry_after"])
+    if description["type"] == "queue_full":
+        return QueueFullError(description["retry_after"])
+    return RuntimeError(description["message"])
+
+
+def worker_main(serial: Optional[str], conn):
+    """
+    设备工作进程入口：独占一台设备，执行前端发来的对话任务
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        conn: 与前端进程相连的管道
+    """
+    slot = DeviceSlot(serial)
+    send_lock = threading.Lock()
+    turns: Dict[int, tuple] = {}
+    stopped = threading.Event()
+
+    def send(message: dict):
+        try:
+            with send_lock:
+                conn.send_bytes(encode_message(message))
+        except (OSError, ValueError):
+            # 前端进程已退出
+            stopped.set()
+
+    def report_status():
+        while not stopped.is_set():
+            send({"event": "status", "status": slot.status(deep=True)})
+            stopped.wait(STATUS_INTERVAL)
+
+    def start_turn(turn_id: int, request: dict):
+        turn = ChatTurn.from_request(request)
+
+        def forward(kind: str, text: Optional[str]):
+            if kind == "sent":
+                send({"event": "sent", "id": turn_id, "send_ok": turn.send_ok,
+                      "turn_context": turn.turn_context})
+            elif kind == "update":
+                send({"event": "update", "id": turn_id, "text": text})
+            elif kind == "end":
+                send(dict(turn.outcome(), event="end", id=turn_id))
+
+        def finished(item: WorkItem):
+            turns.pop(turn_id, None)
+            send({"event": "done", "id": turn_id, "error": describe_error(item.error),
+                  "wait_time": item.wait_time})
+            send({"event": "status", "status": slot.status(deep=True)})
+
+        def run(server):
+            send({"event": "started", "id": turn_id})
+            return turn(server)
+
+        turn.add_listener(forward)
+        try:
+            item = slot.queue.submit(run)
+        except QueueFullError as e:
+            send({"event": "done", "id": turn_id, "error": describe_error(e), "wait_time": 0.0})
+            return
+        turns[turn_id] = (turn, item)
+        item.add_done_callback(finished)
+
+    threading.Thread(target=report_status, name="worker-status", daemon=True).start()
+    while not stopped.is_set():
+        try:
+            message = decode_message(conn.recv_bytes())
+        except (EOFError, OSError):
+            break
+        op = message.get("op")
+        if op == "turn":
+            start_turn(message["id"], message["request"])
+        elif op == "cancel":
+            entry = turns.get(message["id"])
+            if entry is not None:
+                entry[0].cancel()
+                entry[1].cancel()
+        elif op == "degraded":
+            slot.mark_unready(message["reason"])
+        elif op == "reset":
+            slot.reset(message["reason"])
+        elif op == "stop":
+            break
+
+    # 退出前取消进行中的对话并等待队列线程结束，前端才能在同一台设备上启动新的工作进程
+    for turn, item in list(turns.values()):
+        turn.cancel()
+        item.cancel()
+    slot.retire()
+    stopped.set()
+
+
+class WorkerSlot:
+    """由独立工作进程负责的设备（接口与 DeviceSlot 一致，queue 指向自身）"""
+
+    def __init__(self, serial: Optional[str], depth: int = QUEUE_DEPTH):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+            depth (int): 排队深度（不含正在执行的任务）
+        """
+        self.serial = serial
+        self.depth = depth
+        self.server = None
+        self.queue = self
+        self.last_used = 0.0
+        self.restarts = 0
+        self.retired = False
+        self.process = None
+        self.worker_status: Dict[str, Any] = {}
+        self._conn = None
+        self._next_id = 0
+        self._inflight: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._start()
+
+    @property
+    def name(self) -> str:
+        return self.serial or "default"
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def visible_agents(self) -> Dict[str, Optional[str]]:
+        return {name: None for name in self.worker_status.get("agents", [])}
+
+    @property
+    def ready(self) -> bool:
+        return self.alive and self.worker_status.get("ready", False)
+
+    @property
+    def load(self) -> int:
+        """已提交但尚未结束的任务数（工作进程不可用时视为满载）"""
+        if not self.alive:
+            return self.depth + 1
+        return len(self._inflight)
+
+    @property
+    def pending(self) -> int:
+        return max(0, self.load - 1)
+
+    def retry_after(self) -> int:
+        if not self.alive:
+            return max(1, math.ceil(RESTART_DELAY))
+        return max(1, math.ceil(self.worker_status.get("avg_turn_seconds", DEFAULT_TURN_SECONDS)))
+
+    def _start(self):
+        """启动工作进程和读取线程"""
+        parent_conn, child_conn = _mp.Pipe()
+        process = _mp.Process(
+            target=worker_main,
+            args=(self.serial, child_conn),
+            name=f"device-worker-{self.name}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self.process = process
+        print(f"🧩 设备 {self.name} 的工作进程已启动 (pid {process.pid})")
+        threading.Thread(
+            target=self._read_loop,
+            args=(parent_conn,),
+            name=f"worker-reader-{self.name}",
+            daemon=True
+        ).start()
+
+    def _send(self, message: dict) -> bool:
+        try:
+            with self._send_lock:
+                self._conn.send_bytes(encode_message(message))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _read_loop(self, conn):
+        """读取工作进程的消息；管道断开说明工作进程已退出"""
+        while True:
+            try:
+                message = decode_message(conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            self._dispatch(message)
+        self._on_worker_exit(conn)
+
+    def _dispatch(self, message: dict):
+        event = message.get("event")
+        if event == "status":
+            self.worker_status = message["status"]
+            return
+
+        with self._lock:
+            entry = self._inflight.get(message.get("id"))
+        if entry is None:
+            return
+        turn, item, progress = entry
+        if "wait_time" in message and item.started_at is None:
+            item.started_at = item.enqueued_at + message["wait_time"]
+
+        if event == "started":
+            item.start()
+            turn.apply_remote("started", message)
+        elif event in ("sent", "update"):
+            turn.apply_remote(event, message)
+        elif event == "end":
+            progress["ended"] = True
+            turn.apply_remote("end", message)
+        elif event == "done":
+            self._finish(message["id"], restore_error(message.get("error")))
+
+    def _finish(self, turn_id: int, error: Optional[BaseException]):
+        """结束前端的任务对象（任务没有在工作进程中执行时也结束对话）"""
+        with self._lock:
+            entry = self._inflight.pop(turn_id, None)
+        if entry is None:
+            return
+        turn, item, progress = entry
+        if not progress["ended"]:
+            turn.apply_remote("end", {})
+        item.error = error
+        item.finished_at = time.monotonic()
+        item.finish()
+
+    def _on_worker_exit(self, conn):
+        """工作进程退出：结束所有进行中的任务，稍后重新启动"""
+        if conn is not self._conn:
+            return
+        self.process.join(1)
+        code = self.process.exitcode
+        if self.retired:
+            print(f"👋 设备 {self.name} 的工作进程已停止")
+        else:
+            print(f"💥 设备 {self.name} 的工作进程已退出 (exitcode {code})，{RESTART_DELAY:.0f}秒后重启")
+        with self._lock:
+            turn_ids = list(self._inflight)
+        for turn_id in turn_ids:
+            self._finish(turn_id, RuntimeError(f"设备 {self.name} 的工作进程已退出"))
+        self.worker_status = {}
+        if self.retired:
+            return
+
+        def restart():
+            if self.retired:
+                return
+            self.restarts += 1
+            self._start()
+        timer = threading.Timer(RESTART_DELAY, restart)
+        timer.daemon = True
+        timer.start()
+
+    def submit(self, turn: ChatTurn) -> WorkItem:
+        """
+        把一轮对话发给工作进程
+
+        Args:
+            turn (ChatTurn): 对话任务（只支持 ChatTurn，任务在工作进程中按请求重建）
+
+        Returns:
+            WorkItem: 前端的任务对象，工作进程报告结束时完成
+        """
+        with self._lock:
+            if self.load >= self.depth + 1:
+                raise QueueFullError(self.retry_after())
+            self._next_id += 1
+            turn_id = self._next_id
+            item = WorkItem(turn)
+            self._inflight[turn_id] = (turn, item, {"ended": False})
+
+        def forward_cancel(kind: str, text: Optional[str]):
+            if kind == "cancel":
+                self._send({"op": "cancel", "id": turn_id})
+
+        turn.add_listener(forward_cancel)
+        if not self._send({"op": "turn", "id": turn_id, "request": turn.to_request()}):
+            with self._lock:
+                self._inflight.pop(turn_id, None)
+            raise QueueFullError(self.retry_after())
+        return item
+
+    def stats(self) -> dict:
+        return {
+            "worker_pid": self.process.pid if self.process is not None else None,
+            "worker_alive": self.alive,
+            "worker_restarts": self.restarts,
+            "in_flight": len(self._inflight)
+        }
+
+    def status(self, deep: bool = False) -> dict:
+        """设备当前状态（工作进程最近上报的状态加上进程信息）"""
+        status = dict(self.worker_status)
+        if not deep:
+            status.pop("readiness", None)
+        status["serial"] = self.name
+        status["ready"] = self.ready
+        status.update(self.stats())
+        return status
+
+    def mark_unready(self, reason: str):
+        """把设备标记为未就绪，由工作进程重新预热"""
+        self.worker_status["ready"] = False
+        self._send({"op": "degraded", "reason": reason})
+
+    def reset(self, reason: str):
+        """设备原地修复后由同一个工作进程取消当前任务并重新预热"""
+        self.worker_status["ready"] = False
+        self._send({"op": "reset", "reason": reason})
+
+    def stop(self):
+        """停止工作进程"""
+        self._send({"op": "stop"})
+
+    def retire(self) -> List[WorkItem]:
+        """
+        设备已被替换，停止工作进程且不再重启；等待进程退出后才返回，
+        以免新的工作进程和它同时操作同一台设备
+
+        Returns:
+            List[WorkItem]: 总是为空：任务都已交给工作进程，工作进程退出时以错误结束
+        """
+        self.retired = True
+        self.stop()
+        if self.process is not None:
+            self.process.join(STOP_TIMEOUT + RESTART_DELAY)
+            if self.process.is_alive():
+                print(f"⚠️  设备 {self.name} 的工作进程没有按时退出，强制结束")
+                self.process.terminate()
+                self.process.join(RESTART_DELAY)
+        return []
+
+    def adopt(self, items: List[WorkItem]):
+        """接收被替换设备上的任务（工作进程模式下没有可转交的任务，以队列已满结束）"""
+        for item in items:
+            item.error = QueueFullError(self.retry_after())
+            item.finish()
+
+
+class SupervisedPool(DevicePool):
+    """每台设备一个工作进程的设备池"""
+
+    slot_class = WorkerSlot
@@ -0,0 +1,14 @@
+from agent_router import AGENTS_ENV, DEFAULT_MODEL, known_agents, resolve_agent
+
+
+def test_known_agents_merges_configured_and_visible(monkeypatch):
+    monkeypatch.setenv(AGENTS_ENV, "星野, 助手")
+    assert known_agents(["助手", "小爱"]) == ["星野", "助手", "小爱"]
+
+
+def test_resolve_agent():
+    agents = ["星野"]
+    assert resolve_agent(None, agents) is None
+    assert resolve_agent(DEFAULT_MODEL, agents) is None
+    assert resolve_agent("gpt-3.5-turbo", agents) is None
+    assert resolve_agent(" 星野 ", agents) == "星野"
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+import device_pool
+from device_pool import DevicePool
+
+
+class FakeServer:
+    """代替 MessageServer，只记录预热"""
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.readiness = {"ready": False}
+        self.visible_agents = {}
+        self.watcher = None
+        self.events = None
+        self.on_degraded = None
+        self.log = []
+
+    def warm_up(self):
+        self.log.append("warm_up")
+        self.readiness["ready"] = True
+        return True
+
+    def mark_unready(self, reason, notify=True):
+        self.readiness["ready"] = False
+
+
+class BlockingTurn:
+    """一直执行到被取消的对话任务"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+    def __call__(self, server):
+        self.started.set()
+        self.cancelled.wait(5)
+        return "cancelled"
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(device_pool, "MessageServer", FakeServer)
+    pool = DevicePool(["emu-a"])
+    yield pool
+    for slot in pool.slots:
+        slot.retire()
+
+
+def wait_ready(slot):
+    _, item = slot.serial, slot.queue.submit(lambda server: None)
+    item.wait(2)
+
+
+def worker_threads(name):
+    return [thread for thread in threading.enumerate() if thread.name == f"device-worker-{name}"]
+
+
+def test_same_serial_resets_existing_slot(pool):
+    slot = pool.slots[0]
+    wait_ready(slot)
+    turn = BlockingTurn()
+    _, running = pool.submit(turn)
+    assert turn.started.wait(2)
+    queued = slot.queue.submit(lambda server: server.log.append("queued"))
+
+    assert pool.replace("emu-a", "emu-a") is slot
+    assert running.wait(2) == "cancelled"
+    queued.wait(2)
+    # 预热排在重置前已经排队的任务之前，并且始终只有一个工作线程
+    assert slot.server.log == ["warm_up", "warm_up", "queued"]
+    assert len(worker_threads("emu-a")) == 1
+
+
+def test_replace_stops_old_worker_before_new_slot_warms_up(pool, monkeypatch):
+    old_slot = pool.slots[0]
+    wait_ready(old_slot)
+    turn = BlockingTurn()
+    _, running = pool.submit(turn)
+    assert turn.started.wait(2)
+    queued = old_slot.queue.submit(lambda server: server.log.append("queued"))
+
+    old_worker_alive = []
+    original_warm_up = FakeServer.warm_up
+
+    def warm_up(server):
+        old_worker_alive.append(old_slot.queue._worker.is_alive())
+        return original_warm_up(server)
+
+    monkeypatch.setattr(FakeServer, "warm_up", warm_up)
+    new_slot = pool.replace("emu-a", "emu-c")
+
+    assert running.wait(2) == "cancelled"
+    queued.wait(2)
+    assert old_worker_alive == [False]
+    assert new_slot.server.log == ["warm_up", "queued"]
+    assert [slot.name for slot in pool.slots] == ["emu-c"]
+    assert pool.get("emu-a") is None
+    assert worker_threads("emu-a") == []
@@ -0,0 +1,90 @@
+import emulator_manager
+from emulator_manager import CommandRunner, EmulatorConsole, EmulatorManager, serial_for_index
+
+
+class FakeRunner(CommandRunner):
+    """模拟控制台：记录命令，launch / reboot 让实例开机"""
+
+    def __init__(self, running, healthy):
+        self.running = running
+        self.healthy = healthy
+        self.calls = []
+
+    def run(self, args, timeout):
+        command = args[1]
+        self.calls.append(args[1:])
+        if command == "list2":
+            lines = [f"{index},LD-{index},0,0,{1 if on else 0},{100 + index if on else -1},0"
+                     for index, on in self.running.items()]
+            return 0, "\n".join(lines)
+        index = int(args[3])
+        if command in ("launch", "reboot"):
+            self.running[index] = True
+            self.healthy[serial_for_index(index)] = True
+        return 0, ""
+
+
+class FakePool:
+    def __init__(self):
+        self.replaced = []
+        self.manager = None
+
+    def replace(self, old_serial, new_serial):
+        self.replaced.append((old_serial, new_serial))
+
+    def mark_unready(self, serial, reason):
+        pass
+
+
+def make_manager(monkeypatch, running, healthy, active, spares):
+    monkeypatch.setattr(emulator_manager, "BOOT_TIMEOUT", 0.3)
+    monkeypatch.setattr(emulator_manager, "BOOT_POLL_INTERVAL", 0.05)
+    runner = FakeRunner(running, healthy)
+    manager = EmulatorManager(EmulatorConsole("ldconsole.exe", runner), active, spares,
+                              probe=lambda serial: healthy.get(serial, False))
+    return manager, runner
+
+
+def test_start_launches_stopped_instances(monkeypatch):
+    healthy = {}
+    manager, runner = make_manager(monkeypatch, {0: False}, healthy, [0], [])
+    try:
+        assert manager.start() == ["emulator-5554"]
+    finally:
+        manager.stop()
+    assert ["launch", "--index", "0"] in runner.calls
+
+
+def test_failed_active_instance_is_replaced_by_spare(monkeypatch):
+    # 实例0已在运行但一直无响应，备用实例1正常
+    healthy = {"emulator-5556": True}
+    manager, _ = make_manager(monkeypatch, {0: True, 1: True}, healthy, [0], [1])
+    try:
+        assert manager.start() == ["emulator-5556"]
+    finally:
+        manager.stop()
+
+
+def test_replace_swaps_in_spare_and_repair_resets_slot(monkeypatch):
+    healthy = {"emulator-5554": True, "emulator-5556": True}
+    manager, _ = make_manager(monkeypatch, {0: True, 1: True}, healthy, [0], [1])
+    pool = FakePool()
+    try:
+        manager.start()
+        manager.attach(pool)
+        failed, spare = manager.instances
+
+        failed.state = "degraded"
+        manager._replace(failed)
+        assert pool.replaced == [("emulator-5554", "emulator-5556")]
+        assert (failed.role, spare.role) == ("spare", "active")
+
+        # 没有备用实例时原地修复，修复后重置原来的设备槽位
+        pool.replaced.clear()
+        spare.state = "failed"
+        manager._replace(spare)
+        assert pool.replaced == []
+        manager._recovered(spare)
+        assert pool.replaced == [("emulator-5556", "emulator-5556")]
+    finally:
+        manager.stop()
@@ -0,0 +1,49 @@
+import threading
+
+from reply_detector import ReplyTracker, ReplyWaitPolicy, wait_for_reply
+
+
+def test_baseline_and_sent_text_are_not_replies():
+    tracker = ReplyTracker(baseline="旧回复", sent_text="你好", stable_polls=1, stable_seconds=0)
+    assert tracker.observe("旧回复") is False
+    assert tracker.observe(" 你好 ") is False
+    assert tracker.observe(None) is False
+    assert tracker.reply is None
+
+
+def test_reply_completes_after_stable_polls():
+    tracker = ReplyTracker(baseline="旧回复", stable_polls=2, stable_seconds=0)
+    assert tracker.observe("新") is False
+    assert tracker.changed
+    assert tracker.observe("新回复") is False
+    assert tracker.observe("新回复") is True
+    assert tracker.reply == "新回复"
+
+
+def test_reply_needs_minimum_stable_duration():
+    tracker = ReplyTracker(stable_polls=1, stable_seconds=60)
+    assert tracker.observe("回复") is False
+    assert tracker.observe("回复") is False
+    assert not tracker.completed
+
+
+def test_wait_for_reply_returns_final_text():
+    texts = iter(["旧回复", "生成中", "生成完成", "生成完成", "生成完成"])
+    tracker = ReplyTracker(baseline="旧回复", stable_polls=2, stable_seconds=0)
+    policy = ReplyWaitPolicy(deadline=5, initial_interval=0.01, max_interval=0.01)
+
+    result = wait_for_reply(lambda: next(texts, "生成完成"), tracker, policy)
+    assert result["completed"] is True
+    assert result["reply"] == "生成完成"
+    assert result["polls"] == 4
+
+
+def test_wait_for_reply_stops_when_cancelled():
+    cancelled = threading.Event()
+    cancelled.set()
+    tracker = ReplyTracker()
+    policy = ReplyWaitPolicy(deadline=5, initial_interval=0.01)
+
+    result = wait_for_reply(lambda: "回复", tracker, policy, cancelled)
+    assert result["completed"] is False
+    assert result["polls"] == 0
@@ -0,0 +1,21 @@
+from send_message_fixed import FOCUS_POLL_INTERVAL, FOCUS_WAIT_TIMEOUT, STEP_MARKER, build_send_script, parse_step_results
+
+
+def test_parse_step_results():
+    output = "\n".join([
+        f"{STEP_MARKER}:tap:0",
+        "Broadcasting: Intent { act=ADB_INPUT_B64 }",
+        f"{STEP_MARKER}:focus:1",
+        f"{STEP_MARKER}:type:0",
+        f"{STEP_MARKER}:submit:x",
+    ])
+    assert parse_step_results(output) == {"tap": 0, "focus": 1, "type": 0, "submit": -1}
+
+
+def test_send_script_waits_for_input_method():
+    script = build_send_script("你好", (1, 2), (3, 4))
+    polls = int(FOCUS_WAIT_TIMEOUT / FOCUS_POLL_INTERVAL)
+    assert "input tap 1 2" in script
+    assert "mInputShown=true" in script
+    assert f"while [ $i -lt {polls} ]" in script
+    assert "input tap 3 4" in script
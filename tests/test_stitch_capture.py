@@ -0,0 +1,39 @@
+from stitch_capture import merge_pages
+
+
+def bubble(text, resource_id="msg"):
+    return {"text": text, "resource_id": resource_id}
+
+
+def texts(bubbles):
+    return None if bubbles is None else [item["text"] for item in bubbles]
+
+
+def test_merges_on_longest_overlap():
+    upper = [bubble("A"), bubble("B"), bubble("C")]
+    lower = [bubble("B"), bubble("C"), bubble("D")]
+    assert texts(merge_pages(upper, lower)) == ["A", "B", "C", "D"]
+
+
+def test_growing_reply_counts_as_overlap():
+    upper = [bubble("A"), bubble("回复开")]
+    lower = [bubble("A"), bubble("回复开头更多")]
+    assert texts(merge_pages(upper, lower)) == ["A", "回复开头更多"]
+
+
+def test_single_short_bubble_is_not_enough():
+    upper = [bubble("A"), bubble("好的")]
+    lower = [bubble("好的"), bubble("B")]
+    assert merge_pages(upper, lower) is None
+
+
+def test_single_bubble_page_can_overlap():
+    upper = [bubble("A"), bubble("长回复")]
+    lower = [bubble("长回复的后半部分")]
+    assert texts(merge_pages(upper, lower)) == ["A", "长回复的后半部分"]
+
+
+def test_overlap_requires_same_controls():
+    upper = [bubble("A"), bubble("x", "user")]
+    lower = [bubble("A"), bubble("x", "agent"), bubble("y")]
+    assert merge_pages(upper, lower) is None
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from work_queue import DEFAULT_TURN_SECONDS, DeviceWorkQueue, QueueFullError, QueueTimeoutError
+
+
+class BlockingTask:
+    """一直执行到被取消或放行的任务"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.cancelled = False
+
+    def __call__(self, target):
+        self.started.set()
+        self.release.wait(5)
+        return "cancelled" if self.cancelled else "done"
+
+    def cancel(self):
+        self.cancelled = True
+        self.release.set()
+
+
+def test_full_queue_rejects_with_retry_after():
+    task = BlockingTask()
+    work_queue = DeviceWorkQueue("full", None, depth=1)
+    work_queue.submit(task)
+    assert task.started.wait(2)
+    work_queue.submit(lambda target: None)
+
+    with pytest.raises(QueueFullError) as info:
+        work_queue.submit(lambda target: None)
+    assert info.value.retry_after == int(DEFAULT_TURN_SECONDS)
+    assert work_queue.stats()["rejected"] == 1
+
+    task.release.set()
+    work_queue.stop()
+
+
+def test_items_waiting_too_long_expire():
+    task = BlockingTask()
+    work_queue = DeviceWorkQueue("expire", None, depth=2, wait_timeout=0.05)
+    work_queue.submit(task)
+    assert task.started.wait(2)
+    late = work_queue.submit(lambda target: "ran")
+    time.sleep(0.1)
+    task.release.set()
+
+    with pytest.raises(QueueTimeoutError):
+        late.wait(2)
+    assert work_queue.stats()["expired"] == 1
+    work_queue.stop()
+
+
+def test_cancelled_item_does_not_run():
+    task = BlockingTask()
+    work_queue = DeviceWorkQueue("cancel", None)
+    work_queue.submit(task)
+    assert task.started.wait(2)
+    ran = []
+    item = work_queue.submit(lambda target: ran.append(True))
+
+    assert item.cancel() is True
+    task.release.set()
+    item.wait(2)
+    assert ran == []
+    work_queue.stop()
+
+
+def test_stop_cancels_current_and_joins_worker():
+    task = BlockingTask()
+    work_queue = DeviceWorkQueue("stop", None)
+    running = work_queue.submit(task)
+    assert task.started.wait(2)
+    queued = work_queue.submit(lambda target: "never")
+
+    assert work_queue.stop(timeout=2) is True
+    assert running.wait(1) == "cancelled"
+    with pytest.raises(QueueFullError):
+        queued.wait(1)
+    with pytest.raises(QueueFullError):
+        work_queue.submit(lambda target: None)
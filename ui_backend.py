@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可替换的界面操作后端
+MessageExtractor 和 send_message 只通过这里获取界面层次结构和输入文本：
+- uiautomator2: 设备上的atx-agent常驻，通过HTTP/JSON-RPC获取层次结构和输入，省去CLI冷启动
+- cli: `uiautomator dump` 命令行加 ADBKeyboard 广播，作为回退路径
+- auto: 获取界面优先用uiautomator2，发送消息始终走命令行
+
+发送消息的输入法状态缓存和批量输入脚本（send_message_fixed）只用于命令行发送，
+即 auto 和 cli 模式；uiautomator2 模式用自带输入法输入，每次发送都会让ADBKeyboard的缓存失效
+"""
+
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+from send_message_fixed import INPUT_BOX_POS, SEND_BUTTON_POS, invalidate_ime_state, send_message_via_adb_keyboard
+from ui_capture import dump_hierarchy as cli_dump_hierarchy
+
+# 界面后端: auto（uiautomator2可用时优先使用，否则回退到命令行）、uiautomator2、cli
+UI_BACKEND = os.environ.get("SIMHOSHINO_UI_BACKEND", "auto")
+
+# uiautomator2 失败后，在这段时间内直接使用命令行后端（秒）
+RPC_RETRY_INTERVAL = 30.0
+
+# 未指定超时时间时uiautomator2获取界面的超时时间（秒）
+RPC_DUMP_TIMEOUT = 30.0
+
+Point = Tuple[int, int]
+
+
+class UIBackend(ABC):
+    """界面后端接口"""
+
+    name = "base"
+
+    def __init__(self, serial: Optional[str] = None):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号，None表示默认设备
+        """
+        self.serial = serial
+
+    @abstractmethod
+    def dump_hierarchy(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        捕获当前界面的UI层次结构
+
+        Args:
+            timeout (Optional[float]): 超时时间（秒）
+
+        Returns:
+            Optional[bytes]: XML字节内容，失败返回None
+        """
+
+    @abstractmethod
+    def send_message(self, text: str, input_pos: Optional[Point] = None,
+                     send_pos: Optional[Point] = None) -> bool:
+        """
+        点击输入框、输入文本并发送
+
+        Args:
+            text (str): 消息内容
+            input_pos (Optional[Point]): 输入框坐标，None使用默认坐标
+            send_pos (Optional[Point]): 发送按钮坐标，None使用默认坐标
+
+        Returns:
+            bool: 发送是否成功
+        """
+
+
+class CliBackend(UIBackend):
+    """命令行后端（uiautomator dump + ADBKeyboard）"""
+
+    name = "cli"
+
+    def dump_hierarchy(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        return cli_dump_hierarchy(self.serial, timeout)
+
+    def send_message(self, text: str, input_pos: Optional[Point] = None,
+                     send_pos: Optional[Point] = None) -> bool:
+        return send_message_via_adb_keyboard(text, self.serial, input_pos, send_pos)
+
+
+class Uiautomator2Backend(UIBackend):
+    """uiautomator2后端（设备上的atx-agent常驻，连接在首次使用时建立并复用）"""
+
+    name = "uiautomator2"
+
+    def __init__(self, serial: Optional[str] = None):
+        super().__init__(serial)
+        self._device = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        """是否安装了uiautomator2"""
+        try:
+            import uiautomator2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def device(self):
+        """获取uiautomator2设备对象（首次调用时连接并启动atx-agent）"""
+        with self._lock:
+            if self._device is None:
+                import uiautomator2
+                self._device = uiautomator2.connect(self.serial)
+            return self._device
+
+    def reset(self):
+        """丢弃当前连接，下次使用时重新连接"""
+        with self._lock:
+            self._device = None
+
+    def dump_hierarchy(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        # 直接调用JSON-RPC以便把超时交给HTTP请求本身，超时后不会留下仍在等待的线程
+        xml = self.device().jsonrpc.dumpWindowHierarchy(
+            False, None,
+            http_timeout=RPC_DUMP_TIMEOUT if timeout is None else timeout
+        )
+        return xml.encode("utf-8") if xml else None
+
+    def send_message(self, text: str, input_pos: Optional[Point] = None,
+                     send_pos: Optional[Point] = None) -> bool:
+        """
+        点击输入框、输入文本并点击发送按钮
+
+        输入文本之前的失败（连接、点击输入框）直接抛出；
+        开始输入之后消息可能已经发出，此时的失败只返回False，不能再重发
+        """
+        device = self.device()
+        device.click(*(input_pos or INPUT_BOX_POS))
+        # send_keys 会切换到uiautomator2自带的输入法，ADBKeyboard的状态缓存随之失效
+        invalidate_ime_state(self.serial)
+        try:
+            device.send_keys(text, clear=True)
+            device.click(*(send_pos or SEND_BUTTON_POS))
+        except Exception as e:
+            print(f"❌ uiautomator2输入或发送失败，消息可能已经发出: {e}")
+            return False
+        return True
+
+
+class AutoBackend(UIBackend):
+    """
+    获取界面优先使用uiautomator2，出错时回退到命令行并在一段时间后再次尝试；
+    发送消息始终走命令行，以便使用输入法状态缓存和批量输入脚本
+    """
+
+    name = "auto"
+
+    def __init__(self, serial: Optional[str] = None):
+        super().__init__(serial)
+        self.rpc = Uiautomator2Backend(serial) if Uiautomator2Backend.available() else None
+        self.cli = CliBackend(serial)
+        self._rpc_unavailable_until = 0.0
+
+    @property
+    def active(self) -> UIBackend:
+        """当前实际使用的后端"""
+        if self.rpc is not None and time.monotonic() >= self._rpc_unavailable_until:
+            return self.rpc
+        return self.cli
+
+    def _rpc_failed(self, action: str, error: Exception):
+        print(f"⚠️  uiautomator2{action}失败，暂时改用命令行: {error}")
+        self.rpc.reset()
+        self._rpc_unavailable_until = time.monotonic() + RPC_RETRY_INTERVAL
+
+    def dump_hierarchy(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        if self.active is self.rpc:
+            try:
+                xml_data = self.rpc.dump_hierarchy(timeout)
+                if xml_data is not None:
+                    return xml_data
+            except Exception as e:
+                self._rpc_failed("获取界面", e)
+        return self.cli.dump_hierarchy(timeout)
+
+    def send_message(self, text: str, input_pos: Optional[Point] = None,
+                     send_pos: Optional[Point] = None) -> bool:
+        return self.cli.send_message(text, input_pos, send_pos)
+
+
+_BACKEND_TYPES = {
+    "auto": AutoBackend,
+    "uiautomator2": Uiautomator2Backend,
+    "cli": CliBackend
+}
+
+_backends: Dict[Optional[str], UIBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(serial: Optional[str] = None) -> UIBackend:
+    """
+    获取设备的界面后端（每台设备一个实例）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+
+    Returns:
+        UIBackend: 界面后端
+    """
+    with _backends_lock:
+        backend = _backends.get(serial)
+        if backend is None:
+            backend_type = _BACKEND_TYPES.get(UI_BACKEND, AutoBackend)
+            backend = backend_type(serial)
+            _backends[serial] = backend
+        return backend
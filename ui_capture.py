@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI层次结构内存捕获
+`uiautomator dump` 直接输出到标准输出并读入内存，一次设备往返即可拿到XML，
+不再经过 /sdcard 中转，也不在本地落盘
+"""
+
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from adb_session import exec_out
+
+# 直接输出到终端的dump目标
+TTY_DUMP_TARGET = "/dev/tty"
+
+# 部分系统不支持 /dev/tty 时的临时文件目录（单条命令内写入、读取并删除）
+FALLBACK_DUMP_DIR = "/data/local/tmp"
+
+# 连续失败多少次后认为设备不支持 /dev/tty 输出
+# （界面动画时偶尔出现的 "could not get idle state" 不应该直接判定为不支持）
+TTY_FAILURE_LIMIT = 3
+
+# 判定不支持后，隔多久重新尝试 /dev/tty 输出（秒）
+TTY_REPROBE_INTERVAL = 300.0
+
+# 各设备 /dev/tty 输出的连续失败次数和停用截止时间，避免不支持的设备每次都先失败一次
+_tty_failures: Dict[Optional[str], int] = {}
+_tty_disabled_until: Dict[Optional[str], float] = {}
+_tty_lock = threading.Lock()
+
+
+def _tty_enabled(serial: Optional[str]) -> bool:
+    """当前是否尝试 /dev/tty 输出（停用期过后自动重新探测）"""
+    with _tty_lock:
+        return time.monotonic() >= _tty_disabled_until.get(serial, 0.0)
+
+
+def _record_tty_result(serial: Optional[str], ok: bool):
+    """记录一次 /dev/tty 输出的结果，连续失败达到上限后暂时停用"""
+    with _tty_lock:
+        if ok:
+            _tty_failures.pop(serial, None)
+            return
+        failures = _tty_failures.get(serial, 0) + 1
+        if failures >= TTY_FAILURE_LIMIT:
+            _tty_disabled_until[serial] = time.monotonic() + TTY_REPROBE_INTERVAL
+            failures = 0
+        _tty_failures[serial] = failures
+
+
+def _slice_hierarchy(raw: bytes) -> Optional[bytes]:
+    """从命令输出中截取XML部分（去掉 "UI hierchary dumped to" 等提示）"""
+    start = raw.find(b"<?xml")
+    if start < 0:
+        start = raw.find(b"<hierarchy")
+    end = raw.rfind(b"</hierarchy>")
+    if start < 0 or end < 0:
+        return None
+    return raw[start:end + len(b"</hierarchy>")]
+
+
+def dump_hierarchy(serial: Optional[str] = None, timeout: Optional[float] = None) -> Optional[bytes]:
+    """
+    捕获当前界面的UI层次结构
+
+    Args:
+        serial (Optional[str]): 设备序列号
+        timeout (Optional[float]): 超时时间（秒）
+
+    Returns:
+        Optional[bytes]: XML字节内容，失败返回None
+    """
+    if _tty_enabled(serial):
+        xml_data = _slice_hierarchy(
+            exec_out(["uiautomator", "dump", TTY_DUMP_TARGET], serial=serial, timeout=timeout)
+        )
+        _record_tty_result(serial, xml_data is not None)
+        if xml_data is not None:
+            return xml_data
+
+    # 每次使用独立的临时文件，并在同一条命令中读取和删除，避免并发请求互相覆盖
+    remote_path = f"{FALLBACK_DUMP_DIR}/simhoshino_{uuid.uuid4().hex}.xml"
+    command = (
+        f"uiautomator dump {remote_path} >/dev/null && cat {remote_path}; "
+        f"rm -f {remote_path}"
+    )
+    return _slice_hierarchy(exec_out(command, serial=serial, timeout=timeout))
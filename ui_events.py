@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+界面变化事件监听
+每台设备一个常驻的logcat流，匹配到聊天界面变化的日志时立即通知等待回复的请求，
+请求在变化之后马上捕获一次界面，而不是盲目地睡眠再dump；
+没有配置事件源或事件流断开时，等待会按原来的轮询间隔超时返回（轮询兜底）。
+
+说明：`uiautomator events` 与 `uiautomator dump` 共用同一个 UiAutomation 连接，
+两者同时运行时dump会失败，所以这里只使用logcat作为事件源
+"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from adb_client import get_client
+from adb_session import get_adb_path
+
+# logcat过滤表达式，例如 "ChatMessage:V *:S"；为空时不启用事件监听（默认不启用，
+# 应用没有固定的日志标签，需要按实际环境配置；未启用时 /health 中设备的 events 为 "off"）
+EVENT_LOGCAT_FILTER = os.environ.get("SIMHOSHINO_EVENT_LOGCAT", "").strip()
+
+# 只有匹配这个正则的日志行才算界面变化（为空时过滤后的每一行都算）
+EVENT_PATTERN = os.environ.get("SIMHOSHINO_EVENT_PATTERN", "")
+
+# 收到事件后再等待一小段时间，合并同一次变化产生的连续事件（秒）
+EVENT_DEBOUNCE = 0.1
+
+# 事件流断开后重新连接的间隔（秒）
+EVENT_RETRY_INTERVAL = 10.0
+
+
+class UIEventWatcher:
+    """单台设备的界面变化监听器"""
+
+    def __init__(self, serial: Optional[str] = None, logcat_filter: str = EVENT_LOGCAT_FILTER,
+                 pattern: str = EVENT_PATTERN):
+        """
+        Args:
+            serial (Optional[str]): 设备序列号
+            logcat_filter (str): logcat过滤表达式
+            pattern (str): 日志行匹配正则
+        """
+        self.serial = serial
+        self.logcat_filter = logcat_filter
+        self.pattern = re.compile(pattern.encode("utf-8")) if pattern else None
+        self.seq = 0
+        self.connected = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._close_stream = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def command(self) -> str:
+        # -T 取设备上的当前时间，只输出连接之后的日志（-T 1 会回放最后一行，连接时误触发一次通知）
+        return f"logcat -T \"$(date '+%m-%d %H:%M:%S').000\" -v brief {self.logcat_filter}"
+
+    def start(self):
+        """启动监听线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"ui-events-{self.serial or 'default'}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """停止监听"""
+        self._stop.set()
+        if self._close_stream is not None:
+            self._close_stream()
+
+    def _open_stream(self) -> Iterator[bytes]:
+        """打开事件流（优先原生协议，否则启动adb进程），逐行产出"""
+        try:
+            conn = get_client().device(self.serial).open_stream(self.command)
+        except ConnectionError:
+            args = [get_adb_path()]
+            if self.serial:
+                args += ["-s", self.serial]
+            proc = subprocess.Popen(
+                args + ["shell", self.command],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+            self._close_stream = proc.kill
+            try:
+                yield from iter(proc.stdout.readline, b"")
+            finally:
+                proc.kill()
+            return
+
+        self._close_stream = conn.close
+        stream = conn.sock.makefile("rb")
+        try:
+            yield from iter(stream.readline, b"")
+        finally:
+            stream.close()
+            conn.close()
+
+    def _run(self):
+        """监听线程：读取事件流，断开后隔一段时间重连"""
+        while not self._stop.is_set():
+            try:
+                for line in self._open_stream():
+                    if not self.connected:
+                        self.connected = True
+                        print(f"👂 设备 {self.serial or 'default'} 的界面事件监听已连接")
+                    if self.pattern is None or self.pattern.search(line):
+                        self.notify()
+            except Exception as e:
+                print(f"⚠️  界面事件流异常: {e}")
+            self.connected = False
+            self._stop.wait(EVENT_RETRY_INTERVAL)
+
+    def stats(self) -> dict:
+        """监听器状态"""
+        return {"connected": self.connected, "seq": self.seq}
+
+    def notify(self):
+        """记录一次界面变化并唤醒等待者"""
+        with self._cond:
+            self.seq += 1
+            self._cond.notify_all()
+
+    def wait_for_change(self, after_seq: int, timeout: float,
+                        cancelled: Optional[threading.Event] = None) -> bool:
+        """
+        等待序号 after_seq 之后的界面变化
+
+        Args:
+            after_seq (int): 上次读取界面前的事件序号
+            timeout (float): 最长等待时间（秒），事件流不可用时等满这段时间
+            cancelled (Optional[threading.Event]): 取消信号
+
+        Returns:
+            bool: 是否发生了变化（False表示超时或被取消）
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.seq == after_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancelled is not None and cancelled.is_set()):
+                    return False
+                # 分段等待以便及时响应取消
+                self._cond.wait(min(remaining, 0.2))
+
+        if cancelled is not None:
+            cancelled.wait(EVENT_DEBOUNCE)
+        else:
+            time.sleep(EVENT_DEBOUNCE)
+        return True
+
+
+_watchers: Dict[Optional[str], UIEventWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def get_event_watcher(serial: Optional[str] = None) -> Optional[UIEventWatcher]:
+    """
+    获取设备的界面变化监听器（首次调用时启动）
+
+    Args:
+        serial (Optional[str]): 设备序列号
+
+    Returns:
+        Optional[UIEventWatcher]: 监听器，未配置事件源时返回None
+    """
+    if not EVENT_LOGCAT_FILTER:
+        return None
+    with _watchers_lock:
+        watcher = _watchers.get(serial)
+        if watcher is None:
+            watcher = UIEventWatcher(serial)
+            watcher.start()
+            _watchers[serial] = watcher
+        return watcher
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI层次结构流式解析
+基于 iterparse 按文档顺序逐个产出文本节点，边解析边清理已处理的元素；
+查找到目标后立即停止，解析耗时和内存只取决于目标所在的位置
+"""
+
+import io
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from typing import Callable, Iterator, Optional, Tuple
+
+_BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+def parse_bounds(bounds: str) -> Optional[Tuple[int, int, int, int]]:
+    """
+    解析uiautomator的bounds属性
+
+    Args:
+        bounds (str): 形如 "[0,0][1080,1920]" 的字符串
+
+    Returns:
+        Optional[Tuple[int, int, int, int]]: (left, top, right, bottom)，无法解析时返回None
+    """
+    match = _BOUNDS_PATTERN.fullmatch(bounds.strip()) if bounds else None
+    if match is None:
+        return None
+    return tuple(int(value) for value in match.groups())
+
+
+def iter_texts(xml_data: bytes) -> Iterator[str]:
+    """
+    按文档顺序逐个产出非空的text属性
+
+    Args:
+        xml_data (bytes): UI层次结构XML
+
+    Yields:
+        str: 去除首尾空白后的文本
+    """
+    try:
+        for event, node in ET.iterparse(io.BytesIO(xml_data), events=("start", "end")):
+            if event == "start":
+                text = node.attrib.get("text", "").strip()
+                if text:
+                    yield text
+            else:
+                node.clear()
+    except ET.ParseError:
+        return
+
+
+def iter_matches(xml_data: bytes, predicate: Callable[[str], bool],
+                 window: int = 1) -> Iterator[Tuple[int, Optional[str], str]]:
+    """
+    流式查找满足条件的文本，只保留一个小的滑动窗口记录前面的文本
+
+    Args:
+        xml_data (bytes): UI层次结构XML
+        predicate (Callable[[str], bool]): 匹配条件
+        window (int): 保留的前文数量
+
+    Yields:
+        Tuple[int, Optional[str], str]: (文本序号, 前一句文本, 匹配的文本)
+    """
+    previous = deque(maxlen=window)
+    for index, text in enumerate(iter_texts(xml_data)):
+        if predicate(text):
+            yield index, (previous[-1] if previous else None), text
+        previous.append(text)
+
+
+def find_with_previous(xml_data: bytes, predicate: Callable[[str], bool],
+                       require_previous: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """
+    查找第一个满足条件的文本及其前一句，找到后立即停止解析
+
+    Args:
+        xml_data (bytes): UI层次结构XML
+        predicate (Callable[[str], bool]): 匹配条件
+        require_previous (bool): 是否跳过没有前一句的匹配
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: (前一句文本, 匹配的文本)
+    """
+    for index, previous, text in iter_matches(xml_data, predicate):
+        if require_previous and previous is None:
+            continue
+        return previous, text
+    return None, None
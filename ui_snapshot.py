@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI快照
+一次捕获的层次结构及其解析结果（文本列表、节点索引）和捕获时间，
+同一个请求内的多次查询共用一份快照，不再重复dump；
+屏幕指纹没有变化时直接复用同一设备的上一份快照
+"""
+
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional, Tuple
+
+from screen_probe import screen_fingerprint
+from ui_backend import get_backend
+from ui_parser import find_with_previous, parse_bounds
+
+# 是否在dump前先探测屏幕是否变化
+SCREEN_PROBE_ENABLED = True
+
+# 智能体聊天界面的标记文本前缀（后面是智能体名称）
+AGENT_MARKER_PREFIX = "发送消息给"
+
+# 每台设备最近一次捕获的快照（用于屏幕未变化时复用）
+_last_snapshots: Dict[Optional[str], "UISnapshot"] = {}
+_last_snapshots_lock = threading.Lock()
+
+
+class UISnapshot:
+    """一次UI捕获的快照（创建后不再修改，可以在线程之间共享）"""
+
+    def __init__(self, xml_data: bytes, captured_at: Optional[float] = None,
+                 fingerprint: Optional[str] = None):
+        """
+        初始化快照（文本列表和节点索引在第一次使用时才完整解析）
+
+        Args:
+            xml_data (bytes): UI层次结构XML
+            captured_at (Optional[float]): 捕获时间（time.monotonic），默认为当前时间
+            fingerprint (Optional[str]): 捕获前的屏幕指纹
+        """
+        self.xml_data = xml_data
+        self.captured_at = time.monotonic() if captured_at is None else captured_at
+        self.captured_time = time.time()
+        self.fingerprint = fingerprint
+        self.reused = 0
+        self._texts: Optional[List[str]] = None
+        self._nodes: Optional[List[Dict]] = None
+        self._agents: Optional[Dict[str, Optional[str]]] = None
+
+    @classmethod
+    def capture(cls, serial: Optional[str] = None, probe: bool = SCREEN_PROBE_ENABLED) -> Optional["UISnapshot"]:
+        """
+        捕获当前界面并生成快照；屏幕指纹与上一份快照相同时直接复用上一份快照
+
+        Args:
+            serial (Optional[str]): 设备序列号
+            probe (bool): 是否先探测屏幕变化
+
+        Returns:
+            Optional[UISnapshot]: 快照，捕获失败返回None
+        """
+        fingerprint = screen_fingerprint(serial) if probe else None
+        if fingerprint is not None:
+            with _last_snapshots_lock:
+                last = _last_snapshots.get(serial)
+            if last is not None and last.fingerprint == fingerprint:
+                snapshot = last.refreshed()
+                with _last_snapshots_lock:
+                    _last_snapshots[serial] = snapshot
+                return snapshot
+
+        # 指纹在dump之前获取：dump期间界面再变化，下次探测会发现不一致并重新dump
+        try:
+            xml_data = get_backend(serial).dump_hierarchy()
+        except Exception:
+            return None
+        if not xml_data:
+            return None
+        snapshot = cls(xml_data, fingerprint=fingerprint)
+        with _last_snapshots_lock:
+            _last_snapshots[serial] = snapshot
+        return snapshot
+
+    def refreshed(self) -> "UISnapshot":
+        """
+        界面未变化时生成一份捕获时间为当前的新快照，与本快照共用XML和解析结果，
+        不修改可能正被其他线程使用的本快照
+
+        Returns:
+            UISnapshot: 新快照
+        """
+        snapshot = type(self)(self.xml_data, fingerprint=self.fingerprint)
+        snapshot._texts = self.texts
+        snapshot._nodes = self.nodes
+        snapshot._agents = self._agents
+        snapshot.reused = self.reused + 1
+        return snapshot
+
+    @property
+    def age(self) -> float:
+        """快照已存在的时间（秒）"""
+        return time.monotonic() - self.captured_at
+
+    def is_fresh(self, max_age: float) -> bool:
+        """快照是否在允许的时间范围内"""
+        return self.age <= max_age
+
+    def _parse(self):
+        """完整解析一次，同时建立文本列表和节点索引"""
+        texts = []
+        nodes = []
+        try:
+            root = ET.fromstring(self.xml_data)
+            for node in root.iter("node"):
+                text = node.attrib.get("text", "").strip()
+                nodes.append({
+                    "index": len(nodes),
+                    "text": text,
+                    "text_index": len(texts) if text else None,
+                    "resource_id": node.attrib.get("resource-id", ""),
+                    "class": node.attrib.get("class", ""),
+                    "content_desc": node.attrib.get("content-desc", ""),
+                    "clickable": node.attrib.get("clickable") == "true",
+                    "scrollable": node.attrib.get("scrollable") == "true",
+                    "bounds": parse_bounds(node.attrib.get("bounds", ""))
+                })
+                if text:
+                    texts.append(text)
+        except ET.ParseError:
+            pass
+        self._texts = texts
+        self._nodes = nodes
+
+    @property
+    def texts(self) -> List[str]:
+        """所有非空文本（文档顺序）"""
+        if self._texts is None:
+            self._parse()
+        return self._texts
+
+    @property
+    def nodes(self) -> List[Dict]:
+        """所有节点的索引信息"""
+        if self._nodes is None:
+            self._parse()
+        return self._nodes
+
+    def find_with_previous(self, predicate: Callable[[str], bool],
+                           require_previous: bool = False) -> Tuple[Optional[str], Optional[str]]:
+        """
+        查找第一个满足条件的文本及其前一句
+        已完整解析时直接扫描文本列表，否则流式解析并在找到后停止
+
+        Args:
+            predicate (Callable[[str], bool]): 匹配条件
+            require_previous (bool): 是否跳过没有前一句的匹配
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: (前一句文本, 匹配的文本)
+        """
+        if self._texts is None:
+            return find_with_previous(self.xml_data, predicate, require_previous)
+
+        for i, text in enumerate(self._texts):
+            if predicate(text):
+                previous = self._texts[i - 1] if i > 0 else None
+                if require_previous and previous is None:
+                    continue
+                return previous, text
+        return None, None
+
+    def at_messages(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        提取第一个包含@符号的文本及其前一个文本
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: (previous_message, at_message)
+        """
+        return self.find_with_previous(lambda text: "@" in text)
+
+    def agent_index(self) -> Dict[str, Optional[str]]:
+        """
+        一次扫描建立快照中所有智能体标记的索引（"发送消息给<名称>" → 它的前一句）
+
+        Returns:
+            Dict[str, Optional[str]]: 智能体名称 → 上一句消息（同名多次出现时取第一次）
+        """
+        if self._agents is None:
+            agents: Dict[str, Optional[str]] = {}
+            texts = self.texts
+            for i, text in enumerate(texts):
+                start = text.find(AGENT_MARKER_PREFIX)
+                if start < 0:
+                    continue
+                name = text[start + len(AGENT_MARKER_PREFIX):].strip()
+                if name and name not in agents:
+                    agents[name] = texts[i - 1] if i > 0 else None
+            self._agents = agents
+        return self._agents
+
+    def agent_previous_message(self, agent_name: str) -> Optional[str]:
+        """
+        获取指定智能体的上一句消息
+
+        Args:
+            agent_name (str): 智能体名称
+
+        Returns:
+            Optional[str]: 上一句消息内容
+        """
+        target_pattern = f"{AGENT_MARKER_PREFIX}{agent_name}"
+        previous, _ = self.find_with_previous(
+            lambda text: target_pattern in text, require_previous=True
+        )
+        return previous
+
+    def analyze(self) -> dict:
+        """
+        分析UI结构，返回详细信息
+
+        Returns:
+            dict: UI分析结果
+        """
+        texts = self.texts
+        at_messages = []
+        agent_messages = []
+
+        for i, text in enumerate(texts):
+            if "@" in text:
+                at_messages.append({
+                    "index": i,
+                    "text": text,
+                    "previous": texts[i-1] if i > 0 else None
+                })
+
+            if AGENT_MARKER_PREFIX in text:
+                agent_messages.append({
+                    "index": i,
+                    "text": text,
+                    "previous": texts[i-1] if i > 0 else None
+                })
+
+        return {
+            "total_texts": len(texts),
+            "all_texts": texts,
+            "at_messages": at_messages,
+            "agent_messages": agent_messages,
+            "file_size": len(self.xml_data),
+            "snapshot_age": round(self.age, 3)
+        }
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备工作队列
+每台设备一个有界队列和一个工作线程，同一时间只执行一轮对话，
+避免并发请求在同一块屏幕上交错点击、输入和dump；队列满时立即拒绝
+"""
+
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+# 每台设备最多排队的请求数（不含正在执行的）
+QUEUE_DEPTH = 4
+
+# 请求在队列中最多等待的时间（秒），超时后不再执行
+QUEUE_WAIT_TIMEOUT = 30.0
+
+# 还没有历史数据时估算的单轮对话耗时（秒）
+DEFAULT_TURN_SECONDS = 10.0
+
+# 停止队列时最多等待正在执行的任务结束的时间（秒）
+STOP_TIMEOUT = 30.0
+
+# 耗时滑动平均的权重
+_EWMA_ALPHA = 0.3
+
+
+class QueueFullError(Exception):
+    """队列已满，请求被拒绝"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"设备队列已满，请在 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class QueueTimeoutError(Exception):
+    """请求在队列中等待超时"""
+
+    def __init__(self, waited: float, retry_after: int):
+        super().__init__(f"排队等待 {waited:.1f} 秒后超时")
+        self.waited = waited
+        self.retry_after = retry_after
+
+
+class WorkItem:
+    """队列中的一个任务"""
+
+    def __init__(self, fn: Callable[[Any], Any]):
+        """
+        Args:
+            fn (Callable[[Any], Any]): 任务函数，参数为设备的工作对象（MessageServer）
+        """
+        self.fn = fn
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self._dequeued = threading.Event()
+        self._state_lock = threading.Lock()
+        self._callbacks: List[Callable[["WorkItem"], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def wait_time(self) -> float:
+        """在队列中等待的时间（秒）"""
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    def cancel(self) -> bool:
+        """
+        取消任务（尚未开始的任务不再执行）
+
+        Returns:
+            bool: 任务是否在开始执行之前被取消
+        """
+        with self._state_lock:
+            self.cancelled.set()
+            return self.started_at is None
+
+    def start(self) -> bool:
+        """
+        标记任务开始执行（由执行任务的一方调用）
+
+        Returns:
+            bool: 是否可以执行，已取消的任务返回False
+        """
+        with self._state_lock:
+            if self.cancelled.is_set():
+                return False
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+        self._dequeued.set()
+        return True
+
+    def wait_dequeued(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待任务离开队列（开始执行或已结束）
+
+        Args:
+            timeout (Optional[float]): 最长等待时间（秒）
+
+        Returns:
+            bool: 是否在时限内离开队列
+        """
+        return self._dequeued.wait(timeout)
+
+    def add_done_callback(self, callback: Callable[["WorkItem"], None]):
+        """
+        任务结束时调用回调（在设备工作线程上调用；已结束时立即调用）
+
+        Args:
+            callback (Callable[[WorkItem], None]): 回调函数，参数为任务对象
+        """
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        """标记任务结束并通知等待者"""
+        self._dequeued.set()
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"⚠️  任务回调异常: {e}")
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """
+        等待任务结束并返回结果
+
+        Args:
+            timeout (Optional[float]): 最长等待时间（秒）
+
+        Returns:
+            Any: 任务函数的返回值
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError("等待任务结果超时")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class DeviceWorkQueue:
+    """单台设备的串行工作队列"""
+
+    def __init__(self, name: str, worker_target: Any, depth: int = QUEUE_DEPTH,
+                 wait_timeout: float = QUEUE_WAIT_TIMEOUT):
+        """
+        Args:
+            name (str): 设备名称（用于线程名和统计）
+            worker_target (Any): 传给任务函数的设备工作对象
+            depth (int): 队列深度
+            wait_timeout (float): 排队超时时间（秒）
+        """
+        self.name = name
+        self.worker_target = worker_target
+        self.depth = depth
+        self.wait_timeout = wait_timeout
+        self.current: Optional[WorkItem] = None
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.avg_wait = 0.0
+        self.last_wait = 0.0
+        self.avg_turn = DEFAULT_TURN_SECONDS
+        self._queue: "queue.Queue[Optional[WorkItem]]" = queue.Queue(maxsize=depth)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run,
+            name=f"device-worker-{name}",
+            daemon=True
+        )
+        self._worker.start()
+
+    @property
+    def pending(self) -> int:
+        """排队中的任务数"""
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None
+
+    @property
+    def load(self) -> int:
+        """排队和执行中的任务总数"""
+        return self.pending + (1 if self.busy else 0)
+
+    def estimate_wait(self) -> float:
+        """估算新任务开始执行前需要等待的时间（秒）"""
+        return self.load * self.avg_turn
+
+    def retry_after(self) -> int:
+        """建议客户端重试前等待的秒数（大约是队列空出一个位置的时间）"""
+        return max(1, math.ceil(self.avg_turn))
+
+    def submit(self, fn: Callable[[Any], Any]) -> WorkItem:
+        """
+        提交任务，队列已满时立即拒绝
+
+        Args:
+            fn (Callable[[Any], Any]): 任务函数
+
+        Returns:
+            WorkItem: 任务对象
+        """
+        if self._stopping.is_set():
+            raise QueueFullError(self.retry_after())
+        item = WorkItem(fn)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(self.retry_after())
+        return item
+
+    def drain(self) -> List[WorkItem]:
+        """
+        取出所有尚未开始的任务（设备被替换时转交给新设备）
+
+        Returns:
+            List[WorkItem]: 排队中的任务
+        """
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not None:
+                items.append(item)
+
+    def adopt(self, items: List[WorkItem]):
+        """
+        接收其他队列转交的任务（保留原来的入队时间），放不下的任务以队列已满结束
+
+        Args:
+            items (List[WorkItem]): 任务列表
+        """
+        for item in items:
+            if self._stopping.is_set():
+                self._reject(item)
+                continue
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._reject(item)
+
+    def cancel_current(self):
+        """向正在执行的任务发出取消信号（任务函数有 cancel 方法时一并调用，如 ChatTurn）"""
+        item = self.current
+        if item is None:
+            return
+        item.cancel()
+        cancel = getattr(item.fn, "cancel", None)
+        if callable(cancel):
+            cancel()
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> bool:
+        """
+        停止队列：不再接收任务，取消正在执行的任务并等待工作线程退出，
+        还在排队的任务以队列已满结束（需要转交的任务应先用 drain 取出）
+
+        Args:
+            timeout (float): 最长等待时间（秒）
+
+        Returns:
+            bool: 工作线程是否已退出
+        """
+        self._stopping.set()
+        self.cancel_current()
+        try:
+            # 唤醒空闲的工作线程；队列满说明工作线程正忙，执行完当前任务后会发现已停止
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _run(self):
+        """工作线程：逐个执行任务，停止后结束剩余的任务并退出"""
+        while not self._stopping.is_set():
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._stopping.is_set():
+                # 停止期间取出的任务不再执行
+                self._reject(item)
+                break
+            waited = item.wait_time
+            if waited > self.wait_timeout and not item.cancelled.is_set():
+                with self._lock:
+                    self.expired += 1
+                item.error = QueueTimeoutError(waited, self.retry_after())
+                item.finish()
+                continue
+
+            if not item.start():
+                item.finish()
+                continue
+            self.current = item
+            try:
+                item.result = item.fn(self.worker_target)
+            except BaseException as e:
+                item.error = e
+            finally:
+                item.finished_at = time.monotonic()
+                self.current = None
+                with self._lock:
+                    self.completed += 1
+                    self.last_wait = waited
+                    self.avg_wait += _EWMA_ALPHA * (waited - self.avg_wait)
+                    duration = item.finished_at - item.started_at
+                    self.avg_turn += _EWMA_ALPHA * (duration - self.avg_turn)
+                item.finish()
+
+        # 停止后还留在队列中的任务以队列已满结束，客户端可以重试
+        for item in self.drain():
+            self._reject(item)
+
+    def _reject(self, item: WorkItem):
+        """以队列已满结束任务"""
+        item.error = QueueFullError(self.retry_after())
+        item.finish()
+
+    def stats(self) -> dict:
+        """队列统计信息"""
+        with self._lock:
+            return {
+                "queue_depth": self.pending,
+                "queue_capacity": self.depth,
+                "busy": self.busy,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "avg_wait_seconds": round(self.avg_wait, 3),
+                "last_wait_seconds": round(self.last_wait, 3),
+                "avg_turn_seconds": round(self.avg_turn, 3)
+            }